@@ -0,0 +1,107 @@
+"""
+Чекпоинты инкрементального майнинга: по одному JSON на источник в STATE_DIR/checkpoints.
+Повторный запуск майнит только сообщения новее last_message_id (плюс хвост старых для склейки тредов).
+"""
+import os
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from pydantic import BaseModel, Field
+
+from schemas.graph import ProjectMemory
+
+logger = logging.getLogger(__name__)
+
+STATE_DIR = os.getenv("STATE_DIR", "state")
+# INCREMENTAL=0 — полный перемайнинг: чекпоинты и сохранённый граф игнорируются и перезаписываются
+INCREMENTAL = os.getenv("INCREMENTAL", "1") not in ("0", "false", "False", "")
+# Сколько уже обработанных сообщений подмешиваем перед новыми, чтобы треды переподцепились
+INCREMENTAL_OVERLAP_MESSAGES = int(os.getenv("INCREMENTAL_OVERLAP_MESSAGES", "20"))
+
+
+class SourceCheckpoint(BaseModel):
+    source_name: str
+    last_message_id: Optional[int] = Field(default=None, description="Максимальный обработанный id сообщения")
+    # Нецелые id не упорядочены, поэтому обработанные запоминаются поимённо
+    seen_ids: Set[str] = Field(default_factory=set, description="Обработанные нецелые id сообщений")
+    # GlossaryItem.model_dump() — сам класс живёт в extractor
+    glossary: List[Dict[str, Any]] = Field(default_factory=list)
+    project_memory: ProjectMemory = Field(default_factory=ProjectMemory)
+
+
+def _checkpoint_path(state_dir: str, source_name: str) -> str:
+    safe_name = source_name.replace(":", "_").replace("/", "_")
+    return os.path.join(state_dir, "checkpoints", f"{safe_name}.json")
+
+
+def load_checkpoint(state_dir: str, source_name: str) -> Optional[SourceCheckpoint]:
+    path = _checkpoint_path(state_dir, source_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return SourceCheckpoint.model_validate_json(f.read())
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Чекпоинт {path} не прочитан ({e}), источник будет обработан целиком")
+        return None
+
+
+def save_checkpoint(state_dir: str, checkpoint: SourceCheckpoint):
+    """Атомарная запись: сначала во временный файл, затем os.replace."""
+    path = _checkpoint_path(state_dir, checkpoint.source_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(checkpoint.model_dump_json(indent=2))
+    os.replace(tmp_path, path)
+
+
+def _has_history(checkpoint: Optional[SourceCheckpoint]) -> bool:
+    return checkpoint is not None and (checkpoint.last_message_id is not None or bool(checkpoint.seen_ids))
+
+
+def is_new_message(msg: dict, checkpoint: Optional[SourceCheckpoint]) -> bool:
+    """
+    Целые id сравниваются с last_message_id, прочие ищутся в seen_ids.
+    Сообщение без id новое только для источника без истории: отличить его от уже обработанного нечем.
+    """
+    if msg.get("type") != "message":
+        return False
+    if not _has_history(checkpoint):
+        return True
+    msg_id = msg.get("id")
+    if isinstance(msg_id, int):
+        return checkpoint.last_message_id is None or msg_id > checkpoint.last_message_id
+    if msg_id is None:
+        return False
+    return str(msg_id) not in checkpoint.seen_ids
+
+
+def mark_processed(checkpoint: SourceCheckpoint, messages: Iterable[dict]):
+    """Сдвигает last_message_id и дополняет seen_ids обработанными сообщениями."""
+    for msg in messages:
+        msg_id = msg.get("id")
+        if msg.get("type") != "message" or msg_id is None:
+            continue
+        if isinstance(msg_id, int):
+            checkpoint.last_message_id = max(msg_id, checkpoint.last_message_id or msg_id)
+        else:
+            checkpoint.seen_ids.add(str(msg_id))
+
+
+def select_incremental(
+        messages: List[dict],
+        checkpoint: Optional[SourceCheckpoint],
+        overlap: int = INCREMENTAL_OVERLAP_MESSAGES,
+) -> List[dict]:
+    """
+    Новые сообщения + до overlap последних уже обработанных перед первым новым.
+    Если новых нет — пустой список.
+    """
+    if not _has_history(checkpoint):
+        return messages
+    first_new = next((i for i, m in enumerate(messages) if is_new_message(m, checkpoint)), None)
+    if first_new is None:
+        return []
+    tail = [m for m in messages[:first_new] if m.get("type") == "message"][-overlap:] if overlap > 0 else []
+    return tail + [m for m in messages[first_new:] if is_new_message(m, checkpoint)]
@@ -1,21 +1,46 @@
+import os
+import copy
 import logging
 import asyncio
-from typing import List, Dict, Set
+from typing import List, Dict, Optional, Tuple
 from pydantic import BaseModel, Field
 
 from schemas.document import DataSource
-from schemas.enums import NodeLabel
+from schemas.enums import NodeLabel, ExtractionMode
 from schemas.graph import (
     ExtractedKnowledge, ProjectMemory, RawEntitiesSchema,
-    MergeDecision, FixListSchema, GraphNode, GraphEdge, RawEntity
+    MergeDecision, GraphNode, GraphEdge, RawEntity,
+    EntityLinkBatch, EntityLinkDecision, FastExtraction,
 )
-from utils.preprocessing import format_chat_message, enrich_message_with_vote
+from utils.preprocessing import format_chat_message, VoteClassifier
+from utils.chat_stream import ReplyIndex, iter_time_chunks
 from utils.llm_client import acall_llm_json
+from utils.embeddings import aget_embeddings_safe
+from utils.vector_index import VectorIndex, normalize_rows
 from utils.state_logger import log_pydantic, log_dict
 from .windowing import asplit_chat_into_semantic_threads
+from .validator import validate_subgraph
+from .checkpoint import (
+    SourceCheckpoint, load_checkpoint, save_checkpoint, is_new_message, mark_processed, select_incremental,
+)
 
 logger = logging.getLogger(__name__)
 
+# Сколько сущностей окна линкуется одним structured-вызовом
+ENTITY_LINK_BATCH_SIZE = 25
+# Сколько ближайших записей глоссария показываем LLM и с какого сходства они считаются кандидатами
+GLOSSARY_TOP_K = 8
+GLOSSARY_LINK_THRESHOLD = 0.65
+# Новые сущности одного окна с той же label и сходством не ниже порога считаются одной записью
+WINDOW_ENTITY_DEDUP_THRESHOLD = 0.9
+# Быстрый режим: сколько записей глоссария, ближайших к тексту окна, показываем в единственном вызове
+FAST_GLOSSARY_TOP_K = 30
+# Сколько окон источника извлекается одновременно (одна «волна»); 1 — строго последовательно
+MINER_WINDOW_CONCURRENCY = int(os.getenv("MINER_WINDOW_CONCURRENCY", "1"))
+
+# Новые сущности окна, найденные в волне: id → (сущность, эмбеддинг); в глоссарий — после волны
+StagedEntities = Dict[str, Tuple[RawEntity, List[float]]]
+
 
 class GlossaryItem(BaseModel):
     id: str = Field(description="Snake_case ID")
@@ -27,159 +52,581 @@ class GlossaryItem(BaseModel):
 class ProjectGlossary(BaseModel):
     entities: List[GlossaryItem] = Field(default_factory=list)
 
-# ─────────────────────────────────────────────
-# ВАЛИДАЦИЯ (без изменений)
-# ─────────────────────────────────────────────
-def validate_graph_integrity(graph: ExtractedKnowledge, valid_ids: Set[str]) -> ExtractedKnowledge:
-    """
-    Удаляет:
-    - Узлы, ID которых нет в глоссарии (призраки от LLM).
-    - Рёбра, у которых source или target не существует среди узлов.
-    - Петли (self-loop: source == target).
-    """
-    original_node_count = len(graph.nodes)
-    original_edge_count = len(graph.edges)
-
-    graph.nodes = [n for n in graph.nodes if n.id in valid_ids]
-    present_ids = {n.id for n in graph.nodes}
-
-    if original_node_count > len(graph.nodes):
-        logger.warning(
-            f"⚠️ Валидация: удалено {original_node_count - len(graph.nodes)} "
-            f"призрачных узлов (не из глоссария)"
-        )
-
-    graph.edges = [
-        e for e in graph.edges
-        if e.source in present_ids
-        and e.target in present_ids
-        and e.source != e.target
-    ]
-
-    if original_edge_count > len(graph.edges):
-        logger.warning(
-            f"⚠️ Валидация: удалено {original_edge_count - len(graph.edges)} невалидных рёбер"
-        )
-
-    return graph
-
 # ─────────────────────────────────────────────
 # ОСНОВНОЙ ПРОЦЕССОР (ПОЛНОСТЬЮ ПЕРЕПИСАН)
 # ─────────────────────────────────────────────
 class MinerProcessor:
-    def __init__(self):
+    def __init__(
+            self,
+            link_mode: str = "batch",
+            state_dir: Optional[str] = None,
+            window_concurrency: int = MINER_WINDOW_CONCURRENCY,
+            subgraph_queue: Optional[asyncio.Queue] = None,
+    ):
+        """
+        link_mode:
+        - "batch"  — все сущности окна линкуются одним (или несколькими) вызовами;
+        - "single" — по одному LLM вызову на сущность (старое поведение).
+        state_dir — каталог чекпоинтов чатов; None — каждый запуск майнит источник целиком.
+        window_concurrency — размер волны окон, извлекаемых параллельно по снимку глоссария.
+        subgraph_queue — каждый готовый подграф сразу кладётся сюда (online-слияние во время майнинга).
+        """
         self.global_glossary_dict: Dict[str, GlossaryItem] = {}
         self.project_memory = ProjectMemory()
-
-    def _format_glossary(self) -> str:
-        return "\n".join([f"- {e.id} ({e.label.value}): {e.name}" for e in self.global_glossary_dict.values()])
+        self.link_mode = link_mode
+        self.state_dir = state_dir
+        self.window_concurrency = max(1, window_concurrency)
+        self.subgraph_queue = subgraph_queue
+        # Нормализованные эмбеддинги записей глоссария, обновляются при каждой вставке
+        self.glossary_index = VectorIndex()
+        # Чекпоинты источников ждут сохранения графа: commit_checkpoints() после merger.save_graph
+        self.pending_checkpoints: List[SourceCheckpoint] = []
+        # Алиасы записей глоссария old → new после merge_source_glossaries
+        self.glossary_aliases: Dict[str, str] = {}
+        # Чекпоинт источника, который майнит этот процессор (см. for_source)
+        self.source_checkpoint: Optional[SourceCheckpoint] = None
+
+    def for_source(self) -> "MinerProcessor":
+        """
+        Процессор для одного источника при параллельном майнинге: свой снимок глоссария
+        (словарь и векторный индекс копируются) и своя память проекта, так что параллельные
+        источники не видят вставок друг друга. Новые записи возвращаются в общий глоссарий
+        через merge_source_glossaries — в порядке источников, а не завершения.
+        Список pending_checkpoints общий: чекпоинты всех источников коммитит один вызов commit_checkpoints.
+        """
+        source_miner = copy.copy(self)
+        source_miner.global_glossary_dict = dict(self.global_glossary_dict)
+        source_miner.glossary_index = self.glossary_index.copy()
+        source_miner.project_memory = ProjectMemory()
+        source_miner.pending_checkpoints = self.pending_checkpoints
+        source_miner.source_checkpoint = None
+        return source_miner
+
+    def merge_source_glossaries(self, source_miners: List["MinerProcessor"]) -> Dict[str, str]:
+        """
+        Вливает глоссарии источников в общий в порядке списка (при совпадении ID остаётся первая запись).
+        Новая запись источника, которая совпадает по label и эмбеддингу (>= WINDOW_ENTITY_DEDUP_THRESHOLD)
+        с записью, внесённой более ранним источником этого майнинга, сводится к ней — как сущности окон
+        в волне (_extract_wave). Записи, бывшие в глоссарии до майнинга, не сравниваются: их источник
+        уже видел при линковке. Возвращает алиасы old → new для переписывания подграфов.
+        """
+        aliases: Dict[str, str] = {}
+        fold_new: List[Tuple[str, NodeLabel, object]] = []
+        for source_miner in source_miners:
+            source_aliases: Dict[str, str] = {}
+            for gid, item in source_miner.global_glossary_dict.items():
+                if gid in self.global_glossary_dict:
+                    continue
+                if gid in aliases:
+                    source_aliases[gid] = aliases[gid]  # тот же ID уже сведён у более раннего источника
+                    continue
+                row = source_miner.glossary_index.get(gid)
+                target = next((
+                    other_id for other_id, label, other in fold_new
+                    if label == item.label and float(row @ other) >= WINDOW_ENTITY_DEDUP_THRESHOLD
+                ), None)
+                if target is not None:
+                    aliases[gid] = source_aliases[gid] = target
+                    continue
+                self.global_glossary_dict[gid] = item
+                self.glossary_index.add([gid], [row])
+                fold_new.append((gid, item.label, row))
+            if source_aliases and source_miner.source_checkpoint is not None:
+                self._alias_checkpoint_glossary(source_miner.source_checkpoint, source_aliases)
+
+        if aliases:
+            logger.info(f"🔗 Глоссарии источников: {len(aliases)} записей сведено к записям других источников")
+        glossary_dump = {k: v.model_dump() for k, v in self.global_glossary_dict.items()}
+        log_dict("layer1_global_glossary.json", glossary_dump)
+        return aliases
+
+    def _alias_checkpoint_glossary(self, checkpoint: SourceCheckpoint, aliases: Dict[str, str]):
+        """В чекпоинт источника вместо сведённых записей попадают те, к которым они сведены."""
+        items = {item["id"]: item for item in checkpoint.glossary if item.get("id") not in aliases}
+        for target in aliases.values():
+            items.setdefault(target, self.global_glossary_dict[target].model_dump())
+        checkpoint.glossary = list(items.values())
+
+    def _emit(self, extracted_graphs: List[ExtractedKnowledge], graph: ExtractedKnowledge):
+        extracted_graphs.append(graph)
+        if self.subgraph_queue is not None:
+            self.subgraph_queue.put_nowait(graph)
+
+    def _format_glossary(self, staged: Optional[StagedEntities] = None) -> str:
+        lines = [f"- {e.id} ({e.label.value}): {e.name}" for e in self.global_glossary_dict.values()]
+        if staged:
+            lines += [f"- {new_id} ({raw.label.value}): {raw.name}" for new_id, (raw, _) in staged.items()]
+        return "\n".join(lines)
 
     async def process_source(self, source: DataSource) -> List[ExtractedKnowledge]:
         logger.info(f"⛏️ СЛОЙ 1: Начинаем извлечение из {source.file_name}")
         extracted_graphs = []
+        checkpoint = None
+        # Голоса классифицируются один раз на сообщение источника, даже если оно попало в несколько окон
+        vote_classifier = VoteClassifier()
+        if source.source_type in ("chat", "telegram_export"):
+            checkpoint = await self._open_checkpoint(source.file_name)
+
+        mode = source.extraction_mode
+        if mode == ExtractionMode.FAST:
+            logger.info("  ⚡ Быстрый режим: один вызов на окно, без обновления памяти")
+
         if source.source_type == "chat":
-            windows = await asplit_chat_into_semantic_threads(source.content)
+            messages = select_incremental(source.content, checkpoint)
+            windows = await asplit_chat_into_semantic_threads(messages)
             msg_lookup = {m["id"]: m for m in source.content if m.get("type") == "message"}
 
             logger.info(f"  -> Найдено {len(windows)} смысловых окон. Начинаем обработку...")
-
-            for i, (ref, msgs) in enumerate(windows):
-                enriched_msgs = [enrich_message_with_vote(m.copy()) for m in msgs]
-                text_chunk = "\n".join([format_chat_message(m, msg_lookup) for m in enriched_msgs])
-
-                logger.info(f"  -> [{i+1}/{len(windows)}] Анализ окна {ref} ({len(msgs)} сообщений)")
-                graph = await self._extract_subgraph_3pass(text_chunk, ref)
-                extracted_graphs.append(graph)
-                safe_ref = ref.replace(":", "_").replace("/", "_")
-                log_pydantic(f"layer1_subgraph_{source.file_name}_{safe_ref}.json", graph)
+            extracted_graphs += await self._process_chat_windows(
+                windows, msg_lookup, source.file_name, checkpoint, vote_classifier, mode
+            )
+        elif source.source_type == "telegram_export":
+            # Экспорт читается с диска чанками по времени; в памяти только текущий чанк
+            reply_index = ReplyIndex()
+            try:
+                for chunk_idx, messages in enumerate(iter_time_chunks(source.content, reply_index)):
+                    messages = select_incremental(messages, checkpoint)
+                    if not messages:
+                        continue
+                    windows = await asplit_chat_into_semantic_threads(messages)
+                    windows = [(f"chunk_{chunk_idx}_{ref}", msgs) for ref, msgs in windows]
+                    logger.info(
+                        f"  -> Чанк {chunk_idx}: {len(messages)} сообщений, {len(windows)} смысловых окон"
+                    )
+                    extracted_graphs += await self._process_chat_windows(
+                        windows, reply_index, source.file_name, checkpoint, vote_classifier, mode
+                    )
+            finally:
+                reply_index.close()
         else:
             # Обработка обычного текста (не чат)
             try:
-                graph = await self._extract_subgraph_3pass(str(source.content), source.file_name)
-                extracted_graphs.append(graph)
+                graph = await self._extract_window(str(source.content), source.file_name, mode)
+                self._emit(extracted_graphs, graph)
 
                 safe_ref = source.file_name.replace(":", "_").replace("/", "_")
                 log_pydantic(f"layer1_subgraph_{safe_ref}.json", graph)
             except Exception as e:
                 logger.error(f"❌ Ошибка обработки документа {source.file_name}: {e}")
 
-        # Сохраняем глобальный глоссарий
-        glossary_dump = {k: v.model_dump() for k, v in self.global_glossary_dict.items()}
-        log_dict("layer1_global_glossary.json", glossary_dump)
+        if checkpoint is not None:
+            checkpoint.glossary = [item.model_dump() for item in self.global_glossary_dict.values()]
+            checkpoint.project_memory = self.project_memory
+            self.pending_checkpoints.append(checkpoint)
+            self.source_checkpoint = checkpoint
 
         return extracted_graphs
 
-    async def _link_entity_to_glossary(self, raw: RawEntity) -> str:
-        """Шаг 2: Entity Linking"""
-        if not self.global_glossary_dict:
-            new_id = raw.name.lower().replace(" ", "_").replace("-", "_")
+    def commit_checkpoints(self):
+        """
+        Записывает чекпоинты источников. Вызывать только после сохранения графа:
+        иначе при сбое слияния следующий запуск пропустит сообщения, которых нет в графе.
+        """
+        for checkpoint in self.pending_checkpoints:
+            save_checkpoint(self.state_dir, checkpoint)
+            logger.info(f"💾 Чекпоинт {checkpoint.source_name}: last_message_id={checkpoint.last_message_id}")
+        self.pending_checkpoints = []
+
+    async def _open_checkpoint(self, source_name: str) -> Optional[SourceCheckpoint]:
+        """Загружает чекпоинт источника и восстанавливает из него глоссарий (с индексом) и память."""
+        if self.state_dir is None:
+            return None
+        checkpoint = load_checkpoint(self.state_dir, source_name)
+        if checkpoint is None:
+            return SourceCheckpoint(source_name=source_name)
+
+        restored = [
+            GlossaryItem.model_validate(item) for item in checkpoint.glossary
+            if item.get("id") not in self.global_glossary_dict
+        ]
+        if restored:
+            vectors = await aget_embeddings_safe(
+                [self._entity_text(item.name, item.description) for item in restored],
+                call_site="miner.restore_glossary",
+            )
+            for item in restored:
+                self.global_glossary_dict[item.id] = item
+            self.glossary_index.add([item.id for item in restored], vectors)
+        self.project_memory = checkpoint.project_memory
+        logger.info(
+            f"  ♻️ Чекпоинт {source_name}: last_message_id={checkpoint.last_message_id}, "
+            f"восстановлено {len(restored)} записей глоссария"
+        )
+        return checkpoint
+
+    async def _process_chat_windows(
+            self,
+            windows: List[Tuple[str, List[dict]]],
+            msg_lookup,
+            file_name: str,
+            checkpoint: Optional[SourceCheckpoint] = None,
+            vote_classifier: Optional[VoteClassifier] = None,
+            mode: ExtractionMode = ExtractionMode.FULL,
+    ) -> List[ExtractedKnowledge]:
+        """
+        msg_lookup — dict или ReplyIndex: всё, что поддерживает `in` и `[]` по id сообщения.
+        С чекпоинтом окна только из уже обработанных (overlap) сообщений пропускаются,
+        а обработанные сообщения отмечаются в чекпоинте (mark_processed).
+        """
+        if checkpoint is not None:
+            skipped = len(windows)
+            windows = [(ref, msgs) for ref, msgs in windows if any(is_new_message(m, checkpoint) for m in msgs)]
+            skipped -= len(windows)
+            if skipped:
+                logger.info(f"  -> Пропущено {skipped} окон без новых сообщений")
+
+        vote_classifier = vote_classifier or VoteClassifier()
+        extracted_graphs = []
+        for wave_start in range(0, len(windows), self.window_concurrency):
+            wave = windows[wave_start:wave_start + self.window_concurrency]
+            texts = []
+            for i, (ref, msgs) in enumerate(wave, start=wave_start):
+                enriched_msgs = vote_classifier.enrich(msgs)
+                texts.append("\n".join([format_chat_message(m, msg_lookup) for m in enriched_msgs]))
+                n_msgs = sum(m.get("type") == "message" for m in msgs)  # без разделителей тредов
+                logger.info(f"  -> [{file_name} {i+1}/{len(windows)}] Анализ окна {ref} ({n_msgs} сообщений)")
+
+            if len(wave) == 1:
+                graphs = [await self._extract_window(texts[0], wave[0][0], mode)]
+            else:
+                graphs = await self._extract_wave(texts, [ref for ref, _ in wave], mode)
+
+            for (ref, _), graph in zip(wave, graphs):
+                self._emit(extracted_graphs, graph)
+                safe_ref = ref.replace(":", "_").replace("/", "_")
+                log_pydantic(f"layer1_subgraph_{file_name}_{safe_ref}.json", graph)
+
+        if checkpoint is not None:
+            mark_processed(checkpoint, (m for _, msgs in windows for m in msgs))
+        return extracted_graphs
+
+    @staticmethod
+    def _make_glossary_id(raw: RawEntity) -> str:
+        return raw.name.lower().replace(" ", "_").replace("-", "_")
+
+    @staticmethod
+    def _entity_text(name: str, description: str) -> str:
+        return f"{name} {description}".strip()
+
+    def _register_entity(self, raw: RawEntity, vector: List[float]) -> str:
+        """Добавляет новую сущность в глоссарий и его векторный индекс (первое описание сохраняется)."""
+        new_id = self._make_glossary_id(raw)
+        if new_id not in self.global_glossary_dict:
             self.global_glossary_dict[new_id] = GlossaryItem(
                 id=new_id, name=raw.name, label=raw.label, description=raw.description
             )
-            return new_id
+            self.glossary_index.add([new_id], [vector])
+        return new_id
 
-        # Простой эмбеддинг-матч + LLM
-        prompt = f"""Сущность: {raw.name} ({raw.label.value})
-Глоссарий: {self._format_glossary()}
-Это дубликат? Верни JSON с is_duplicate и target_global_id."""
-        decision: MergeDecision = await acall_llm_json(MergeDecision, prompt, data=raw.name)
-        if decision.is_duplicate and decision.target_global_id:
-            return decision.target_global_id
+    def _format_candidates(self, candidates: List[Tuple[str, float]], indent: str = "") -> str:
+        return "\n".join(
+            f"{indent}- {gid} ({self.global_glossary_dict[gid].label.value}): {self.global_glossary_dict[gid].name}"
+            for gid, _ in candidates
+        )
+
+    def _new_entity(self, raw: RawEntity, vector: List[float], staged: Optional[StagedEntities]) -> str:
+        """Новая сущность: сразу в глоссарий или (в волне) в staged до детерминированного слияния."""
+        if staged is None:
+            return self._register_entity(raw, vector)
+        new_id = self._make_glossary_id(raw)
+        if new_id not in self.global_glossary_dict:
+            staged.setdefault(new_id, (raw, vector))
+        return new_id
 
-        new_id = raw.name.lower().replace(" ", "_").replace("-", "_")
-        self.global_glossary_dict[new_id] = GlossaryItem(
-            id=new_id, name=raw.name, label=raw.label, description=raw.description
+    async def _extract_window(
+            self,
+            text: str,
+            source_ref: str,
+            mode: ExtractionMode,
+            staged: Optional[StagedEntities] = None,
+    ) -> ExtractedKnowledge:
+        if mode == ExtractionMode.FAST:
+            return await self._extract_subgraph_fast(text, source_ref, staged)
+        return await self._extract_subgraph_3pass(text, source_ref, staged)
+
+    async def _extract_wave(
+            self,
+            texts: List[str],
+            refs: List[str],
+            mode: ExtractionMode = ExtractionMode.FULL,
+    ) -> List[ExtractedKnowledge]:
+        """
+        Параллельное извлечение волны окон по одному снимку глоссария и памяти.
+        Глоссарий во время волны не меняется (он свой у источника, см. for_source); новые сущности
+        окон вливаются после неё в порядке окон (первое описание сохраняется), поэтому итог
+        не зависит от порядка ответов. Одна сущность, найденная в разных окнах под разными именами,
+        сводится по эмбеддингам к первой записи, а ID в графах окон переписываются.
+        Память проекта обновляется один раз на волну (в быстром режиме — не обновляется).
+        """
+        staged_per_window: List[StagedEntities] = [{} for _ in texts]
+        graphs = await asyncio.gather(*[
+            self._extract_window(text, ref, mode, staged=staged)
+            for text, ref, staged in zip(texts, refs, staged_per_window)
+        ])
+
+        wave_new: List[Tuple[str, NodeLabel, object]] = []
+        for window_idx, staged in enumerate(staged_per_window):
+            aliases: Dict[str, str] = {}
+            for staged_id, (raw, vector) in staged.items():
+                if staged_id in self.global_glossary_dict:
+                    continue  # тот же ID уже внесён более ранним окном волны
+                linked_id = self._new_window_entity(raw, vector, None, wave_new)
+                if linked_id != staged_id:
+                    aliases[staged_id] = linked_id
+            if aliases:
+                logger.info(f"  🔗 Окно {refs[window_idx]}: {len(aliases)} сущностей сведено к записям других окон волны")
+                graphs[window_idx] = self.apply_aliases(graphs[window_idx], aliases)
+
+        if mode == ExtractionMode.FAST:
+            return list(graphs)
+        self.project_memory = await acall_llm_json(
+            ProjectMemory,
+            "Обнови память проекта на основе этих графов",
+            data="\n".join(g.model_dump_json() for g in graphs),
+            call_site="miner.update_memory",
         )
+        return list(graphs)
+
+    async def _link_entities(
+            self,
+            entities: List[RawEntity],
+            staged: Optional[StagedEntities] = None,
+    ) -> List[str]:
+        """
+        Шаг 2: Entity Linking для всех сущностей окна.
+        В промпт попадают только top-k ближайших записей глоссария (по эмбеддингам);
+        сущность без кандидатов выше порога сразу становится новой записью.
+        staged — режим волны: новые сущности не вставляются в глоссарий, а копятся в staged.
+        """
+        if not entities:
+            return []
+        vectors = await aget_embeddings_safe(
+            [self._entity_text(e.name, e.description) for e in entities], call_site="miner.embed_entities"
+        )
+        candidates = self.glossary_index.search(vectors, k=GLOSSARY_TOP_K, threshold=GLOSSARY_LINK_THRESHOLD)
+
+        if self.link_mode == "single":
+            return [
+                await self._link_entity_to_glossary(entity, vector, entity_candidates, staged)
+                for entity, vector, entity_candidates in zip(entities, vectors, candidates)
+            ]
+
+        linked_ids: List[Optional[str]] = [None] * len(entities)
+        pending: List[int] = []
+        for i, entity in enumerate(entities):
+            # Точное совпадение ID не требует LLM
+            if self._make_glossary_id(entity) in self.global_glossary_dict or (
+                    staged is not None and self._make_glossary_id(entity) in staged):
+                linked_ids[i] = self._make_glossary_id(entity)
+            elif candidates[i]:
+                pending.append(i)
+
+        # Все батчи видят один и тот же снимок глоссария — вставки только после ответов
+        chunks = [pending[i:i + ENTITY_LINK_BATCH_SIZE] for i in range(0, len(pending), ENTITY_LINK_BATCH_SIZE)]
+        results = await asyncio.gather(*[
+            self._link_entity_batch(entities, chunk, candidates) for chunk in chunks
+        ])
+        decisions: Dict[int, MergeDecision] = {}
+        for chunk, chunk_decisions in zip(chunks, results):
+            if chunk_decisions is None:
+                # Пакет не удался — линкуем его сущности по одной; ошибка одиночного вызова пробрасывается
+                singles = await asyncio.gather(*[self._decide_link(entities[i], candidates[i]) for i in chunk])
+                chunk_decisions = dict(zip(chunk, singles))
+            decisions.update(chunk_decisions)
+
+        # Детерминированное применение в порядке сущностей окна
+        window_new: List[Tuple[str, NodeLabel, object]] = []
+        for i, entity in enumerate(entities):
+            if linked_ids[i] is not None:
+                continue
+            decision = decisions.get(i)
+            if (decision is not None and decision.is_duplicate
+                    and decision.target_global_id in self.global_glossary_dict):
+                linked_ids[i] = decision.target_global_id
+            else:
+                linked_ids[i] = self._new_window_entity(entity, vectors[i], staged, window_new)
+        return linked_ids
+
+    def _new_window_entity(
+            self,
+            raw: RawEntity,
+            vector: List[float],
+            staged: Optional[StagedEntities],
+            window_new: List[Tuple[str, NodeLabel, object]],
+    ) -> str:
+        """Новые сущности окна сверяются между собой: одна и та же сущность под разными именами — одна запись."""
+        row = normalize_rows([vector])[0]
+        for new_id, label, other in window_new:
+            if label == raw.label and float(row @ other) >= WINDOW_ENTITY_DEDUP_THRESHOLD:
+                return new_id
+        new_id = self._new_entity(raw, vector, staged)
+        window_new.append((new_id, raw.label, row))
         return new_id
 
-    async def _extract_subgraph_3pass(self, text: str, source_ref: str) -> ExtractedKnowledge:
+    @staticmethod
+    def apply_aliases(graph: ExtractedKnowledge, aliases: Dict[str, str]) -> ExtractedKnowledge:
+        """Переименовывает узлы подграфа (old → new); слившиеся узлы, петли и дубли рёбер убирает валидатор."""
+        nodes: Dict[str, GraphNode] = {}
+        for node in graph.nodes:
+            node_id = aliases.get(node.id, node.id)
+            nodes.setdefault(node_id, node.model_copy(update={"id": node_id}))
+        graph.nodes = list(nodes.values())
+        graph.edges = [
+            edge.model_copy(update={
+                "source": aliases.get(edge.source, edge.source),
+                "target": aliases.get(edge.target, edge.target),
+            })
+            for edge in graph.edges
+        ]
+        graph, _ = validate_subgraph(graph)
+        return graph
+
+    async def _link_entity_batch(
+            self,
+            entities: List[RawEntity],
+            indices: List[int],
+            candidates: List[List[Tuple[str, float]]],
+    ) -> Optional[Dict[int, EntityLinkDecision]]:
+        """None — пакетный вызов не удался, вызывающий линкует эти сущности по одной."""
+        prompt = """Для КАЖДОЙ сущности из входных данных определи, совпадает ли она с одним из её кандидатов из глоссария.
+Верни decisions: entity_index (номер из списка), is_duplicate и target_global_id (ID кандидата)."""
+        data = "\n".join(
+            f"{i}. {entities[i].name} ({entities[i].label.value}): {entities[i].description}\n"
+            f"{self._format_candidates(candidates[i], indent='   ')}"
+            for i in indices
+        )
+        try:
+            batch: EntityLinkBatch = await acall_llm_json(
+                EntityLinkBatch, prompt, data=data, call_site="miner.link_entities_batch"
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Пакетный линкинг ({len(indices)} сущностей) не удался ({e}), линкуем по одной")
+            return None
+        wanted = set(indices)
+        return {d.entity_index: d for d in batch.decisions if d.entity_index in wanted}
+
+    async def _link_entity_to_glossary(
+            self,
+            raw: RawEntity,
+            vector: List[float],
+            candidates: List[Tuple[str, float]],
+            staged: Optional[StagedEntities] = None,
+    ) -> str:
+        """Шаг 2: Entity Linking (по одной сущности)"""
+        if not candidates:
+            return self._new_entity(raw, vector, staged)
+
+        decision = await self._decide_link(raw, candidates)
+        if decision.is_duplicate and decision.target_global_id in self.global_glossary_dict:
+            return decision.target_global_id
+
+        return self._new_entity(raw, vector, staged)
+
+    async def _decide_link(self, raw: RawEntity, candidates: List[Tuple[str, float]]) -> MergeDecision:
+        """Эмбеддинг-отбор кандидатов + LLM: решение по одной сущности, глоссарий не меняется."""
+        prompt = f"""Сущность: {raw.name} ({raw.label.value})
+Глоссарий: {self._format_candidates(candidates)}
+Это дубликат? Верни JSON с is_duplicate и target_global_id."""
+        return await acall_llm_json(MergeDecision, prompt, data=raw.name, call_site="miner.link_entity")
+
+    async def _extract_subgraph_3pass(
+            self,
+            text: str,
+            source_ref: str,
+            staged: Optional[StagedEntities] = None,
+    ) -> ExtractedKnowledge:
+        """staged задан — окно идёт в волне: глоссарий не меняется, память обновит _extract_wave."""
         # ── ШАГ 1: Raw Entities ─────────────────────────────────────
         raw_prompt = """Найди ВСЕ ключевые сущности. Не думай про ID. Просто имя + label + описание."""
-        raw: RawEntitiesSchema = await acall_llm_json(RawEntitiesSchema, raw_prompt, data=text)
+        raw: RawEntitiesSchema = await acall_llm_json(
+            RawEntitiesSchema, raw_prompt, data=text, call_site="miner.raw_entities"
+        )
 
         # ── ШАГ 2: Linking → правильные ID ───────────────────────────
-        linked_ids = []
-        for entity in raw.entities:
-            global_id = await self._link_entity_to_glossary(entity)
-            linked_ids.append(global_id)
+        linked_ids = await self._link_entities(raw.entities, staged)
 
         # ── ШАГ 3: Граф + голосования (только с правильными ID) ─────
-        graph_prompt = f"""Глоссарий: {self._format_glossary()}
+        graph_prompt = f"""Глоссарий: {self._format_glossary(staged)}
 Память проекта: {self.project_memory.model_dump_json(indent=2)}
 Текст: {text}
 Извлеки узлы и рёбра ТОЛЬКО используя ID из глоссария выше."""
-        result: ExtractedKnowledge = await acall_llm_json(ExtractedKnowledge, graph_prompt, data=text)
+        result: ExtractedKnowledge = await acall_llm_json(
+            ExtractedKnowledge, graph_prompt, data=text, call_site="miner.extract_graph"
+        )
         result.source_ref = source_ref
 
-        # ── Critique & Fix ───────────────────────────────────────────
-        critique_prompt = """Проверь граф на ошибки (призраки, неправильные голоса, отсутствующие RELATES_TO).
-Верни список исправлений."""
-        fixes: FixListSchema = await acall_llm_json(FixListSchema, critique_prompt, data=result.model_dump_json())
-        result = self._apply_fixes(result, fixes)
+        # ── Локальная валидация (вместо LLM-critique) ────────────────
+        valid_ids = set(self.global_glossary_dict.keys()) | set(staged or ())
+        result, _ = validate_subgraph(result, valid_ids)
 
         # ── Обновляем память ─────────────────────────────────────────
-        self.project_memory = await acall_llm_json(
-            ProjectMemory,
-            "Обнови память проекта на основе этого графа",
-            data=result.model_dump_json()
-        )
-
-        valid_ids = set(self.global_glossary_dict.keys())
-        result = validate_graph_integrity(result, valid_ids)
+        if staged is None:
+            self.project_memory = await acall_llm_json(
+                ProjectMemory,
+                "Обнови память проекта на основе этого графа",
+                data=result.model_dump_json(),
+                call_site="miner.update_memory",
+            )
 
         logger.info(f" ✅ Граф: {len(result.nodes)} узлов, {len(result.edges)} рёбер")
         return result
 
-    def _apply_fixes(self, graph: ExtractedKnowledge, fixes: FixListSchema) -> ExtractedKnowledge:
-        for fix in fixes.fixes:
-            logger.info(f" 🔧 Critique fix: {fix.action} — {fix.reason}")
-
-            if fix.action == "remove_node" and fix.node_id:
-                graph.nodes = [n for n in graph.nodes if n.id != fix.node_id]
-                graph.edges = [e for e in graph.edges if e.source != fix.node_id and e.target != fix.node_id]
+    async def _extract_subgraph_fast(
+            self,
+            text: str,
+            source_ref: str,
+            staged: Optional[StagedEntities] = None,
+    ) -> ExtractedKnowledge:
+        """
+        Быстрый режим: сущности, привязка к глоссарию и рёбра — одним structured-вызовом.
+        Кандидаты глоссария — top-k ближайших к тексту окна; память проекта не обновляется,
+        граф проверяется тем же локальным валидатором (validate_subgraph).
+        """
+        [window_vector] = await aget_embeddings_safe([text], call_site="miner.embed_window")
+        [candidates] = self.glossary_index.search([window_vector], k=FAST_GLOSSARY_TOP_K)
+
+        prompt = f"""Найди ВСЕ ключевые сущности (имя + label + описание) и связи между ними.
+Если сущность совпадает с записью глоссария ниже, укажи её ID в glossary_id, иначе оставь glossary_id пустым.
+Рёбра задавай номерами сущностей (с 0) в списке entities.
+Глоссарий (ближайшие записи):
+{self._format_candidates(candidates) or "- (пусто)"}
+Память проекта: {self.project_memory.model_dump_json()}"""
+        fast: FastExtraction = await acall_llm_json(
+            FastExtraction, prompt, data=text, call_site="miner.extract_fast"
+        )
 
-            elif fix.action == "remove_edge" and fix.edge_source and fix.edge_target:
-                graph.edges = [e for e in graph.edges if
-                               not (e.source == fix.edge_source and e.target == fix.edge_target)]
+        known = set(self.global_glossary_dict) | set(staged or ())
+        ids: List[Optional[str]] = [
+            e.glossary_id if e.glossary_id in known else None for e in fast.entities
+        ]
+        new_positions = [i for i, gid in enumerate(ids) if gid is None]
+        if new_positions:
+            vectors = await aget_embeddings_safe(
+                [self._entity_text(fast.entities[i].name, fast.entities[i].description) for i in new_positions],
+                call_site="miner.embed_entities",
+            )
+            for i, vector in zip(new_positions, vectors):
+                raw = RawEntity(
+                    name=fast.entities[i].name,
+                    label=fast.entities[i].label,
+                    description=fast.entities[i].description,
+                )
+                ids[i] = self._new_entity(raw, vector, staged)
+
+        nodes: Dict[str, GraphNode] = {}
+        for gid, entity in zip(ids, fast.entities):
+            if gid not in nodes:
+                nodes[gid] = GraphNode(id=gid, label=entity.label, name=entity.name, description=entity.description)
+        edges = [
+            GraphEdge(source=ids[e.source], target=ids[e.target], relation=e.relation, evidence=e.evidence)
+            for e in fast.edges
+            if 0 <= e.source < len(ids) and 0 <= e.target < len(ids)
+        ]
+        result = ExtractedKnowledge(
+            summary=fast.summary, nodes=list(nodes.values()), edges=edges, source_ref=source_ref
+        )
 
-        return graph
\ No newline at end of file
+        valid_ids = set(self.global_glossary_dict.keys()) | set(staged or ())
+        result, _ = validate_subgraph(result, valid_ids)
+        logger.info(f" ⚡ Граф: {len(result.nodes)} узлов, {len(result.edges)} рёбер")
+        return result
@@ -0,0 +1,173 @@
+"""
+Локальная проверка подграфа окна вместо LLM-critique.
+
+Правила детерминированные и чинят граф на месте; каждое исправление записывается
+в FixListSchema, так что лог правок воспроизводим от запуска к запуску:
+- призраки: узлы не из глоссария, повторные узлы с тем же ID;
+- висячие рёбра и петли;
+- голоса (VOTED_FOR / VOTED_AGAINST) не от Person: перевёрнутое ребро разворачивается, остальное удаляется;
+- Decision без вариантов: варианты восстанавливаются из RESOLVED_TO и из голосов окна;
+- дубли рёбер (source, target, relation).
+"""
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from schemas.enums import NodeLabel, EdgeRelation
+from schemas.graph import ExtractedKnowledge, FixListSchema, GraphEdge, GraphFix
+
+logger = logging.getLogger(__name__)
+
+VOTE_RELATIONS = (EdgeRelation.VOTED_FOR, EdgeRelation.VOTED_AGAINST)
+
+
+def _remove_ghost_nodes(graph: ExtractedKnowledge, valid_ids: Set[str], fixes: List[GraphFix]):
+    kept, seen = [], set()
+    for node in graph.nodes:
+        if node.id not in valid_ids:
+            fixes.append(GraphFix(action="remove_node", node_id=node.id, reason="Призрак: ID нет в глоссарии"))
+        elif node.id in seen:
+            fixes.append(GraphFix(action="remove_node", node_id=node.id, reason="Повторный узел с тем же ID"))
+        else:
+            seen.add(node.id)
+            kept.append(node)
+    graph.nodes = kept
+
+
+def _remove_invalid_edges(graph: ExtractedKnowledge, fixes: List[GraphFix]):
+    present_ids = {n.id for n in graph.nodes}
+    kept = []
+    for edge in graph.edges:
+        if edge.source == edge.target:
+            reason = "Петля: source == target"
+        elif edge.source not in present_ids or edge.target not in present_ids:
+            reason = "Висячее ребро: конец не среди узлов"
+        else:
+            kept.append(edge)
+            continue
+        fixes.append(GraphFix(
+            action="remove_edge", edge_source=edge.source, edge_target=edge.target,
+            new_value=edge.relation.value, reason=reason,
+        ))
+    graph.edges = kept
+
+
+def _fix_votes(graph: ExtractedKnowledge, labels: Dict[str, NodeLabel], fixes: List[GraphFix]):
+    """Голос всегда идёт от Person к варианту. Person в target — LLM перепутала направление."""
+    kept = []
+    for edge in graph.edges:
+        if edge.relation not in VOTE_RELATIONS or labels[edge.source] == NodeLabel.PERSON:
+            kept.append(edge)
+        elif labels[edge.target] == NodeLabel.PERSON:
+            fixes.append(GraphFix(
+                action="fix_vote", edge_source=edge.source, edge_target=edge.target,
+                new_value=f"{edge.target}->{edge.source}", reason="Голос направлен к Person: ребро развёрнуто",
+            ))
+            kept.append(edge.model_copy(update={"source": edge.target, "target": edge.source}))
+        else:
+            fixes.append(GraphFix(
+                action="remove_edge", edge_source=edge.source, edge_target=edge.target,
+                new_value=edge.relation.value, reason=f"Голос не от Person ({labels[edge.source].value})",
+            ))
+    graph.edges = kept
+
+
+def _fix_decision_options(graph: ExtractedKnowledge, labels: Dict[str, NodeLabel], fixes: List[GraphFix]):
+    """
+    Decision без RELATES_TO получает варианты:
+    - из своих RESOLVED_TO (выбранный вариант — тоже вариант);
+    - если такой Decision в окне один — из вариантов, за которые голосовали,
+      но которые не привязаны ни к одному Decision.
+    Остальные Decision оставляем как есть: варианты могут прийти из других окон при слиянии.
+    """
+    decisions = [n.id for n in graph.nodes if labels[n.id] == NodeLabel.DECISION]
+    if not decisions:
+        return
+
+    options: Dict[str, List[str]] = {d: [] for d in decisions}
+    for edge in graph.edges:
+        if edge.relation == EdgeRelation.RELATES_TO and edge.source in options:
+            options[edge.source].append(edge.target)
+    attached = {opt for opts in options.values() for opt in opts}
+
+    orphan_votes: List[str] = []
+    for edge in graph.edges:
+        if (
+                edge.relation in VOTE_RELATIONS
+                and labels[edge.target] != NodeLabel.DECISION
+                and edge.target not in attached
+                and edge.target not in orphan_votes
+        ):
+            orphan_votes.append(edge.target)
+
+    optionless = [d for d in decisions if not options[d]]
+
+    def add_option(decision_id: str, option_id: str, reason: str):
+        graph.edges.append(GraphEdge(
+            source=decision_id, target=option_id, relation=EdgeRelation.RELATES_TO, evidence=reason,
+        ))
+        options[decision_id].append(option_id)
+        fixes.append(GraphFix(
+            action="add_edge", edge_source=decision_id, edge_target=option_id,
+            new_value=EdgeRelation.RELATES_TO.value, reason=reason,
+        ))
+
+    for decision_id in optionless:
+        resolved = [
+            e.target for e in graph.edges
+            if e.source == decision_id and e.relation == EdgeRelation.RESOLVED_TO
+        ]
+        for option_id in dict.fromkeys(resolved):
+            add_option(decision_id, option_id, "Вариант восстановлен из RESOLVED_TO")
+
+    still_optionless = [d for d in optionless if not options[d]]
+    if len(still_optionless) == 1:
+        for option_id in orphan_votes:
+            add_option(still_optionless[0], option_id, "Вариант восстановлен из голосов окна")
+
+    for decision_id in decisions:
+        if not options[decision_id]:
+            logger.debug(f"Decision '{decision_id}' без вариантов — чинить нечем, оставлен для слияния")
+
+
+def _remove_duplicate_edges(graph: ExtractedKnowledge, fixes: List[GraphFix]):
+    """Первое ребро (source, target, relation) остаётся; пустой evidence дополняется из дубля."""
+    kept: Dict[Tuple[str, str, EdgeRelation], GraphEdge] = {}
+    for edge in graph.edges:
+        key = (edge.source, edge.target, edge.relation)
+        first = kept.get(key)
+        if first is None:
+            kept[key] = edge
+            continue
+        if not first.evidence and edge.evidence:
+            kept[key] = first.model_copy(update={"evidence": edge.evidence})
+        fixes.append(GraphFix(
+            action="remove_edge", edge_source=edge.source, edge_target=edge.target,
+            new_value=edge.relation.value, reason="Дубль ребра",
+        ))
+    graph.edges = list(kept.values())
+
+
+def validate_subgraph(
+        graph: ExtractedKnowledge,
+        valid_ids: Optional[Set[str]] = None,
+) -> Tuple[ExtractedKnowledge, FixListSchema]:
+    """
+    Проверяет и чинит подграф окна. valid_ids — ID глоссария (None — проверку призраков пропустить).
+    Возвращает исправленный граф и список применённых правок в порядке применения.
+    """
+    fixes: List[GraphFix] = []
+    if valid_ids is not None:
+        _remove_ghost_nodes(graph, valid_ids, fixes)
+    _remove_invalid_edges(graph, fixes)
+
+    labels = {n.id: n.label for n in graph.nodes}
+    _fix_votes(graph, labels, fixes)
+    _fix_decision_options(graph, labels, fixes)
+    _remove_duplicate_edges(graph, fixes)
+
+    for fix in fixes:
+        logger.debug(f"🔧 {fix.action}: {fix.node_id or f'{fix.edge_source} → {fix.edge_target}'} — {fix.reason}")
+    if fixes:
+        logger.info(f" 🔧 Валидатор: {len(fixes)} исправлений")
+    return graph, FixListSchema(fixes=fixes)
+
@@ -1,17 +1,37 @@
+import os
 import asyncio
+import logging
 import numpy as np
 import networkx as nx
 import community as community_louvain
-from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 from typing import List, Tuple
 from utils.embeddings import aget_embeddings_safe
+from utils.vector_index import normalize_rows
+from utils.tokens import count_tokens
+from utils.preprocessing import THREAD_SEPARATOR_TYPE
 
-MAX_CHARS_PER_WINDOW = 6000
+# Бюджет окна в токенах модели: длинные треды режутся по нему, короткие пакуются вместе до него
+WINDOW_TOKEN_BUDGET = int(os.getenv("WINDOW_TOKEN_BUDGET", "2000"))
+# Дата, автор и цитата ответа в строке сообщения
+MESSAGE_OVERHEAD_TOKENS = 15
 OVERLAP_MESSAGES = 4
 SEMANTIC_THRESHOLD = 0.65
 LOOKBACK_WINDOW = 20
+LINK_THRESHOLD = 0.72
+MAX_LINK_GAP = np.timedelta64(4, "h")
+# Сколько сообщений за раз проходит через ленточное умножение (ограничивает память)
+LOOKBACK_CHUNK_ROWS = 65536
 EMBEDDING_BATCH_SIZE = 20
-EMBEDDING_DELAY = 1.0
+# Шардирование Louvain: независимые участки чата упаковываются в шарды до LOUVAIN_SHARD_MESSAGES сообщений
+LOUVAIN_SHARD_MESSAGES = int(os.getenv("LOUVAIN_SHARD_MESSAGES", "2000"))
+# Пул процессов поднимается только для больших чатов — иначе запуск воркеров дороже самого Louvain
+LOUVAIN_POOL_MIN_MESSAGES = int(os.getenv("LOUVAIN_POOL_MIN_MESSAGES", "10000"))
+LOUVAIN_WORKERS = int(os.getenv("LOUVAIN_WORKERS", str(os.cpu_count() or 1)))
+LOUVAIN_RANDOM_STATE = 42
+
+logger = logging.getLogger(__name__)
 
 
 def parse_date(date_str: str) -> datetime:
@@ -21,10 +41,219 @@ def parse_date(date_str: str) -> datetime:
         return datetime.now()
 
 
-def cosine_similarity(v1: List[float], v2: List[float]) -> float:
-    v1, v2 = np.array(v1), np.array(v2)
-    norm = np.linalg.norm(v1) * np.linalg.norm(v2)
-    return float(np.dot(v1, v2) / norm) if norm > 0 else 0.0
+def parse_timestamps(messages: List[dict]) -> np.ndarray:
+    """Даты сообщений → numpy datetime64[s] (aware-даты приводятся к UTC)."""
+    stamps = []
+    for m in messages:
+        dt = parse_date(m.get("date", ""))
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        stamps.append(dt)
+    return np.array(stamps, dtype="datetime64[s]")
+
+
+def best_lookback_links(
+        embeddings,
+        timestamps: np.ndarray,
+        lookback: int = LOOKBACK_WINDOW,
+        max_gap: np.timedelta64 = MAX_LINK_GAP,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Для каждого сообщения i — самое похожее из lookback предыдущих (не старше max_gap).
+    Ленточная операция: для каждого сдвига k считается построчное скалярное произведение E[i]·E[i-k].
+    Возвращает (best_j, best_sim); best_j = -1, если подходящих соседей нет.
+    При равенстве сходства выбирается более раннее сообщение.
+    """
+    matrix = normalize_rows(embeddings)
+    n = matrix.shape[0]
+    best_j = np.full(n, -1, dtype=np.int64)
+    best_sim = np.zeros(n, dtype=np.float32)
+    offsets = np.arange(lookback, 0, -1)  # от дальних к ближним: argmax берёт первое (самое раннее)
+
+    for start in range(0, n, LOOKBACK_CHUNK_ROWS):
+        stop = min(n, start + LOOKBACK_CHUNK_ROWS)
+        rows = np.arange(start, stop)
+        band = np.full((stop - start, len(offsets)), -np.inf, dtype=np.float32)
+        for col, k in enumerate(offsets):
+            valid = rows >= k
+            if not valid.any():
+                continue
+            i = rows[valid]
+            sims = np.einsum("ij,ij->i", matrix[i], matrix[i - k])
+            sims[timestamps[i] - timestamps[i - k] > max_gap] = -np.inf
+            band[valid, col] = sims
+
+        best_col = np.argmax(band, axis=1)
+        chunk_best = band[np.arange(stop - start), best_col]
+        # Как и раньше, учитываем только положительное сходство
+        found = chunk_best > 0
+        best_j[start:stop][found] = rows[found] - offsets[best_col[found]]
+        best_sim[start:stop][found] = chunk_best[found]
+
+    return best_j, best_sim
+
+
+def _partition_shard(args: Tuple[int, np.ndarray, np.ndarray, np.ndarray]) -> np.ndarray:
+    """
+    Louvain по одному шарду (запускается в пуле процессов, поэтому функция верхнего уровня).
+    Граф — только целые индексы и веса, без сообщений. Возвращает номер сообщества для каждого узла.
+    """
+    n_nodes, sources, targets, weights = args
+    G = nx.Graph()
+    G.add_nodes_from(range(n_nodes))
+    G.add_weighted_edges_from(zip(sources.tolist(), targets.tolist(), weights.tolist()))
+    labels = np.arange(n_nodes)
+    if G.number_of_edges() == 0:
+        return labels
+    try:
+        partition = community_louvain.best_partition(G, random_state=LOUVAIN_RANDOM_STATE)
+        for node, comm in partition.items():
+            labels[node] = comm
+    except Exception as e:
+        logger.warning(f"Louvain failed ({e}), fallback to connected_components")
+        for comm, component in enumerate(nx.connected_components(G)):
+            labels[list(component)] = comm
+    return labels
+
+
+def shard_bounds(
+        n: int,
+        sources: np.ndarray,
+        targets: np.ndarray,
+        max_shard: int = LOUVAIN_SHARD_MESSAGES,
+) -> List[Tuple[int, int]]:
+    """
+    Делит [0, n) на шарды [start, stop), которые не пересекает ни одно ребро.
+    Разрезы возможны в естественных паузах (похожие сообщения связываются только в пределах 4 часов,
+    ответы учитываются явно); соседние независимые участки пакуются до max_shard сообщений.
+    """
+    coverage = np.zeros(n + 1, dtype=np.int64)
+    if len(sources):
+        lo, hi = np.minimum(sources, targets), np.maximum(sources, targets)
+        np.add.at(coverage, lo + 1, 1)
+        np.add.at(coverage, hi + 1, -1)
+    # cut[c] — между c-1 и c нет рёбер
+    cuts = (np.flatnonzero(np.cumsum(coverage)[1:n] == 0) + 1).tolist()
+
+    bounds: List[Tuple[int, int]] = []
+    shard_start = 0
+    for seg_start, seg_stop in zip([0] + cuts, cuts + [n]):
+        # Участок длиннее max_shard не режется: внутри него есть связи
+        if seg_stop - shard_start > max_shard and seg_start > shard_start:
+            bounds.append((shard_start, seg_start))
+            shard_start = seg_start
+    if n > shard_start:
+        bounds.append((shard_start, n))
+    return bounds
+
+
+def message_tokens(msg: dict) -> int:
+    return count_tokens(str(msg.get("text", ""))) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _window_ref(threads_label: str, msgs: List[dict]) -> str:
+    return f"{threads_label}_msg_{msgs[0]['id']}_to_{msgs[-1]['id']}"
+
+
+def pack_thread_windows(
+        threads: List[List[dict]],
+        budget: int = WINDOW_TOKEN_BUDGET,
+) -> List[Tuple[str, List[dict]]]:
+    """
+    Окна по токен-бюджету.
+    - Тред больше бюджета режется на окна с перекрытием OVERLAP_MESSAGES (как раньше по символам).
+    - Треды, целиком влезающие в бюджет, пакуются подряд (в порядке времени) в общие окна,
+      разделённые псевдо-сообщениями type=thread_separator.
+    """
+    windows: List[Tuple[str, List[dict]]] = []
+    pack: List[Tuple[int, List[dict]]] = []
+    pack_tokens = 0
+
+    def flush_pack():
+        nonlocal pack, pack_tokens
+        if not pack:
+            return
+        msgs: List[dict] = []
+        for k, (_, thread) in enumerate(pack):
+            if k:
+                msgs.append({"type": THREAD_SEPARATOR_TYPE, "text": ""})
+            msgs.extend(thread)
+        label = f"thread_{pack[0][0]}" if len(pack) == 1 else f"threads_{pack[0][0]}-{pack[-1][0]}"
+        windows.append((_window_ref(label, msgs), msgs))
+        pack, pack_tokens = [], 0
+
+    for thread_idx, thread in enumerate(threads):
+        tokens = [message_tokens(m) for m in thread]
+        thread_tokens = sum(tokens)
+
+        if thread_tokens <= budget:
+            separator_tokens = MESSAGE_OVERHEAD_TOKENS if pack else 0
+            if pack_tokens + separator_tokens + thread_tokens > budget:
+                flush_pack()
+                separator_tokens = 0
+            pack.append((thread_idx, thread))
+            pack_tokens += separator_tokens + thread_tokens
+            continue
+
+        # Накопленные мелкие треды старше этого: их окно идёт раньше, чтобы окна шли в порядке времени
+        flush_pack()
+        current_window: List[dict] = []
+        current_tokens: List[int] = []
+        window_tokens = 0
+        for msg, msg_tokens in zip(thread, tokens):
+            if window_tokens + msg_tokens > budget and len(current_window) > OVERLAP_MESSAGES:
+                windows.append((_window_ref(f"thread_{thread_idx}", current_window), current_window))
+                current_window = current_window[-OVERLAP_MESSAGES:]
+                current_tokens = current_tokens[-OVERLAP_MESSAGES:]
+                window_tokens = sum(current_tokens)
+            current_window.append(msg)
+            current_tokens.append(msg_tokens)
+            window_tokens += msg_tokens
+        if current_window:
+            windows.append((_window_ref(f"thread_{thread_idx}", current_window), current_window))
+
+    flush_pack()
+    return windows
+
+
+async def apartition_threads(
+        n: int,
+        sources: np.ndarray,
+        targets: np.ndarray,
+        weights: np.ndarray,
+) -> List[np.ndarray]:
+    """
+    Разбиение сообщений на треды: Louvain по шардам, которые не связаны рёбрами.
+    Большие чаты считаются в пуле процессов. Треды — массивы индексов, упорядоченные по первому сообщению.
+    """
+    if n == 0:
+        return []
+    bounds = shard_bounds(n, sources, targets)
+    starts = np.array([start for start, _ in bounds], dtype=np.int64)
+    edge_shard = np.searchsorted(starts, np.minimum(sources, targets), side="right") - 1
+
+    tasks = []
+    for k, (start, stop) in enumerate(bounds):
+        mask = edge_shard == k
+        tasks.append((stop - start, sources[mask] - start, targets[mask] - start, weights[mask]))
+
+    if len(tasks) > 1 and n >= LOUVAIN_POOL_MIN_MESSAGES and LOUVAIN_WORKERS > 1:
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=min(LOUVAIN_WORKERS, len(tasks))) as pool:
+            labels_per_shard = await asyncio.gather(*[
+                loop.run_in_executor(pool, _partition_shard, task) for task in tasks
+            ])
+    else:
+        labels_per_shard = await asyncio.to_thread(lambda: [_partition_shard(task) for task in tasks])
+
+    threads: List[np.ndarray] = []
+    for (start, _), labels in zip(bounds, labels_per_shard):
+        order = np.argsort(labels, kind="stable")
+        _, first = np.unique(labels[order], return_index=True)
+        groups = np.split(order, first[1:])
+        groups.sort(key=lambda g: g[0])
+        threads.extend(g + start for g in groups)
+    return threads
 
 
 async def asplit_chat_into_semantic_threads(
@@ -39,91 +268,33 @@ async def asplit_chat_into_semantic_threads(
     embeddings = await aget_embeddings_safe(
         texts=texts_to_embed,
         batch_size=EMBEDDING_BATCH_SIZE,
-        delay=EMBEDDING_DELAY
+        call_site="windowing.embed_messages",
     )
-    G = nx.Graph()
-    for i, msg in enumerate(valid_msgs):
-        G.add_node(
-            msg["id"],
-            msg=msg,
-            vec=embeddings[i],
-            time=parse_date(msg.get("date", "")),
-        )
+    timestamps = parse_timestamps(valid_msgs)
+    best_j, best_sim = best_lookback_links(embeddings, timestamps)
 
+    # Рёбра — только целые индексы сообщений и веса
+    index_by_id = {msg["id"]: i for i, msg in enumerate(valid_msgs)}
+    edges: List[Tuple[int, int, float]] = []
     for i, msg in enumerate(valid_msgs):
         reply_id = msg.get("reply_to_message_id")
-        if reply_id and G.has_node(reply_id):
-            G.add_edge(msg["id"], reply_id, weight=15.0)  # ← сильнее
+        if reply_id and reply_id in index_by_id:
+            edges.append((i, index_by_id[reply_id], 15.0))  # ← сильнее
             continue
 
-        best_sim = 0.0
-        best_target_id = None
-        for j in range(max(0, i - LOOKBACK_WINDOW), i):
-            time_i = G.nodes[msg["id"]]["time"]
-            time_j = G.nodes[valid_msgs[j]["id"]]["time"]
-            if time_i - time_j > timedelta(hours=4):
-                continue
-            sim = cosine_similarity(embeddings[i], embeddings[j])
-            if sim > best_sim:
-                best_sim, best_target_id = sim, valid_msgs[j]["id"]
-
-        if best_sim >= 0.72 and best_target_id:  # ← было 0.65
-            G.add_edge(msg["id"], best_target_id, weight=best_sim)
-
-    threads: List[List[dict]] =[]
-
-    if G.number_of_edges() > 0:
-        try:
-            partition = community_louvain.best_partition(G)
-            communities: dict[int, List[dict]] = {}
-            for node_id, comm_id in partition.items():
-                communities.setdefault(comm_id, []).append(G.nodes[node_id]["msg"])
-
-            threads = list(communities.values())
-        except Exception as e:
-            import logging
-            logging.getLogger(__name__).warning(
-                f"Louvain failed ({e}), fallback to connected_components"
-            )
-            for component in nx.connected_components(G):
-                thread_msgs =[G.nodes[nid]["msg"] for nid in component]
-                threads.append(thread_msgs)
-    else:
-        threads = [[G.nodes[nid]["msg"]] for nid in G.nodes()]
+        if best_j[i] >= 0 and best_sim[i] >= LINK_THRESHOLD:  # ← было 0.65
+            edges.append((i, int(best_j[i]), float(best_sim[i])))
 
-    for thread in threads:
-        thread.sort(key=lambda x: parse_date(x.get("date", "")))
+    sources = np.array([e[0] for e in edges], dtype=np.int64)
+    targets = np.array([e[1] for e in edges], dtype=np.int64)
+    weights = np.array([e[2] for e in edges], dtype=np.float64)
+    thread_indices = await apartition_threads(len(valid_msgs), sources, targets, weights)
 
+    # Сообщения внутри треда и сами треды — по времени (stable: при равных датах — порядок чата)
+    threads: List[List[dict]] = []
+    for indices in thread_indices:
+        ordered = indices[np.argsort(timestamps[indices], kind="stable")]
+        threads.append([valid_msgs[i] for i in ordered.tolist()])
     threads.sort(key=lambda t: parse_date(t[0].get("date", "")))
 
-    processed_windows: List[Tuple[str, List[dict]]] =[]
-
-    for thread_idx, thread in enumerate(threads):
-        current_window: List[dict] =[]
-        current_chars = 0
-
-        for msg in thread:
-            msg_len = len(str(msg.get("text", "")))
-            if (
-                current_chars + msg_len > MAX_CHARS_PER_WINDOW
-                and len(current_window) > OVERLAP_MESSAGES
-            ):
-                ref = (
-                    f"thread_{thread_idx}_msg_"
-                    f"{current_window[0]['id']}_to_{current_window[-1]['id']}"
-                )
-                processed_windows.append((ref, current_window))
-                current_window = current_window[-OVERLAP_MESSAGES:]
-                current_chars = sum(len(str(m.get("text", ""))) for m in current_window)
-
-            current_window.append(msg)
-            current_chars += msg_len
-
-        if current_window:
-            ref = (
-                f"thread_{thread_idx}_msg_"
-                f"{current_window[0]['id']}_to_{current_window[-1]['id']}"
-            )
-            processed_windows.append((ref, current_window))
-
-    return processed_windows
\ No newline at end of file
+    return pack_thread_windows(threads)
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""
+Вторичный индекс рёбер графа слияния: relation → рёбра и вариант → голоса за/против него.
+Обновляется вместе с графом (add_edge / remove_node), так что варианты (RELATES_TO) и голоса
+в resolve_decisions берутся из индекса, а не сканированием рёбер каждого Decision.
+"""
+from collections import defaultdict
+from typing import Any, Dict, Iterator, Tuple
+
+from schemas.enums import EdgeRelation
+
+# (source, target, key) — ключ ребра в MultiDiGraph
+EdgeKey = Tuple[str, str, Any]
+
+VOTE_RELATIONS = (EdgeRelation.VOTED_FOR.value, EdgeRelation.VOTED_AGAINST.value)
+
+
+def relation_value(relation: Any) -> str:
+    return relation.value if isinstance(relation, EdgeRelation) else str(relation or "")
+
+
+class EdgeIndex:
+    def __init__(self):
+        # Словари вместо множеств: порядок обхода = порядок добавления рёбер
+        self._by_relation: Dict[str, Dict[EdgeKey, None]] = defaultdict(dict)
+        self._votes_by_target: Dict[str, Dict[EdgeKey, str]] = defaultdict(dict)
+
+    @classmethod
+    def from_graph(cls, G) -> "EdgeIndex":
+        index = cls()
+        for u, v, key, data in G.edges(keys=True, data=True):
+            index.add(u, v, key, data.get("relation"))
+        return index
+
+    def add(self, u: str, v: str, key: Any, relation: Any):
+        relation = relation_value(relation)
+        edge = (u, v, key)
+        self._by_relation[relation][edge] = None
+        if relation in VOTE_RELATIONS:
+            self._votes_by_target[v][edge] = relation
+
+    def discard(self, u: str, v: str, key: Any, relation: Any):
+        relation = relation_value(relation)
+        edge = (u, v, key)
+        self._by_relation.get(relation, {}).pop(edge, None)
+        votes = self._votes_by_target.get(v)
+        if votes is not None:
+            votes.pop(edge, None)
+            if not votes:
+                del self._votes_by_target[v]
+
+    def discard_node(self, G, node: str):
+        """Вызывать ДО G.remove_node(node): снимает с индекса все инцидентные рёбра узла."""
+        for u, v, key, data in G.out_edges(node, keys=True, data=True):
+            self.discard(u, v, key, data.get("relation"))
+        for u, v, key, data in G.in_edges(node, keys=True, data=True):
+            if u != node:
+                self.discard(u, v, key, data.get("relation"))
+
+    def edges_by_relation(self, relation: Any) -> Iterator[EdgeKey]:
+        return iter(self._by_relation.get(relation_value(relation), {}))
+
+    def votes_for_target(self, target: str) -> Iterator[Tuple[str, str]]:
+        """(голосующий, relation) по всем голосам за/против варианта target."""
+        for (u, _, _), relation in self._votes_by_target.get(target, {}).items():
+            yield u, relation
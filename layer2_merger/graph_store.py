@@ -0,0 +1,450 @@
+"""
+Компактное хранилище графа слияния — альтернатива nx.MultiDiGraph (GRAPH_BACKEND=compact).
+
+- ID узлов интернируются в номера слотов; label, relation и target_section хранятся кодами;
+- рёбра — параллельные массивы (source, target, relation, evidence) с флагом «живое»;
+- смежность — CSR-массивы (offsets + номера рёбер), пересобираемые лениво;
+  рёбра, добавленные после сборки, лежат в небольшом «хвосте» до следующей пересборки;
+- описания узлов и evidence рёбер — в общей текстовой таблице, редкие атрибуты — в словарях-сайдтейблах.
+
+Наружу выставлено только то подмножество API networkx, которым пользуются merger и EdgeIndex.
+Состояние пишется и читается напрямую в node-link JSON (тот же формат, что у nx.node_link_data),
+в networkx граф превращается лишь для отладочного GraphML (to_networkx).
+"""
+from array import array
+from collections.abc import MutableMapping
+from enum import Enum
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import networkx as nx
+
+from schemas.enums import NodeLabel, EdgeRelation, TZSectionEnum
+
+# Пересобираем CSR, когда «хвост» новых рёбер больше этой доли от собранных (но не меньше минимума)
+CSR_REBUILD_MIN_PENDING = 1024
+CSR_REBUILD_PENDING_RATIO = 0.25
+
+_ABSENT = -1
+
+
+class _Codebook:
+    """Строка ↔ маленький код; значения enum заводятся заранее, незнакомые строки — по мере появления."""
+
+    def __init__(self, enum_cls):
+        self.values: List[str] = [e.value for e in enum_cls]
+        self._codes: Dict[str, int] = {v: i for i, v in enumerate(self.values)}
+
+    def encode(self, value: Any) -> int:
+        if value is None:
+            return _ABSENT
+        if isinstance(value, Enum):
+            value = value.value
+        value = str(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def decode(self, code: int) -> Optional[str]:
+        return None if code == _ABSENT else self.values[code]
+
+
+class _NodeAttrs(MutableMapping):
+    """Живое представление атрибутов узла в виде словаря (как G.nodes[n] в networkx)."""
+
+    __slots__ = ("_g", "_slot")
+
+    def __init__(self, graph: "CompactGraph", slot: int):
+        self._g = graph
+        self._slot = slot
+
+    def __getitem__(self, key):
+        g, slot = self._g, self._slot
+        if key == "id":
+            return g._ids[slot]
+        if key == "label" and g._label[slot] != _ABSENT:
+            return g._labels.decode(g._label[slot])
+        if key == "target_section" and g._section[slot] != _ABSENT:
+            return g._sections.decode(g._section[slot])
+        if key == "name" and g._name[slot] is not None:
+            return g._name[slot]
+        if key == "description" and g._desc[slot] != _ABSENT:
+            return g._texts[g._desc[slot]]
+        extra = g._node_extra.get(slot)
+        if extra is not None and key in extra:
+            return extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        g, slot = self._g, self._slot
+        if key == "id":
+            return  # ID узла — сам ключ слота
+        if key == "label":
+            g._label[slot] = g._labels.encode(value)
+        elif key == "target_section":
+            g._section[slot] = g._sections.encode(value)
+        elif key == "name":
+            g._name[slot] = value
+        elif key == "description":
+            g._desc[slot] = g._set_text(g._desc[slot], value)
+        else:
+            g._node_extra.setdefault(slot, {})[key] = value
+
+    def __delitem__(self, key):
+        g, slot = self._g, self._slot
+        if key not in self or key == "id":
+            raise KeyError(key)
+        if key == "label":
+            g._label[slot] = _ABSENT
+        elif key == "target_section":
+            g._section[slot] = _ABSENT
+        elif key == "name":
+            g._name[slot] = None
+        elif key == "description":
+            g._desc[slot] = _ABSENT
+        else:
+            del g._node_extra[slot][key]
+
+    def __iter__(self):
+        g, slot = self._g, self._slot
+        yield "id"
+        if g._label[slot] != _ABSENT:
+            yield "label"
+        if g._name[slot] is not None:
+            yield "name"
+        if g._desc[slot] != _ABSENT:
+            yield "description"
+        if g._section[slot] != _ABSENT:
+            yield "target_section"
+        yield from g._node_extra.get(slot, ())
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(self)
+
+
+class _EdgeAttrs(MutableMapping):
+    """Живое представление атрибутов ребра (relation, evidence и редкие прочие)."""
+
+    __slots__ = ("_g", "_edge")
+
+    def __init__(self, graph: "CompactGraph", edge: int):
+        self._g = graph
+        self._edge = edge
+
+    def __getitem__(self, key):
+        g, e = self._g, self._edge
+        if key == "relation" and g._rel[e] != _ABSENT:
+            return g._relations.decode(g._rel[e])
+        if key == "evidence" and g._evidence[e] != _ABSENT:
+            return g._texts[g._evidence[e]]
+        extra = g._edge_extra.get(e)
+        if extra is not None and key in extra:
+            return extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        g, e = self._g, self._edge
+        if key == "relation":
+            g._rel[e] = g._relations.encode(value)
+        elif key == "evidence":
+            g._evidence[e] = g._set_text(g._evidence[e], value)
+        else:
+            g._edge_extra.setdefault(e, {})[key] = value
+
+    def __delitem__(self, key):
+        g, e = self._g, self._edge
+        if key not in self:
+            raise KeyError(key)
+        if key == "relation":
+            g._rel[e] = _ABSENT
+        elif key == "evidence":
+            g._evidence[e] = _ABSENT
+        else:
+            del g._edge_extra[e][key]
+
+    def __iter__(self):
+        g, e = self._g, self._edge
+        if g._rel[e] != _ABSENT:
+            yield "relation"
+        if g._evidence[e] != _ABSENT:
+            yield "evidence"
+        yield from g._edge_extra.get(e, ())
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(self)
+
+
+class _NodeView:
+    """G.nodes: итерация по ID, G.nodes(data=True), G.nodes[n] → атрибуты узла."""
+
+    def __init__(self, graph: "CompactGraph"):
+        self._g = graph
+
+    def __call__(self, data: bool = False):
+        g = self._g
+        if data:
+            return ((g._ids[slot], _NodeAttrs(g, slot)) for slot in g._live_slots())
+        return (g._ids[slot] for slot in g._live_slots())
+
+    def __iter__(self):
+        return self()
+
+    def __len__(self):
+        return len(self._g._index)
+
+    def __contains__(self, node):
+        return node in self._g._index
+
+    def __getitem__(self, node) -> _NodeAttrs:
+        return _NodeAttrs(self._g, self._g._index[node])
+
+
+class CompactGraph:
+    """Направленный мультиграф на массивах; ключ ребра — его порядковый номер."""
+
+    def __init__(self):
+        self._index: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._node_alive = bytearray()
+        self._labels = _Codebook(NodeLabel)
+        self._sections = _Codebook(TZSectionEnum)
+        self._relations = _Codebook(EdgeRelation)
+        self._label = array("h")
+        self._section = array("h")
+        self._name: List[Optional[str]] = []
+        self._desc = array("i")
+        self._node_extra: Dict[int, Dict[str, Any]] = {}
+
+        self._src = array("i")
+        self._dst = array("i")
+        self._rel = array("h")
+        self._evidence = array("i")
+        self._edge_alive = bytearray()
+        self._edge_extra: Dict[int, Dict[str, Any]] = {}
+        self._live_edges = 0
+
+        # Общая таблица текстов: описания узлов и evidence рёбер
+        self._texts: List[str] = []
+
+        # CSR по рёбрам [0, _csr_edges): номера рёбер, отсортированные по source / target
+        self._csr_edges = 0
+        self._out_offsets = np.zeros(1, dtype=np.int64)
+        self._out_order = np.zeros(0, dtype=np.int32)
+        self._in_offsets = np.zeros(1, dtype=np.int64)
+        self._in_order = np.zeros(0, dtype=np.int32)
+        # «Хвост»: рёбра после последней сборки CSR, по слотам концов
+        self._pending_out: Dict[int, List[int]] = {}
+        self._pending_in: Dict[int, List[int]] = {}
+
+        self.nodes = _NodeView(self)
+
+    # ── служебное ────────────────────────────────────────────────
+    def _set_text(self, idx: int, value: Any) -> int:
+        if value is None:
+            return _ABSENT
+        if idx == _ABSENT:
+            self._texts.append(str(value))
+            return len(self._texts) - 1
+        self._texts[idx] = str(value)
+        return idx
+
+    def _live_slots(self) -> Iterator[int]:
+        alive = self._node_alive
+        return (slot for slot in range(len(self._ids)) if alive[slot])
+
+    def _ensure_csr(self, force: bool = False):
+        pending = len(self._src) - self._csr_edges
+        if pending == 0:
+            return
+        if not force and pending <= max(CSR_REBUILD_MIN_PENDING, CSR_REBUILD_PENDING_RATIO * self._csr_edges):
+            return
+        n_slots = len(self._ids)
+        src = np.frombuffer(self._src, dtype=np.int32) if len(self._src) else np.zeros(0, dtype=np.int32)
+        dst = np.frombuffer(self._dst, dtype=np.int32) if len(self._dst) else np.zeros(0, dtype=np.int32)
+        self._out_order = np.argsort(src, kind="stable").astype(np.int32)
+        self._in_order = np.argsort(dst, kind="stable").astype(np.int32)
+        self._out_offsets = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n_slots))))
+        self._in_offsets = np.concatenate(([0], np.cumsum(np.bincount(dst, minlength=n_slots))))
+        self._csr_edges = len(src)
+        self._pending_out, self._pending_in = {}, {}
+
+    def _incident(self, slot: int, outgoing: bool) -> Iterator[int]:
+        """Номера живых рёбер узла: сначала из CSR, затем из хвоста (в порядке добавления)."""
+        self._ensure_csr()
+        if outgoing:
+            offsets, order, pending = self._out_offsets, self._out_order, self._pending_out
+        else:
+            offsets, order, pending = self._in_offsets, self._in_order, self._pending_in
+        alive = self._edge_alive
+        if slot + 1 < len(offsets):
+            for e in order[offsets[slot]:offsets[slot + 1]].tolist():
+                if alive[e]:
+                    yield e
+        for e in pending.get(slot, ()):
+            if alive[e]:
+                yield e
+
+    def _edge_tuple(self, e: int, keys: bool, data: bool):
+        u, v = self._ids[self._src[e]], self._ids[self._dst[e]]
+        if keys and data:
+            return u, v, e, _EdgeAttrs(self, e)
+        if keys:
+            return u, v, e
+        if data:
+            return u, v, _EdgeAttrs(self, e)
+        return u, v
+
+    def _slot(self, node: str) -> int:
+        slot = self._index.get(node)
+        if slot is None:
+            slot = self._index[node] = len(self._ids)
+            self._ids.append(node)
+            self._node_alive.append(1)
+            self._label.append(_ABSENT)
+            self._section.append(_ABSENT)
+            self._name.append(None)
+            self._desc.append(_ABSENT)
+        return slot
+
+    # ── подмножество API networkx ─────────────────────────────────
+    def is_directed(self) -> bool:
+        return True
+
+    def is_multigraph(self) -> bool:
+        return True
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, node) -> bool:
+        return node in self._index
+
+    def number_of_nodes(self) -> int:
+        return len(self._index)
+
+    def number_of_edges(self) -> int:
+        return self._live_edges
+
+    def has_node(self, node) -> bool:
+        return node in self._index
+
+    def add_node(self, node: str, **attr):
+        attrs = _NodeAttrs(self, self._slot(node))
+        for key, value in attr.items():
+            attrs[key] = value
+
+    def add_edge(self, u: str, v: str, **attr) -> int:
+        e = len(self._src)
+        src, dst = self._slot(u), self._slot(v)
+        self._src.append(src)
+        self._dst.append(dst)
+        self._pending_out.setdefault(src, []).append(e)
+        self._pending_in.setdefault(dst, []).append(e)
+        self._rel.append(_ABSENT)
+        self._evidence.append(_ABSENT)
+        self._edge_alive.append(1)
+        self._live_edges += 1
+        attrs = _EdgeAttrs(self, e)
+        for key, value in attr.items():
+            attrs[key] = value
+        return e
+
+    def remove_node(self, node: str):
+        slot = self._index.get(node)
+        if slot is None:
+            raise nx.NetworkXError(f"The node {node} is not in the graph.")
+        for e in list(self._incident(slot, True)) + list(self._incident(slot, False)):
+            if self._edge_alive[e]:
+                self._edge_alive[e] = 0
+                self._live_edges -= 1
+                self._edge_extra.pop(e, None)
+        del self._index[node]
+        self._node_alive[slot] = 0
+        self._node_extra.pop(slot, None)
+
+    def out_edges(self, node: str, data: bool = False, keys: bool = False):
+        slot = self._index[node]
+        return [self._edge_tuple(e, keys, data) for e in self._incident(slot, True)]
+
+    def in_edges(self, node: str, data: bool = False, keys: bool = False):
+        slot = self._index[node]
+        return [self._edge_tuple(e, keys, data) for e in self._incident(slot, False)]
+
+    def edges(self, data: bool = False, keys: bool = False) -> Iterator:
+        """Все живые рёбра, сгруппированные по source в порядке добавления узлов."""
+        self._ensure_csr(force=True)
+        alive, offsets = self._edge_alive, self._out_offsets
+        for slot in self._live_slots():
+            if slot + 1 >= len(offsets):
+                continue
+            for e in self._out_order[offsets[slot]:offsets[slot + 1]].tolist():
+                if alive[e]:
+                    yield self._edge_tuple(e, keys, data)
+
+    # ── экспорт / импорт ─────────────────────────────────────────
+    def to_networkx(self) -> nx.MultiDiGraph:
+        G = nx.MultiDiGraph()
+        for node, attrs in self.nodes(data=True):
+            G.add_node(node, **attrs)
+        for u, v, attrs in self.edges(data=True):
+            G.add_edge(u, v, **attrs)
+        return G
+
+    def to_node_link(self) -> Dict[str, Any]:
+        """node-link словарь в формате nx.node_link_data(edges="edges"), без промежуточного networkx-графа."""
+        return {
+            "directed": True,
+            "multigraph": True,
+            "graph": {},
+            "nodes": [attrs.copy() for _, attrs in self.nodes(data=True)],
+            "edges": [
+                {"source": u, "target": v, "key": key, **attrs}
+                for u, v, key, attrs in self.edges(keys=True, data=True)
+            ],
+        }
+
+    @classmethod
+    def from_node_link(cls, data: Dict[str, Any]) -> "CompactGraph":
+        """Граф из node-link словаря (своего или записанного networkx-бэкендом); ключи рёбер перенумеровываются."""
+        graph = cls()
+        for node in data.get("nodes", []):
+            attrs = dict(node)
+            graph.add_node(attrs.pop("id"), **attrs)
+        for edge in data.get("edges", []):
+            attrs = {k: v for k, v in edge.items() if k not in ("source", "target", "key")}
+            graph.add_edge(edge["source"], edge["target"], **attrs)
+        return graph
+
+    @classmethod
+    def from_networkx(cls, G: nx.MultiDiGraph) -> "CompactGraph":
+        graph = cls()
+        for node, attrs in G.nodes(data=True):
+            graph.add_node(node, **attrs)
+        for u, v, attrs in G.edges(data=True):
+            graph.add_edge(u, v, **attrs)
+        return graph
+
+
+GRAPH_BACKENDS = ("networkx", "compact")
+
+
+def make_graph(backend: str = "networkx"):
+    """Пустой граф выбранного бэкенда."""
+    if backend == "compact":
+        return CompactGraph()
+    if backend == "networkx":
+        return nx.MultiDiGraph()
+    raise ValueError(f"Неизвестный GRAPH_BACKEND: {backend!r} (ожидается один из {GRAPH_BACKENDS})")
+
+
+def to_networkx(G) -> nx.MultiDiGraph:
+    """networkx-граф как есть, компактный — конвертированный (для GraphML)."""
+    return G.to_networkx() if isinstance(G, CompactGraph) else G
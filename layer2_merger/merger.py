@@ -1,9 +1,12 @@
+import os
+import json
 import logging
 import asyncio
-import numpy as np
 import networkx as nx
-from collections import defaultdict
-from typing import List, Tuple, Dict, Any, Optional
+import community as community_louvain
+from enum import Enum
+from collections import defaultdict, deque
+from typing import List, Tuple, Dict, Any, Optional, Set, Union
 from pydantic import BaseModel, Field
 
 from schemas.graph import (
@@ -14,9 +17,43 @@ from schemas.enums import TZSectionEnum, NodeLabel, EdgeRelation
 from utils.llm_client import acall_llm_json
 from utils.state_logger import log_graphml, log_pydantic
 from utils.embeddings import aget_embeddings_safe
+from utils.vector_index import VectorIndex, normalize_rows, similar_pairs
+from .edge_index import EdgeIndex
+from .graph_store import CompactGraph, make_graph, to_networkx
 
 logger = logging.getLogger(__name__)
 
+# networkx — nx.MultiDiGraph; compact — CompactGraph на массивах (меньше памяти на больших графах)
+GRAPH_BACKEND = os.getenv("GRAPH_BACKEND", "networkx")
+# GraphML-дампы графа в logs/ для компактного бэкенда — только по явному запросу (требуют конвертации в networkx)
+COMPACT_GRAPH_DEBUG_DUMPS = os.getenv("COMPACT_GRAPH_DEBUG_DUMPS", "0") == "1"
+# batch — слияние после майнинга всех источников; online — подграфы вливаются по мере майнинга (consume_subgraphs)
+MERGE_MODE = os.getenv("MERGE_MODE", "batch")
+# Порог косинусного сходства для кандидатов в дубли и сколько соседей ищем на узел в online-режиме
+DUPLICATE_SIMILARITY_THRESHOLD = 0.88
+ONLINE_DUPLICATE_TOP_K = 5
+# Сколько пакетов кластеров-кандидатов проверяется LLM одновременно (по всем label сразу)
+MERGE_VERIFY_CONCURRENCY = int(os.getenv("MERGE_VERIFY_CONCURRENCY", "8"))
+# Мелкие кластеры упаковываются в один промпт, пока суммарно узлов не больше MERGE_PACK_MAX_NODES
+MERGE_PACK_MAX_NODES = int(os.getenv("MERGE_PACK_MAX_NODES", "24"))
+
+# Поиск конфликтов: технические узлы режутся на партиции не больше CONFLICT_PARTITION_SIZE
+# (сообщества по top-k сходству и рёбрам графа), партиции проверяются параллельно;
+# соседи, разрезанные границей партиций, проверяются отдельными межпартиционными группами
+CONFLICT_PARTITION_SIZE = int(os.getenv("CONFLICT_PARTITION_SIZE", "60"))
+CONFLICT_CHECK_CONCURRENCY = int(os.getenv("CONFLICT_CHECK_CONCURRENCY", "8"))
+CONFLICT_NEIGHBOURS_TOP_K = 8
+CONFLICT_NEIGHBOUR_THRESHOLD = 0.3
+CONFLICT_LOUVAIN_RANDOM_STATE = 42
+TECH_LABELS = (NodeLabel.COMPONENT.value, NodeLabel.CONCEPT.value, NodeLabel.REQUIREMENT.value)
+
+_VERIFY_PROMPT = """Ты Архитектор. Перед тобой кластеры узлов, отобранных по семантическому сходству.
+Для КАЖДОГО кластера проверь: это действительно одна и та же сущность или разные?
+- Дубликаты → is_duplicate=true, верни MergeAction (по одному на кластер).
+- Разные → для этого кластера ничего не возвращай.
+Сливать можно только узлы из ОДНОГО кластера.
+Выбирай unified_id из существующих (предпочти более короткий)."""
+
 
 class MergeAction(BaseModel):
     is_duplicate: bool = Field(description="Это одна и та же сущность?")
@@ -43,28 +80,25 @@ class ConflictBatchResult(BaseModel):
     conflicts: List[DetectedConflict] = Field(default_factory=list)
 
 
-def _cosine_similarity(v1: List[float], v2: List[float]) -> float:
-    a, b = np.array(v1), np.array(v2)
-    norm = np.linalg.norm(a) * np.linalg.norm(b)
-    return float(np.dot(a, b) / norm) if norm > 0 else 0.0
+def _node_text(node: Dict[str, Any]) -> str:
+    return f"{node['name']} {node.get('desc', '')}".strip()
 
 
 async def _find_duplicate_candidates(
         nodes: List[Dict[str, Any]],
-        similarity_threshold: float = 0.88,
+        similarity_threshold: float = DUPLICATE_SIMILARITY_THRESHOLD,
+        top_k: Optional[int] = None,
 ) -> List[Tuple[Dict, Dict, float]]:
     if len(nodes) < 2:
         return []
-    texts = [f"{n['name']} {n.get('desc', '')}".strip() for n in nodes]
+    texts = [_node_text(n) for n in nodes]
 
-    embeddings = await aget_embeddings_safe(texts, batch_size=20, delay=0.5)
+    embeddings = await aget_embeddings_safe(texts, batch_size=20, call_site="merger.embed_nodes")
 
-    candidates = []
-    for i in range(len(nodes)):
-        for j in range(i + 1, len(nodes)):
-            sim = _cosine_similarity(embeddings[i], embeddings[j])
-            if sim >= similarity_threshold:
-                candidates.append((nodes[i], nodes[j], sim))
+    candidates = [
+        (nodes[i], nodes[j], sim)
+        for i, j, sim in similar_pairs(embeddings, similarity_threshold, top_k=top_k)
+    ]
     logger.info(
         f"  -> Embedding pre-filter: {len(nodes)} узлов → "
         f"{len(candidates)} пар-кандидатов (threshold={similarity_threshold})"
@@ -72,7 +106,156 @@ async def _find_duplicate_candidates(
     return candidates
 
 
-def resolve_decisions(G: nx.MultiDiGraph) -> List[DecisionResolution]:
+def _cluster_candidates(candidates: List[Tuple[Dict, Dict, float]]) -> List[List[str]]:
+    """Связные компоненты графа пар-кандидатов (в порядке появления пар)."""
+    id_to_cluster: Dict[str, int] = {}
+    clusters: Dict[int, List[str]] = {}
+    counter = 0
+
+    for node_a, node_b, _ in candidates:
+        id_a, id_b = node_a["id"], node_b["id"]
+        ca, cb = id_to_cluster.get(id_a), id_to_cluster.get(id_b)
+
+        if ca is None and cb is None:
+            clusters[counter] = [id_a, id_b]
+            id_to_cluster[id_a] = id_to_cluster[id_b] = counter
+            counter += 1
+        elif ca is None:
+            clusters[cb].append(id_a)
+            id_to_cluster[id_a] = cb
+        elif cb is None:
+            clusters[ca].append(id_b)
+            id_to_cluster[id_b] = ca
+        elif ca != cb:
+            for nid in clusters[cb]:
+                id_to_cluster[nid] = ca
+            clusters[ca].extend(clusters.pop(cb))
+
+    return list(clusters.values())
+
+
+def _pack_clusters(clusters: List[List[Any]], max_nodes: int) -> List[List[List[Any]]]:
+    """Жадно собирает подряд идущие кластеры в пакеты до max_nodes узлов; крупный кластер идёт отдельно."""
+    packs: List[List[List[Any]]] = []
+    current: List[List[Any]] = []
+    current_size = 0
+    for cluster in clusters:
+        if current and current_size + len(cluster) > max_nodes:
+            packs.append(current)
+            current, current_size = [], 0
+        current.append(cluster)
+        current_size += len(cluster)
+    if current:
+        packs.append(current)
+    return packs
+
+
+def _split_community(members: List[int], neighbours: Dict[int, Dict[int, float]], max_size: int) -> List[List[int]]:
+    """Большое сообщество режется на куски по BFS-порядку, чтобы соседи по сходству оставались вместе."""
+    member_set = set(members)
+    order: List[int] = []
+    visited: Set[int] = set()
+    for start in members:
+        if start in visited:
+            continue
+        queue = deque([start])
+        visited.add(start)
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for nb, _ in sorted(neighbours.get(node, {}).items(), key=lambda x: (-x[1], x[0])):
+                if nb in member_set and nb not in visited:
+                    visited.add(nb)
+                    queue.append(nb)
+    return [order[i:i + max_size] for i in range(0, len(order), max_size)]
+
+
+def conflict_neighbours(vectors, graph_links: List[Tuple[int, int]]) -> Dict[int, Dict[int, float]]:
+    """Соседи узлов 0..n-1: top-k по эмбеддингам (вес — сходство) плюс рёбра исходного графа (вес 1)."""
+    neighbours: Dict[int, Dict[int, float]] = defaultdict(dict)
+    for i, j, sim in similar_pairs(vectors, CONFLICT_NEIGHBOUR_THRESHOLD, top_k=CONFLICT_NEIGHBOURS_TOP_K):
+        neighbours[i][j] = neighbours[j][i] = sim
+    for i, j in graph_links:
+        if i != j:
+            neighbours[i][j] = neighbours[j][i] = max(neighbours[i].get(j, 0.0), 1.0)
+    return neighbours
+
+
+def partition_for_conflicts(
+        vectors,
+        graph_links: List[Tuple[int, int]],
+        max_size: int = CONFLICT_PARTITION_SIZE,
+        neighbours: Optional[Dict[int, Dict[int, float]]] = None,
+) -> List[List[int]]:
+    """
+    Делит узлы 0..n-1 на партиции не больше max_size (каждый узел — ровно в одной):
+    сообщества Louvain на графе соседей (conflict_neighbours, можно передать готовых),
+    крупные сообщества режутся, мелкие упаковываются подряд.
+    """
+    n = len(vectors)
+    if neighbours is None:
+        neighbours = conflict_neighbours(vectors, graph_links)
+
+    link_graph = nx.Graph()
+    link_graph.add_nodes_from(range(n))
+    link_graph.add_weighted_edges_from((i, j, w) for i, nbs in neighbours.items() for j, w in nbs.items() if i < j)
+    partition = community_louvain.best_partition(link_graph, random_state=CONFLICT_LOUVAIN_RANDOM_STATE)
+
+    communities: Dict[int, List[int]] = {}
+    for node in range(n):
+        communities.setdefault(partition[node], []).append(node)
+
+    pieces: List[List[int]] = []
+    for members in communities.values():
+        if len(members) > max_size:
+            pieces.extend(_split_community(members, neighbours, max_size))
+        else:
+            pieces.append(members)
+
+    return [[i for piece in pack for i in piece] for pack in _pack_clusters(pieces, max_size)]
+
+
+def boundary_groups(
+        neighbours: Dict[int, Dict[int, float]],
+        parts: List[List[int]],
+        max_size: int = CONFLICT_PARTITION_SIZE,
+) -> List[List[int]]:
+    """
+    Группы для проверки конфликтов МЕЖДУ партициями: соседние узлы (top-k по эмбеддингам
+    или связь в графе), оказавшиеся в разных партициях, собираются по паре партиций;
+    большие группы режутся BFS-порядком, мелкие упаковываются до max_size.
+    """
+    part_of = {i: p for p, part in enumerate(parts) for i in part}
+    by_pair: Dict[Tuple[int, int], Dict[int, None]] = {}
+    for i, nbs in neighbours.items():
+        for j in nbs:
+            a, b = part_of[i], part_of[j]
+            if i < j and a != b:
+                group = by_pair.setdefault((min(a, b), max(a, b)), {})
+                group[i] = group[j] = None
+
+    pieces: List[List[int]] = []
+    for pair in sorted(by_pair):
+        members = sorted(by_pair[pair])
+        if len(members) > max_size:
+            pieces.extend(_split_community(members, neighbours, max_size))
+        else:
+            pieces.append(members)
+    return [[i for piece in pack for i in piece] for pack in _pack_clusters(pieces, max_size)]
+
+
+def resolve_decisions(G: Union[nx.MultiDiGraph, CompactGraph], index: Optional[EdgeIndex] = None) -> List[DecisionResolution]:
+    """
+    Подсчёт голосов по каждому Decision. Варианты (RELATES_TO) и голоса берутся из индекса рёбер
+    (без индекса он строится по графу один раз); RESOLVED_TO-рёбра победителей попадают и в граф, и в индекс.
+    Эти рёбра помечены derived=True: они пересчитываются при каждой финализации и в состояние не сохраняются.
+    """
+    if index is None:
+        index = EdgeIndex.from_graph(G)
+    # Варианты всех Decision — один проход по RELATES_TO-рёбрам индекса вместо out_edges каждого Decision
+    options_by_decision: Dict[str, List[str]] = defaultdict(list)
+    for u, v, _ in index.edges_by_relation(EdgeRelation.RELATES_TO):
+        options_by_decision[u].append(v)
     resolutions: List[DecisionResolution] = []
     decision_nodes = [
         (nid, data) for nid, data in G.nodes(data=True)
@@ -82,10 +265,7 @@ def resolve_decisions(G: nx.MultiDiGraph) -> List[DecisionResolution]:
     for decision_id, decision_data in decision_nodes:
         decision_name = decision_data.get("name", decision_id)
 
-        option_ids = [
-            v for _, v, edata in G.out_edges(decision_id, data=True)
-            if edata.get("relation") in (EdgeRelation.RELATES_TO.value, EdgeRelation.RELATES_TO)
-        ]
+        option_ids = options_by_decision.get(decision_id, [])
 
         if not option_ids:
             logger.warning(f"⚠️ Decision '{decision_id}' не имеет вариантов (RELATES_TO рёбра не найдены)")
@@ -96,22 +276,16 @@ def resolve_decisions(G: nx.MultiDiGraph) -> List[DecisionResolution]:
             opt_name = G.nodes[opt_id].get("name", opt_id) if G.has_node(opt_id) else opt_id
             vote_counts[opt_id] = VoteCount(option_id=opt_id, option_name=opt_name)
 
-        for src, tgt, edata in G.edges(data=True):
-            relation = edata.get("relation", "")
-            if isinstance(relation, EdgeRelation):
-                relation = relation.value
+        for opt_id, vote_count in vote_counts.items():
+            for src, relation in index.votes_for_target(opt_id):
+                voter_name = G.nodes[src].get("name", src) if G.has_node(src) else src
 
-            if tgt not in vote_counts:
-                continue
-
-            voter_name = G.nodes[src].get("name", src) if G.has_node(src) else src
-
-            if relation == EdgeRelation.VOTED_FOR.value:
-                vote_counts[tgt].votes_for += 1
-                vote_counts[tgt].voters_for.append(voter_name)
-            elif relation == EdgeRelation.VOTED_AGAINST.value:
-                vote_counts[tgt].votes_against += 1
-                vote_counts[tgt].voters_against.append(voter_name)
+                if relation == EdgeRelation.VOTED_FOR.value:
+                    vote_count.votes_for += 1
+                    vote_count.voters_for.append(voter_name)
+                elif relation == EdgeRelation.VOTED_AGAINST.value:
+                    vote_count.votes_against += 1
+                    vote_count.voters_against.append(voter_name)
 
         options_list = list(vote_counts.values())
 
@@ -150,12 +324,14 @@ def resolve_decisions(G: nx.MultiDiGraph) -> List[DecisionResolution]:
                     is_tie=False,
                     options=options_list,
                 )
-                G.add_edge(
+                key = G.add_edge(
                     decision_id,
                     top.option_id,
                     relation=EdgeRelation.RESOLVED_TO.value,
                     evidence=f"Победитель голосования: {top.votes_for} за, {top.votes_against} против",
+                    derived=True,
                 )
+                index.add(decision_id, top.option_id, key, EdgeRelation.RESOLVED_TO)
                 logger.info(
                     f"  🗳️  '{decision_name}': победил '{top.option_name}' "
                     f"({top.votes_for}✅ / {top.votes_against}❌)"
@@ -215,11 +391,79 @@ def format_merge_report(
 
 
 class SmartGraphMerger:
-    def __init__(self):
-        self.G = nx.MultiDiGraph()
+    def __init__(self, backend: str = GRAPH_BACKEND):
+        self.backend = backend
+        self.G = make_graph(backend)
+        # relation → рёбра и вариант → голоса; меняется только через _add_edge / _remove_node
+        self.edge_index = EdgeIndex()
         self.conflicts: List[Conflict] = []
         self.active_conflicts: List[DetectedConflict] = []
         self.logged_merge_actions: List[MergeAction] = []
+        # Граф загружен из прошлого запуска: дедуплицируем только кластеры с новыми узлами
+        self.loaded_from_state = False
+        # Online-режим: индекс эмбеддингов узлов по label и куда ушли слитые ID (old → unified)
+        self.label_indexes: Dict[str, VectorIndex] = {}
+        self.merged_aliases: Dict[str, str] = {}
+
+    def save_graph(self, path: str):
+        """
+        Сохраняет текущий граф (node-link JSON) для инкрементальных запусков.
+        Рёбра, выведенные финализацией (derived), не сохраняются: следующий запуск посчитает их заново.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if isinstance(self.G, CompactGraph):
+            data = self.G.to_node_link()
+        else:
+            data = nx.node_link_data(self.G, edges="edges")
+        data["edges"] = [edge for edge in data["edges"] if not edge.get("derived")]
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, default=lambda v: v.value if isinstance(v, Enum) else str(v))
+        os.replace(tmp_path, path)
+        logger.info(f"💾 Граф сохранён: {path} ({self.G.number_of_nodes()} узлов)")
+
+    def load_graph(self, path: str) -> bool:
+        """Загружает граф прошлого запуска; дельты новых подграфов будут влиты в него."""
+        if not os.path.exists(path):
+            return False
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if self.backend == "compact":
+            self.G = CompactGraph.from_node_link(data)
+        else:
+            self.G = nx.node_link_graph(data, directed=True, multigraph=True, edges="edges")
+        self.edge_index = EdgeIndex.from_graph(self.G)
+        self.loaded_from_state = True
+        logger.info(f"♻️ Загружен граф прошлого запуска: {self.G.number_of_nodes()} узлов, {self.G.number_of_edges()} связей")
+        return True
+
+    def _log_graph(self, filename: str):
+        """Отладочный GraphML; компактный граф выгружается только с COMPACT_GRAPH_DEBUG_DUMPS=1."""
+        if isinstance(self.G, CompactGraph) and not COMPACT_GRAPH_DEBUG_DUMPS:
+            return
+        log_graphml(filename, to_networkx(self.G))
+
+    def _add_edge(self, u: str, v: str, **data):
+        key = self.G.add_edge(u, v, **data)
+        self.edge_index.add(u, v, key, data.get("relation"))
+
+    def _add_extracted_edge(self, u: str, v: str, **data):
+        """
+        Ребро из подграфа майнера. В граф прошлого запуска тот же факт (source, target, relation, evidence)
+        второй раз не добавляется: хвост уже обработанных сообщений (INCREMENTAL_OVERLAP_MESSAGES)
+        майнится повторно, и его голоса иначе посчитались бы дважды.
+        """
+        if self.loaded_from_state and self.G.has_node(u) and any(
+                target == v and edata.get("relation") == data.get("relation")
+                and edata.get("evidence", "") == data.get("evidence", "")
+                for _, target, edata in self.G.out_edges(u, data=True)
+        ):
+            return
+        self._add_edge(u, v, **data)
+
+    def _remove_node(self, node: str):
+        self.edge_index.discard_node(self.G, node)
+        self.G.remove_node(node)
 
     async def merge_subgraphs_and_deduplicate(self, subgraphs: List[ExtractedKnowledge]):
         """
@@ -227,22 +471,157 @@ class SmartGraphMerger:
         """
         logger.info("🔗 СЛОЙ 2 (Шаг 1): Загрузка подграфов и дедупликация...")
 
+        new_node_ids: Set[str] = set()
         for sg in subgraphs:
             for node in sg.nodes:
                 if not self.G.has_node(node.id):
                     self.G.add_node(node.id, **node.model_dump(mode='json'))
+                    new_node_ids.add(node.id)
             for edge in sg.edges:
                 edge_data = edge.model_dump(mode='json', exclude={'source', 'target'})
-                self.G.add_edge(edge.source, edge.target, **edge_data)
+                self._add_extracted_edge(edge.source, edge.target, **edge_data)
 
         logger.info(f"  -> Исходный размер графа: {self.G.number_of_nodes()} узлов, {self.G.number_of_edges()} связей.")
-        log_graphml("layer2_step1_initial_combined.graphml", self.G)
+        self._log_graph("layer2_step1_initial_combined.graphml")
 
-        await self._deduplicate_with_embeddings()
+        await self._deduplicate_with_embeddings(only_ids=new_node_ids if self.loaded_from_state else None)
 
         log_pydantic("layer2_step2_merge_actions.json", MergeBatchResult(actions=self.logged_merge_actions))
         logger.info("✅ Этап 1 завершен. Граф очищен от явных дублей.")
 
+    def _resolve_alias(self, node_id: str) -> str:
+        """ID, в который узел был слит (с учётом цепочек слияний)."""
+        seen = set()
+        while node_id in self.merged_aliases and node_id not in seen:
+            seen.add(node_id)
+            node_id = self.merged_aliases[node_id]
+        return node_id
+
+    async def consume_subgraphs(self, queue: "asyncio.Queue[Optional[ExtractedKnowledge]]"):
+        """
+        Online-слияние (MERGE_MODE=online): забирает подграфы из очереди, пока майнинг ещё идёт.
+        None в очереди — майнинг закончен. Всё, что накопилось за время предыдущей проверки,
+        вливается одной порцией: эмбеддинги только новых узлов, поиск по индексу label, проверка кандидатов.
+        """
+        logger.info("🔗 СЛОЙ 2 (online): слияние подграфов по мере майнинга...")
+        await self._index_existing_nodes()
+        done = False
+        merged_subgraphs = 0
+        while not done:
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            done = None in batch
+            subgraphs = [sg for sg in batch if sg is not None]
+            if not subgraphs:
+                continue
+            try:
+                await self._merge_online_batch(subgraphs)
+            except Exception as e:
+                logger.error(f"Ошибка online-слияния порции из {len(subgraphs)} подграфов: {e}")
+            merged_subgraphs += len(subgraphs)
+
+        logger.info(
+            f"  -> Online: влито {merged_subgraphs} подграфов, граф: "
+            f"{self.G.number_of_nodes()} узлов, {self.G.number_of_edges()} связей"
+        )
+        self._log_graph("layer2_step1_initial_combined.graphml")
+        log_pydantic("layer2_step2_merge_actions.json", MergeBatchResult(actions=self.logged_merge_actions))
+        logger.info("✅ Этап 1 (online) завершен. Граф очищен от явных дублей.")
+
+    def merge_aliased_nodes(self, aliases: Dict[str, str]):
+        """
+        Online-режим: подграфы уже влиты со своими ID, а майнер после майнинга свёл часть записей
+        глоссариев источников (old → new) — соответствующие узлы сливаются в графе.
+        """
+        for old_id, new_id in aliases.items():
+            old_id, new_id = self._resolve_alias(old_id), self._resolve_alias(new_id)
+            if old_id == new_id or not self.G.has_node(old_id):
+                continue
+            primary = self.G.nodes[new_id] if self.G.has_node(new_id) else self.G.nodes[old_id]
+            action = MergeAction(
+                is_duplicate=True,
+                ids_to_merge=[new_id, old_id],
+                unified_id=new_id,
+                unified_name=primary.get("name", new_id),
+                unified_desc=primary.get("description", ""),
+            )
+            self.logged_merge_actions.append(action)
+            self._merge_nodes_in_graph(action)
+            logger.info(f"     🔗 Слито по глоссарию: {old_id} → {new_id}")
+
+    async def _index_existing_nodes(self):
+        """Узлы графа прошлого запуска попадают в индексы label до первой порции подграфов."""
+        nodes = [
+            {"id": nid, "label": data.get("label", "unknown"), "name": data.get("name", ""),
+             "desc": data.get("description", "")}
+            for nid, data in self.G.nodes(data=True)
+            if nid not in self.label_indexes.get(data.get("label", "unknown"), ())
+        ]
+        if nodes:
+            await self._embed_into_indexes(nodes)
+
+    async def _embed_into_indexes(self, nodes: List[Dict[str, Any]]) -> List[List[float]]:
+        vectors = await aget_embeddings_safe(
+            [_node_text(n) for n in nodes], batch_size=20, call_site="merger.embed_nodes"
+        )
+        by_label: Dict[str, List[int]] = defaultdict(list)
+        for i, n in enumerate(nodes):
+            by_label[n["label"]].append(i)
+        for label, positions in by_label.items():
+            self.label_indexes.setdefault(label, VectorIndex()).add(
+                [nodes[i]["id"] for i in positions], [vectors[i] for i in positions]
+            )
+        return vectors
+
+    async def _merge_online_batch(self, subgraphs: List[ExtractedKnowledge]):
+        new_nodes: List[Dict[str, Any]] = []
+        for sg in subgraphs:
+            for node in sg.nodes:
+                node_id = self._resolve_alias(node.id)
+                if not self.G.has_node(node_id):
+                    self.G.add_node(node_id, **{**node.model_dump(mode='json'), "id": node_id})
+                    new_nodes.append({
+                        "id": node_id, "label": node.label.value, "name": node.name, "desc": node.description,
+                    })
+            for edge in sg.edges:
+                source, target = self._resolve_alias(edge.source), self._resolve_alias(edge.target)
+                if source == target:
+                    continue
+                edge_data = edge.model_dump(mode='json', exclude={'source', 'target'})
+                self._add_extracted_edge(source, target, **edge_data)
+
+        if not new_nodes:
+            return
+        vectors = await self._embed_into_indexes(new_nodes)
+
+        # Пары (новый узел, сосед по индексу его label); Decision не дедуплицируем, как и в batch-режиме
+        candidates: List[Tuple[Dict, Dict, float]] = []
+        lookup: Dict[str, Dict[str, Any]] = {}
+        for node, vector in zip(new_nodes, vectors):
+            if node["label"] == NodeLabel.DECISION.value:
+                continue
+            [matches] = self.label_indexes[node["label"]].search(
+                [vector], k=ONLINE_DUPLICATE_TOP_K + 1, threshold=DUPLICATE_SIMILARITY_THRESHOLD
+            )
+            for match_id, sim in matches:
+                if match_id == node["id"] or not self.G.has_node(match_id):
+                    continue
+                lookup.setdefault(node["id"], node)
+                if match_id not in lookup:
+                    data = self.G.nodes[match_id]
+                    lookup[match_id] = {"id": match_id, "name": data.get("name", ""), "desc": data.get("description", "")}
+                candidates.append((lookup[node["id"]], lookup[match_id], sim))
+
+        clusters = [[lookup[nid] for nid in cluster_ids] for cluster_ids in _cluster_candidates(candidates)]
+        if not clusters:
+            return
+        packs = _pack_clusters(clusters, MERGE_PACK_MAX_NODES)
+        logger.info(f"  -> Online: {len(new_nodes)} новых узлов, {len(clusters)} кластеров-кандидатов")
+        semaphore = asyncio.Semaphore(MERGE_VERIFY_CONCURRENCY)
+        pack_actions = await asyncio.gather(*(self._verify_cluster_pack(pack, semaphore) for pack in packs))
+        self._apply_merge_actions(pack_actions)
+
     async def detect_conflicts(self) -> List[DetectedConflict]:
         """
         ЭТАП 2: Поиск логических противоречий.
@@ -251,19 +630,98 @@ class SmartGraphMerger:
 
         tech_nodes = [
             n for n, d in self.G.nodes(data=True)
-            if d.get("label") in ["Component", "Concept", "Requirement"]
+            if d.get("label") in TECH_LABELS
         ]
 
         if not tech_nodes:
             logger.info("  -> Нет технических узлов для анализа конфликтов.")
             return []
 
-        nodes_context = []
-        for nid in tech_nodes[:60]:
-            data = self.G.nodes[nid]
-            nodes_context.append(f"ID: {nid} | Имя: {data.get('name')} | Описание: {data.get('description')}")
+        partitions, boundary = await self._conflict_partitions(tech_nodes)
+        logger.info(
+            f"  -> Проверяем {len(tech_nodes)} технических узлов в {len(partitions)} партициях "
+            f"и {len(boundary)} межпартиционных группах "
+            f"(до {CONFLICT_PARTITION_SIZE} узлов, {CONFLICT_CHECK_CONCURRENCY} одновременно)"
+        )
+
+        semaphore = asyncio.Semaphore(CONFLICT_CHECK_CONCURRENCY)
+        partition_results = await asyncio.gather(
+            *(self._check_conflict_partition(part, semaphore) for part in partitions + boundary)
+        )
+        checked = sum(len(part) for part, found in zip(partitions, partition_results) if found is not None)
+        logger.info(f"  -> Покрытие: проверено {checked}/{len(tech_nodes)} технических узлов")
+
+        # Один и тот же конфликт мог найтись в нескольких партициях: ключ — набор ID вариантов.
+        # ID конфликтов от LLM уникальны только внутри вызова, поэтому выдаём свои, по порядку партиций
+        conflicts: List[DetectedConflict] = []
+        seen_options: Set[frozenset] = set()
+        for found in partition_results:
+            for conflict in found or []:
+                key = frozenset(opt.id for opt in conflict.options)
+                if key in seen_options:
+                    continue
+                seen_options.add(key)
+                conflicts.append(conflict.model_copy(update={"id": f"conflict_{len(conflicts) + 1}"}))
+
+        self.active_conflicts = conflicts
+        if conflicts:
+            logger.warning(f"⚠️ Найдено {len(conflicts)} настоящих конфликтов!")
+        else:
+            logger.info("✅ Логических конфликтов не обнаружено (или найдены только взаимодополняющие технологии).")
+        return conflicts
+
+    async def _conflict_partitions(self, tech_nodes: List[str]) -> Tuple[List[List[str]], List[List[str]]]:
+        """
+        Партиции технических узлов и межпартиционные группы соседей на их границах;
+        небольшой граф проверяется одним вызовом без эмбеддингов.
+        """
+        if len(tech_nodes) <= CONFLICT_PARTITION_SIZE:
+            return [tech_nodes], []
+
+        # В online-режиме векторы узлов уже лежат в индексах label — эмбеддим только недостающие
+        vectors: List[Optional[Any]] = []
+        for nid in tech_nodes:
+            index = self.label_indexes.get(self.G.nodes[nid].get("label"))
+            vectors.append(index.get(nid) if index is not None else None)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            embedded = await aget_embeddings_safe(
+                [_node_text({"name": self.G.nodes[tech_nodes[i]].get("name", ""),
+                             "desc": self.G.nodes[tech_nodes[i]].get("description", "")}) for i in missing],
+                batch_size=20, call_site="merger.embed_conflict_nodes",
+            )
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+
+        position = {nid: i for i, nid in enumerate(tech_nodes)}
+        graph_links = [
+            (position[u], position[v])
+            for u in tech_nodes
+            for _, v in self.G.out_edges(u)
+            if v in position
+        ]
+        parts, boundary = await asyncio.to_thread(self._partition_with_boundary, normalize_rows(vectors), graph_links)
+        return (
+            [[tech_nodes[i] for i in part] for part in parts],
+            [[tech_nodes[i] for i in group] for group in boundary],
+        )
 
-        nodes_desc = "\n".join(nodes_context)
+    @staticmethod
+    def _partition_with_boundary(vectors, graph_links: List[Tuple[int, int]]):
+        neighbours = conflict_neighbours(vectors, graph_links)
+        parts = partition_for_conflicts(vectors, graph_links, CONFLICT_PARTITION_SIZE, neighbours)
+        return parts, boundary_groups(neighbours, parts, CONFLICT_PARTITION_SIZE)
+
+    async def _check_conflict_partition(
+            self,
+            partition: List[str],
+            semaphore: asyncio.Semaphore,
+    ) -> Optional[List[DetectedConflict]]:
+        """Конфликты внутри одной партиции; None — вызов не удался (узлы партиции не проверены)."""
+        nodes_desc = "\n".join(
+            f"ID: {nid} | Имя: {self.G.nodes[nid].get('name')} | Описание: {self.G.nodes[nid].get('description')}"
+            for nid in partition
+        )
 
         prompt = """
         Ты Главный Системный Архитектор. Твоя задача — найти ВЗАИМОИСКЛЮЧАЮЩИЕ (конфликтующие) технологические решения или бизнес-требования в списке узлов.
@@ -287,23 +745,17 @@ class SmartGraphMerger:
         """
 
         try:
-            result = await acall_llm_json(
-                schema=ConflictBatchResult,
-                prompt=prompt,
-                data=nodes_desc
-            )
-            self.active_conflicts = result.conflicts
-
-            if self.active_conflicts:
-                logger.warning(f"⚠️ Найдено {len(self.active_conflicts)} настоящих конфликтов!")
-            else:
-                logger.info("✅ Логических конфликтов не обнаружено (или найдены только взаимодополняющие технологии).")
-
+            async with semaphore:
+                result = await acall_llm_json(
+                    schema=ConflictBatchResult,
+                    prompt=prompt,
+                    data=nodes_desc,
+                    call_site="merger.detect_conflicts",
+                )
             return result.conflicts
-
         except Exception as e:
-            logger.error(f"Ошибка поиска конфликтов: {e}")
-            return []
+            logger.error(f"Ошибка поиска конфликтов в партиции из {len(partition)} узлов: {e}")
+            return None
 
     def apply_resolutions(self, resolutions: List[ConflictResolution]):
         """
@@ -323,15 +775,20 @@ class SmartGraphMerger:
                 logger.info(f"  -> Победил: {winner_id}")
                 for loose_id in all_option_ids:
                     if loose_id != winner_id and self.G.has_node(loose_id):
-                        self.G.remove_node(loose_id)
+                        self._remove_node(loose_id)
 
             elif res.custom_text:
                 logger.info(f"  -> Свой вариант: {res.custom_text}")
                 for old_id in all_option_ids:
                     if self.G.has_node(old_id):
-                        self.G.remove_node(old_id)
+                        self._remove_node(old_id)
 
                 new_id = f"custom_{res.conflict_id}"[:30]
+                # ID конфликтов нумеруются заново каждый запуск: решение прошлого запуска не затираем
+                suffix = 1
+                while self.G.has_node(new_id):
+                    suffix += 1
+                    new_id = f"custom_{res.conflict_id}"[:27] + f"_{suffix}"
                 self.G.add_node(
                     new_id,
                     name=res.custom_text,
@@ -349,7 +806,7 @@ class SmartGraphMerger:
         logger.info("🏁 СЛОЙ 2 (Шаг 4): Финализация графа...")
 
         logger.info("  -> Разрешение голосований...")
-        resolutions = resolve_decisions(self.G)
+        resolutions = resolve_decisions(self.G, self.edge_index)
 
         await self._assign_sections()
 
@@ -384,7 +841,7 @@ class SmartGraphMerger:
         )
 
         # --- LOGGING ---
-        log_graphml("layer2_step3_final_unified.graphml", self.G)
+        self._log_graph("layer2_step3_final_unified.graphml")
         log_pydantic("layer2_step3_final_unified.json", unified_graph)
 
         report = format_merge_report(resolutions, self.conflicts)
@@ -393,7 +850,12 @@ class SmartGraphMerger:
 
         return unified_graph
 
-    async def _deduplicate_with_embeddings(self):
+    async def _deduplicate_with_embeddings(self, only_ids: Optional[Set[str]] = None):
+        """
+        only_ids — проверять только кластеры, где есть хотя бы один из этих узлов (дельта запуска).
+        Кандидаты ищутся по всем label параллельно, кластеры проверяются пакетами с ограниченной
+        параллельностью, а слияния применяются к графу после всех проверок — в порядке label и кластеров.
+        """
         nodes_by_label: Dict[str, List[Dict[str, Any]]] = {}
         for nid, data in self.G.nodes(data=True):
             label = data.get("label", "unknown")
@@ -401,69 +863,100 @@ class SmartGraphMerger:
                 {"id": nid, "name": data.get("name", ""), "desc": data.get("description", "")}
             )
 
-        for label, nodes in nodes_by_label.items():
-            if len(nodes) < 2:
-                continue
-
-            if label in (NodeLabel.DECISION.value, NodeLabel.DECISION):
-                continue
-
+        groups = [
+            (label, nodes) for label, nodes in nodes_by_label.items()
+            if len(nodes) >= 2 and label not in (NodeLabel.DECISION.value, NodeLabel.DECISION)
+        ]
+        for label, nodes in groups:
             logger.info(f"  -> Дедупликация группы '{label}' ({len(nodes)} узлов)...")
-            candidates = await _find_duplicate_candidates(nodes, similarity_threshold=0.88)
+        candidate_lists = await asyncio.gather(
+            *(_find_duplicate_candidates(nodes) for _, nodes in groups)
+        )
 
+        clusters: List[List[Dict[str, Any]]] = []
+        for (label, nodes), candidates in zip(groups, candidate_lists):
             if not candidates:
                 logger.info(f"     Дубликатов не найдено в '{label}'")
                 continue
-
-            id_to_cluster: Dict[str, int] = {}
-            clusters: Dict[int, List[str]] = {}
-            counter = 0
-
-            for node_a, node_b, _ in candidates:
-                id_a, id_b = node_a["id"], node_b["id"]
-                ca, cb = id_to_cluster.get(id_a), id_to_cluster.get(id_b)
-
-                if ca is None and cb is None:
-                    clusters[counter] = [id_a, id_b]
-                    id_to_cluster[id_a] = id_to_cluster[id_b] = counter
-                    counter += 1
-                elif ca is None:
-                    clusters[cb].append(id_a);
-                    id_to_cluster[id_a] = cb
-                elif cb is None:
-                    clusters[ca].append(id_b);
-                    id_to_cluster[id_b] = ca
-                elif ca != cb:
-                    for nid in clusters[cb]: id_to_cluster[nid] = ca
-                    clusters[ca].extend(clusters.pop(cb))
-
             node_lookup = {n["id"]: n for n in nodes}
-            for cluster_ids in clusters.values():
+            for cluster_ids in _cluster_candidates(candidates):
                 cluster_nodes = [node_lookup[nid] for nid in cluster_ids if nid in node_lookup]
                 if len(cluster_nodes) < 2:
                     continue
+                if only_ids is not None and not any(n["id"] in only_ids for n in cluster_nodes):
+                    continue
+                clusters.append(cluster_nodes)
+
+        if not clusters:
+            return
 
-                data_str = "\n".join(
-                    [f"ID: {n['id']} | Имя: {n['name']} | Описание: {n['desc']}"
-                     for n in cluster_nodes]
+        packs = _pack_clusters(clusters, MERGE_PACK_MAX_NODES)
+        logger.info(
+            f"  -> LLM-верификация: {len(clusters)} кластеров в {len(packs)} пакетах "
+            f"(до {MERGE_VERIFY_CONCURRENCY} одновременно)"
+        )
+        semaphore = asyncio.Semaphore(MERGE_VERIFY_CONCURRENCY)
+        pack_actions = await asyncio.gather(*(self._verify_cluster_pack(pack, semaphore) for pack in packs))
+        self._apply_merge_actions(pack_actions)
+
+    def _apply_merge_actions(self, pack_actions: List[List[MergeAction]]):
+        for actions in pack_actions:
+            for action in actions:
+                # Новый unified_id мог уже занять более ранний пакет
+                action.unified_id = self._checked_unified_id(action.unified_id, action.ids_to_merge)
+                self.logged_merge_actions.append(action)
+                self._merge_nodes_in_graph(action)
+                logger.info(f"     🔗 Слито: {action.ids_to_merge} → {action.unified_id}")
+
+    async def _verify_cluster_pack(
+            self,
+            pack: List[List[Dict[str, Any]]],
+            semaphore: asyncio.Semaphore,
+    ) -> List[MergeAction]:
+        """
+        Один вызов на пакет кластеров. Граф не меняется; действие, задевающее несколько кластеров,
+        урезается до кластера первого из его ID.
+        """
+        data_str = "\n\n".join(
+            f"Кластер {i}:\n" + "\n".join(
+                f"ID: {n['id']} | Имя: {n['name']} | Описание: {n['desc']}" for n in cluster
+            )
+            for i, cluster in enumerate(pack, start=1)
+        )
+        cluster_of = {n["id"]: i for i, cluster in enumerate(pack) for n in cluster}
+
+        try:
+            async with semaphore:
+                result: MergeBatchResult = await acall_llm_json(
+                    schema=MergeBatchResult, prompt=_VERIFY_PROMPT, data=data_str,
+                    call_site="merger.verify_duplicates",
                 )
-                prompt = """Ты Архитектор. Перед тобой узлы, отобранные по семантическому сходству.
-Проверь: это действительно одна и та же сущность или разные?
-- Дубликаты → is_duplicate=true, верни MergeAction.
-- Разные → is_duplicate=false, верни пустой список.
-Выбирай unified_id из существующих (предпочти более короткий)."""
+        except Exception as e:
+            logger.error(f"Ошибка LLM верификации кластеров: {e}")
+            return []
 
-                try:
-                    result: MergeBatchResult = await acall_llm_json(
-                        schema=MergeBatchResult, prompt=prompt, data=data_str
-                    )
-                    for action in result.actions:
-                        if action.is_duplicate and len(action.ids_to_merge) > 1:
-                            self.logged_merge_actions.append(action)
-                            self._merge_nodes_in_graph(action)
-                            logger.info(f"     🔗 Слито: {action.ids_to_merge} → {action.unified_id}")
-                except Exception as e:
-                    logger.error(f"Ошибка LLM верификации кластера: {e}")
+        actions: List[MergeAction] = []
+        for action in result.actions:
+            known = [nid for nid in action.ids_to_merge if nid in cluster_of]
+            if not action.is_duplicate or not known:
+                continue
+            ids = [nid for nid in dict.fromkeys(known) if cluster_of[nid] == cluster_of[known[0]]]
+            if len(ids) > 1:
+                actions.append(action.model_copy(update={
+                    "ids_to_merge": ids, "unified_id": self._checked_unified_id(action.unified_id, ids),
+                }))
+        return actions
+
+    def _checked_unified_id(self, unified_id: str, ids: List[str]) -> str:
+        """
+        unified_id принимается, если это ID из сливаемых или новый ID, которого нет в графе;
+        иначе (LLM указала чужой узел) — самый короткий из сливаемых ID.
+        """
+        if unified_id in ids or (unified_id and not self.G.has_node(unified_id)):
+            return unified_id
+        fallback = min(ids, key=len)
+        logger.warning(f"⚠️ unified_id '{unified_id}' вне кластера {ids}, используем '{fallback}'")
+        return fallback
 
     def _merge_nodes_in_graph(self, action: MergeAction):
         valid_ids = [nid for nid in action.ids_to_merge if self.G.has_node(nid)]
@@ -479,18 +972,28 @@ class SmartGraphMerger:
                 "description": action.unified_desc,
             })
             self.G.add_node(primary_id, **base_data)
+        self.merged_aliases.pop(primary_id, None)
+
+        label_index = self.label_indexes.get(self.G.nodes[primary_id].get("label"))
+        if label_index is not None and primary_id not in label_index:
+            vector = next((label_index.get(nid) for nid in valid_ids if nid in label_index), None)
+            if vector is not None:
+                label_index.add([primary_id], [vector])
 
         for old_id in valid_ids:
             if old_id == primary_id: continue
+            self.merged_aliases[old_id] = primary_id
+            if label_index is not None:
+                label_index.remove(old_id)
 # В MultiDiGraph правильно перенаправляем ВСЕ рёбра
             for u, v, data in list(self.G.out_edges(old_id, data=True)):
                 target = primary_id if v == old_id else v
-                self.G.add_edge(primary_id, target, **data)
+                self._add_edge(primary_id, target, **data)
             for u, v, data in list(self.G.in_edges(old_id, data=True)):
                 if u == old_id:
                     continue  # self-loops уже скопированы в out_edges
-                self.G.add_edge(u, primary_id, **data)
-            self.G.remove_node(old_id)
+                self._add_edge(u, primary_id, **data)
+            self._remove_node(old_id)
 
     async def _assign_sections(self):
         logger.info("  -> Распределение узлов по секциям ТЗ...")
@@ -519,7 +1022,8 @@ class SmartGraphMerger:
             data_str = "\n".join([f"ID:{n['id']} | {n['name']}" for n in batch])
             try:
                 result: SectionBatchResult = await acall_llm_json(
-                    schema=SectionBatchResult, prompt=prompt, data=data_str
+                    schema=SectionBatchResult, prompt=prompt, data=data_str,
+                    call_site="merger.assign_sections",
                 )
                 for assignment in result.assignments:
                     if self.G.has_node(assignment.node_id):
@@ -63,7 +63,9 @@ class TZGenerator:
         log_text(f"layer3_prompt_{sec_enum.value}.txt", prompt)
 
         try:
-            content_markdown = await acall_llm_text(prompt=prompt, model_name=self.model_name)
+            content_markdown = await acall_llm_text(
+                prompt=prompt, model_name=self.model_name, call_site="compiler.generate_section"
+            )
             return GeneratedSection(
                 section_id=sec_enum,
                 title=sec_enum.name,
@@ -1,16 +1,20 @@
 import os
+import time
 import asyncio
 import logging
+from typing import List, Optional
 from dotenv import load_dotenv
 
 from schemas.document import DataSource
-from schemas.enums import DataEnum
-from schemas.graph import ConflictResolution
+from schemas.enums import DataEnum, ExtractionMode
+from schemas.graph import ConflictResolution, ExtractedKnowledge
 from layer1_miner.extractor import MinerProcessor
-from layer2_merger.merger import SmartGraphMerger
+from layer1_miner.checkpoint import STATE_DIR, INCREMENTAL
+from layer2_merger.merger import SmartGraphMerger, MERGE_MODE
 from layer3_compiler.generator import TZGenerator
 from utils.test_data_gen import get_backend_chat_dataset, get_frontend_chat_dataset
 from utils.state_logger import init_logs_dir
+from utils.call_ledger import LEDGER
 
 load_dotenv()
 
@@ -29,14 +33,65 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Сколько источников майнится одновременно (общий бюджет запросов — LLM_MAX_IN_FLIGHT и rate limiter).
+# ID сущностей не зависят ни от этого числа, ни от порядка завершения: источник видит только глоссарий
+# на старт майнинга, а после майнинга новые записи источников сводятся по эмбеддингам в порядке источников
+MINER_MAX_SOURCES = int(os.getenv("MINER_MAX_SOURCES", "8"))
+# Режим извлечения экспортов Telegram: full по умолчанию; fast — явный выбор для массового импорта истории
+TELEGRAM_EXPORT_MODE = ExtractionMode(os.getenv("TELEGRAM_EXPORT_MODE", ExtractionMode.FULL.value))
+
+
+async def mine_sources(miner: MinerProcessor, sources: List[DataSource]) -> List[ExtractedKnowledge]:
+    """
+    Параллельный майнинг источников; подграфы возвращаются в порядке источников.
+    Каждый источник майнится по своему снимку глоссария, новые записи вливаются
+    в общий глоссарий после майнинга в порядке источников (упавший источник не вливается),
+    а записи, сведённые по эмбеддингам к записям других источников, переписываются в подграфах.
+    Алиасы (old → new) остаются в miner.glossary_aliases — для online-слияния.
+    """
+    semaphore = asyncio.Semaphore(MINER_MAX_SOURCES)
+    finished = 0
+    source_miners: List[Optional[MinerProcessor]] = [None] * len(sources)
+
+    async def mine_one(idx: int, source: DataSource) -> List[ExtractedKnowledge]:
+        nonlocal finished
+        async with semaphore:
+            logger.info(f"📂 Обработка источника: {source.file_name}")
+            started = time.monotonic()
+            source_miner = miner.for_source()
+            try:
+                subgraphs = await source_miner.process_source(source)
+                source_miners[idx] = source_miner
+            except Exception as e:
+                logger.error(f"❌ Критическая ошибка при обработке {source.file_name}: {e}")
+                subgraphs = []
+            finished += 1
+            logger.info(
+                f"   -> [{finished}/{len(sources)}] {source.file_name}: извлечено {len(subgraphs)} чанков "
+                f"за {time.monotonic() - started:.1f} с"
+            )
+            return subgraphs
+
+    results = await asyncio.gather(*[mine_one(idx, source) for idx, source in enumerate(sources)])
+    aliases = miner.merge_source_glossaries([m for m in source_miners if m is not None])
+    miner.glossary_aliases = aliases
+    subgraphs = [sg for source_subgraphs in results for sg in source_subgraphs]
+    if aliases:
+        subgraphs = [MinerProcessor.apply_aliases(sg, aliases) for sg in subgraphs]
+    return subgraphs
+
 
 async def main():
     print("==================================================")
     print("🚀 ГЕНЕРАТОР ТЗ (HUMAN-IN-THE-LOOP PIPELINE)")
     print("==================================================\n")
 
-    miner = MinerProcessor()
+    # Инкрементальный режим: чекпоинты источников и граф прошлого запуска лежат в STATE_DIR
+    miner = MinerProcessor(state_dir=STATE_DIR if INCREMENTAL else None)
     merger = SmartGraphMerger()
+    graph_state_path = os.path.join(STATE_DIR, "graph.json")
+    if INCREMENTAL:
+        merger.load_graph(graph_state_path)
     compiler = TZGenerator()
 
     # 1. Подготовка источников данных
@@ -52,40 +107,48 @@ async def main():
             file_name="chat_frontend_team"
         )
     ]
+    # Большие экспорты Telegram (result.json) читаются потоково: TELEGRAM_EXPORTS=path1.json:path2.json
+    for path in filter(None, os.getenv("TELEGRAM_EXPORTS", "").split(os.pathsep)):
+        logger.info(f"📥 Экспорт Telegram {path}: режим извлечения {TELEGRAM_EXPORT_MODE.value} (TELEGRAM_EXPORT_MODE)")
+        sources.append(DataSource(
+            source_type=DataEnum.TELEGRAM_EXPORT,
+            content=path,
+            file_name=os.path.splitext(os.path.basename(path))[0],
+            extraction_mode=TELEGRAM_EXPORT_MODE,
+        ))
 
     # --- ЭТАП 1: MINER (Майнинг знаний) ---
     logger.info(">>> СТАРТ ЭТАПА 1: Майнинг знаний")
-    all_extracted_subgraphs = []
-
-    for source in sources:
-        logger.info(f"📂 Обработка источника: {source.file_name}")
+    # Источники майнятся параллельно, каждый по своему снимку глоссария (см. MINER_MAX_SOURCES);
+    # темп запросов держит utils.rate_limiter
+    if MERGE_MODE == "online":
+        # Подграфы вливаются в граф прямо во время майнинга, дедупликация в конце не нужна
+        subgraph_queue: asyncio.Queue = asyncio.Queue()
+        miner.subgraph_queue = subgraph_queue
+        merge_task = asyncio.create_task(merger.consume_subgraphs(subgraph_queue))
         try:
-            # Майнинг подграфов из источника
-            # Важно: В miner.py желательно добавить небольшую задержку между окнами,
-            # но здесь мы добавим задержку между файлами.
-            subgraphs = await miner.process_source(source)
-            all_extracted_subgraphs.extend(subgraphs)
-            logger.info(f"   -> Извлечено {len(subgraphs)} чанков из {source.file_name}")
-            
-            # Задержка 5 секунд, чтобы "остудить" лимит запросов Google API
-            logger.info("⏳ Пауза 5с для соблюдения квоты API...")
-            await asyncio.sleep(5) 
-
-        except Exception as e:
-            logger.error(f"❌ Критическая ошибка при обработке {source.file_name}: {e}")
+            all_extracted_subgraphs = await mine_sources(miner, sources)
+        finally:
+            subgraph_queue.put_nowait(None)
+            await merge_task
+        # Записи глоссариев, сведённые между источниками после майнинга, — слить и в графе
+        merger.merge_aliased_nodes(miner.glossary_aliases)
+    else:
+        all_extracted_subgraphs = await mine_sources(miner, sources)
 
     print("-" * 50)
 
     # --- ЭТАП 2: MERGER (Слияние и Разрешение конфликтов) ---
     logger.info(">>> СТАРТ ЭТАПА 2: Слияние графов")
 
-    if not all_extracted_subgraphs:
+    if not all_extracted_subgraphs and merger.G.number_of_nodes() == 0:
         logger.error("❌ Нет данных для слияния. Завершение работы.")
         return
 
-    # Шаг 2.1: Черновое слияние и дедупликация синонимов
-    logger.info("...Выполняется дедупликация сущностей (Step 1)...")
-    await merger.merge_subgraphs_and_deduplicate(all_extracted_subgraphs)
+    # Шаг 2.1: Черновое слияние и дедупликация синонимов (в online-режиме уже выполнено)
+    if MERGE_MODE != "online":
+        logger.info("...Выполняется дедупликация сущностей (Step 1)...")
+        await merger.merge_subgraphs_and_deduplicate(all_extracted_subgraphs)
 
     # Шаг 2.2: Поиск логических конфликтов
     logger.info("...Поиск противоречий в требованиях (Step 2)...")
@@ -143,6 +206,9 @@ async def main():
     
     # Шаг 2.4: Финализация графа (распределение по секциям)
     unified_graph = await merger.finalize_graph()
+    merger.save_graph(graph_state_path)
+    # Чекпоинты источников — только когда их дельта уже лежит в сохранённом графе
+    miner.commit_checkpoints()
     logger.info(f"✅ Граф готов. Итоговых узлов: {len(unified_graph.nodes)}")
 
     print("-" * 50)
@@ -175,4 +241,8 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    finally:
+        # Сводка по стадиям: где тратятся время и токены
+        LEDGER.report()
\ No newline at end of file
@@ -1,11 +1,12 @@
 from typing import List, Any, Dict, Optional
 from pydantic import BaseModel, Field
-from .enums import TZSectionEnum, DataEnum
+from .enums import TZSectionEnum, DataEnum, ExtractionMode
 
 class DataSource(BaseModel):
     source_type: DataEnum
     content: Any
     file_name: str
+    extraction_mode: ExtractionMode = Field(default=ExtractionMode.FULL, description="fast — для массового импорта истории")
     metadata: Optional[Dict[str, Any]] = Field(default_factory=dict)
 
 class GeneratedSection(BaseModel):
@@ -3,11 +3,17 @@ from enum import Enum
 
 class DataEnum(str, Enum):
     CHAT = "chat"
+    TELEGRAM_EXPORT = "telegram_export"  # content — путь к result.json, читается потоково
     DOCUMENT = "document"
     PLAIN_TEXT = "plain_text"
     GRAPHML = "graphml"
 
 
+class ExtractionMode(str, Enum):
+    FULL = "full"    # 3 прохода + память проекта
+    FAST = "fast"    # один structured-вызов на окно, без памяти проекта
+
+
 class TZSectionEnum(str, Enum):
     GENERAL = "general_info"
     STACK = "tech_stack"
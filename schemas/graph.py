@@ -20,6 +20,29 @@ class MergeDecision(BaseModel):
     target_global_id: Optional[str] = Field(description="ID из глобального глоссария, если дубликат")
     new_id: Optional[str] = Field(description="Новый snake_case ID, если не дубликат")
 
+class EntityLinkDecision(MergeDecision):
+    """MergeDecision для пакетного линкинга: привязан к номеру сущности во входном списке"""
+    entity_index: int = Field(description="Номер сущности из входного списка")
+
+class EntityLinkBatch(BaseModel):
+    decisions: List[EntityLinkDecision] = Field(default_factory=list)
+
+class FastEntity(RawEntity):
+    """Быстрый режим: сущность сразу с привязкой к кандидату глоссария"""
+    glossary_id: Optional[str] = Field(default=None, description="ID из кандидатов глоссария, если это та же сущность")
+
+class FastEdge(BaseModel):
+    source: int = Field(description="Номер исходной сущности в списке entities")
+    target: int = Field(description="Номер целевой сущности в списке entities")
+    relation: EdgeRelation = Field(description="Тип связи")
+    evidence: str = Field(default="", description="Цитата или обоснование связи")
+
+class FastExtraction(BaseModel):
+    """Быстрый режим: сущности, линкинг и рёбра одним вызовом"""
+    summary: str = Field(default="", description="Краткая выжимка окна")
+    entities: List[FastEntity] = Field(default_factory=list)
+    edges: List[FastEdge] = Field(default_factory=list)
+
 class ProjectMemory(BaseModel):
     """Структурированная память между окнами"""
     key_entities: List[str] = Field(default_factory=list, description="Важные ID, упомянутые недавно")
@@ -28,7 +51,7 @@ class ProjectMemory(BaseModel):
     last_mentioned: Dict[str, str] = Field(default_factory=dict, description="id → 'окно X'")
 
 class GraphFix(BaseModel):
-    action: str = Field(description="add_node | remove_node | change_relation | fix_vote")
+    action: str = Field(description="remove_node | remove_edge | add_edge | fix_vote")
     node_id: Optional[str] = None
     edge_source: Optional[str] = None
     edge_target: Optional[str] = None
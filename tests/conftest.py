@@ -0,0 +1,7 @@
+"""Тесты не ходят в сеть: LLM и эмбеддинги — фейковый провайдер, без кэша."""
+import os
+import sys
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("LLM_CACHE", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
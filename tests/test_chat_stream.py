@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from utils.chat_stream import ReplyIndex, iter_export_messages, iter_time_chunks
+
+
+def _write_export(tmp_path, messages, wrap=True):
+    path = tmp_path / "result.json"
+    data = {"name": "Чат", "type": "private_group", "id": 1, "messages": messages} if wrap else messages
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+    return str(path)
+
+
+def _messages(n):
+    return [
+        {
+            "id": i, "type": "message", "date": f"2024-01-01T10:{i % 60:02d}:00", "from": "Аня",
+            "text": [{"type": "bold", "text": "важно"}, f" сообщение №{i} — «кириллица» и \\\" экранирование"],
+            "reactions": [{"emoji": "👍", "count": i}],
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 7, 64, 1 << 20])
+def test_iter_export_messages_buffer_boundaries(tmp_path, read_size):
+    messages = _messages(30)
+    path = _write_export(tmp_path, messages)
+    assert list(iter_export_messages(path, read_size=read_size)) == messages
+
+
+@pytest.mark.parametrize("read_size", [1, 5, 1 << 20])
+def test_iter_export_messages_plain_array(tmp_path, read_size):
+    messages = _messages(5)
+    path = _write_export(tmp_path, messages, wrap=False)
+    assert list(iter_export_messages(path, read_size=read_size)) == messages
+
+
+def test_iter_export_messages_empty_and_broken(tmp_path):
+    assert list(iter_export_messages(_write_export(tmp_path, []), read_size=3)) == []
+
+    no_messages = tmp_path / "no_messages.json"
+    no_messages.write_text('{"name": "Чат"}', encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_export_messages(str(no_messages), read_size=4))
+
+    truncated = tmp_path / "truncated.json"
+    truncated.write_text('{"messages": [{"id": 1}, {"id": 2', encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_export_messages(str(truncated), read_size=4))
+
+
+def test_reply_index_lookup():
+    index = ReplyIndex(preview_chars=5)
+    try:
+        for msg_id in (3, 5, 4, "service_7"):
+            index.add({"id": msg_id, "from": f"user_{msg_id}", "text": f"текст {msg_id}"})
+        # Повтор и сообщение без id не добавляются
+        index.add({"id": 5, "from": "другой", "text": "перезапись"})
+        index.add({"from": "без id", "text": "..."})
+
+        assert len(index) == 4
+        assert index[5] == {"from": "user_5", "text": "текст"}
+        assert index[4] == {"from": "user_4", "text": "текст"}
+        assert index["service_7"]["from"] == "user_service_7"
+        assert 3 in index and 6 not in index and "3" not in index
+        assert index.get(6, "нет") == "нет"
+        with pytest.raises(KeyError):
+            index[6]
+    finally:
+        index.close()
+
+
+def test_iter_time_chunks_indexes_media_replies(tmp_path):
+    messages = [
+        {"id": 1, "type": "message", "date": "2024-01-01T10:00:00", "from": "Аня", "text": "первое"},
+        {"id": 2, "type": "message", "date": "2024-01-01T10:01:00", "from": "Боря", "text": "",
+         "media_type": "sticker"},
+        {"id": 3, "type": "service", "date": "2024-01-01T10:02:00", "text": ""},
+        {"id": 4, "type": "message", "date": "2024-01-01T10:03:00", "from": "Аня", "text": "ответ на стикер",
+         "reply_to_message_id": 2},
+        {"id": 5, "type": "message", "date": "2024-01-01T20:00:00", "from": "Боря", "text": "после паузы"},
+    ]
+    path = _write_export(tmp_path, messages)
+    index = ReplyIndex()
+    try:
+        chunks = list(iter_time_chunks(path, reply_index=index, gap_hours=4))
+        assert [[m["id"] for m in chunk] for chunk in chunks] == [[1, 4], [5]]
+        assert chunks[0][1]["reply_to_message_id"] in index
+        assert index[2] == {"from": "Боря", "text": ""}
+        assert 3 not in index
+    finally:
+        index.close()
+
+
+def test_iter_time_chunks_max_messages(tmp_path):
+    path = _write_export(tmp_path, _messages(7))
+    sizes = [len(chunk) for chunk in iter_time_chunks(path, gap_hours=100, max_messages=3)]
+    assert sizes == [3, 3, 1]
@@ -0,0 +1,78 @@
+import json
+
+import networkx as nx
+import pytest
+
+from layer2_merger.graph_store import CompactGraph, make_graph, to_networkx
+from schemas.enums import EdgeRelation, NodeLabel, TZSectionEnum
+
+
+def _fill(G):
+    G.add_node("anya", id="anya", label=NodeLabel.PERSON.value, name="Аня", description="")
+    G.add_node("redis", id="redis", label=NodeLabel.COMPONENT.value, name="Redis",
+               description="кэш", target_section=TZSectionEnum.STACK.value, properties=[{"key": "v", "value": "7"}])
+    G.add_node("cache_choice", id="cache_choice", label=NodeLabel.DECISION.value, name="Выбор кэша")
+    G.add_edge("cache_choice", "redis", relation=EdgeRelation.RELATES_TO.value, evidence="")
+    G.add_edge("anya", "redis", relation=EdgeRelation.VOTED_FOR.value, evidence="за redis")
+    G.add_edge("anya", "redis", relation=EdgeRelation.VOTED_FOR.value, evidence="ещё раз за redis")
+    G.add_edge("redis", "redis", relation=EdgeRelation.MENTIONS.value, evidence="петля")
+    return G
+
+
+def _snapshot(G, node_id_attr=True):
+    nodes = sorted(
+        (n, json.dumps({k: v for k, v in attrs.items() if node_id_attr or k != "id"}, sort_keys=True, ensure_ascii=False))
+        for n, attrs in G.nodes(data=True)
+    )
+    edges = sorted(
+        (u, v, json.dumps(dict(attrs), sort_keys=True, ensure_ascii=False)) for u, v, attrs in G.edges(data=True)
+    )
+    return nodes, edges
+
+
+def test_compact_node_link_round_trip():
+    G = _fill(CompactGraph())
+    restored = CompactGraph.from_node_link(json.loads(json.dumps(G.to_node_link())))
+
+    assert _snapshot(restored) == _snapshot(G)
+    assert restored.number_of_edges() == 4
+
+
+def _nx_load(data):
+    return nx.node_link_graph(data, directed=True, multigraph=True, edges="edges")
+
+
+def test_node_link_is_readable_by_the_other_backend():
+    # Граф, сохранённый одним бэкендом, другой загружает так же, как загрузил бы сохранивший
+    compact = _fill(CompactGraph())
+    reference = _fill(nx.MultiDiGraph())
+    compact_data = json.loads(json.dumps(compact.to_node_link()))
+    networkx_data = json.loads(json.dumps(nx.node_link_data(reference, edges="edges")))
+
+    assert _snapshot(_nx_load(compact_data)) == _snapshot(_nx_load(networkx_data))
+    assert _snapshot(CompactGraph.from_node_link(networkx_data)) == _snapshot(CompactGraph.from_node_link(compact_data))
+    # Атрибут id networkx при загрузке забирает в ключ узла, компактный граф отдаёт его и в атрибутах
+    assert _snapshot(CompactGraph.from_node_link(compact_data), node_id_attr=False) == _snapshot(
+        _nx_load(compact_data), node_id_attr=False
+    )
+
+
+def test_networkx_conversion_round_trip():
+    compact = _fill(CompactGraph())
+    assert _snapshot(CompactGraph.from_networkx(to_networkx(compact))) == _snapshot(compact)
+
+
+def test_remove_node_drops_incident_edges():
+    G = _fill(CompactGraph())
+    G.remove_node("redis")
+
+    assert sorted(G.nodes()) == ["anya", "cache_choice"]
+    assert G.number_of_edges() == 0
+    assert list(G.out_edges("anya")) == [] and list(G.in_edges("cache_choice")) == []
+
+
+def test_make_graph_rejects_unknown_backend():
+    assert isinstance(make_graph("compact"), CompactGraph)
+    assert isinstance(make_graph("networkx"), nx.MultiDiGraph)
+    with pytest.raises(ValueError):
+        make_graph("neo4j")
@@ -0,0 +1,86 @@
+import pytest
+
+from layer2_merger.edge_index import EdgeIndex
+from layer2_merger.graph_store import GRAPH_BACKENDS
+from layer2_merger.merger import SmartGraphMerger, resolve_decisions
+from schemas.enums import EdgeRelation, NodeLabel
+
+
+def _index_view(index, G):
+    relations = {
+        relation.value: sorted(map(str, index.edges_by_relation(relation))) for relation in EdgeRelation
+    }
+    votes = {node: sorted(index.votes_for_target(node)) for node in G.nodes()}
+    return relations, votes
+
+
+def _voting_merger(backend):
+    merger = SmartGraphMerger(backend=backend)
+    for node_id, label in [
+        ("anya", NodeLabel.PERSON), ("borya", NodeLabel.PERSON), ("vera", NodeLabel.PERSON),
+        ("cache_choice", NodeLabel.DECISION), ("redis", NodeLabel.COMPONENT), ("memcached", NodeLabel.COMPONENT),
+    ]:
+        merger.G.add_node(node_id, id=node_id, label=label.value, name=node_id)
+    merger._add_edge("cache_choice", "redis", relation=EdgeRelation.RELATES_TO.value, evidence="")
+    merger._add_edge("cache_choice", "memcached", relation=EdgeRelation.RELATES_TO.value, evidence="")
+    merger._add_edge("anya", "redis", relation=EdgeRelation.VOTED_FOR.value, evidence="+1 redis")
+    merger._add_edge("borya", "memcached", relation=EdgeRelation.VOTED_FOR.value, evidence="+1 memcached")
+    merger._add_edge("vera", "memcached", relation=EdgeRelation.VOTED_FOR.value, evidence="+1 memcached")
+    return merger
+
+
+@pytest.mark.parametrize("backend", GRAPH_BACKENDS)
+def test_edge_index_follows_graph_mutations(backend):
+    merger = _voting_merger(backend)
+    assert _index_view(merger.edge_index, merger.G) == _index_view(EdgeIndex.from_graph(merger.G), merger.G)
+
+    merger._remove_node("vera")
+    merger.G.add_node("memcache", id="memcache", label=NodeLabel.COMPONENT.value, name="memcache")
+    merger._add_edge("vera_2", "memcache", relation=EdgeRelation.VOTED_AGAINST.value, evidence="")
+    merger.merge_aliased_nodes({"memcache": "memcached"})
+
+    assert not merger.G.has_node("memcache")
+    assert _index_view(merger.edge_index, merger.G) == _index_view(EdgeIndex.from_graph(merger.G), merger.G)
+    assert sorted(merger.edge_index.votes_for_target("memcached")) == [
+        ("borya", EdgeRelation.VOTED_FOR.value), ("vera_2", EdgeRelation.VOTED_AGAINST.value),
+    ]
+
+
+@pytest.mark.parametrize("backend", GRAPH_BACKENDS)
+def test_resolve_decisions_uses_index_after_node_removal(backend):
+    merger = _voting_merger(backend)
+    merger._remove_node("vera")
+    [tie] = resolve_decisions(merger.G, merger.edge_index)
+    assert tie.is_tie and tie.winner_id is None
+
+    merger = _voting_merger(backend)
+    merger._remove_node("anya")
+    [resolution] = resolve_decisions(merger.G, merger.edge_index)
+
+    assert resolution.winner_id == "memcached"
+    assert [(o.option_id, o.votes_for) for o in resolution.options] == [("redis", 0), ("memcached", 2)]
+    resolved = list(merger.edge_index.edges_by_relation(EdgeRelation.RESOLVED_TO))
+    assert [(u, v) for u, v, _ in resolved] == [("cache_choice", "memcached")]
+
+
+@pytest.mark.parametrize("backend", GRAPH_BACKENDS)
+def test_reloaded_graph_skips_derived_and_repeated_edges(backend, tmp_path):
+    path = str(tmp_path / "graph.json")
+    merger = _voting_merger(backend)
+    merger._remove_node("vera")
+    resolve_decisions(merger.G, merger.edge_index)
+    merger.save_graph(path)
+
+    reloaded = SmartGraphMerger(backend=backend)
+    assert reloaded.load_graph(path)
+    assert not any(
+        data.get("relation") == EdgeRelation.RESOLVED_TO.value for _, _, data in reloaded.G.edges(data=True)
+    )
+    edges_before = reloaded.G.number_of_edges()
+
+    # Хвост уже обработанных сообщений майнится повторно: тот же голос второй раз не добавляется
+    reloaded._add_extracted_edge("anya", "redis", relation=EdgeRelation.VOTED_FOR.value, evidence="+1 redis")
+    assert reloaded.G.number_of_edges() == edges_before
+    reloaded._add_extracted_edge("anya", "redis", relation=EdgeRelation.VOTED_FOR.value, evidence="снова за redis")
+    assert reloaded.G.number_of_edges() == edges_before + 1
+    assert _index_view(reloaded.edge_index, reloaded.G) == _index_view(EdgeIndex.from_graph(reloaded.G), reloaded.G)
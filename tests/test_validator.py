@@ -0,0 +1,126 @@
+from layer1_miner.validator import validate_subgraph
+from schemas.enums import EdgeRelation, NodeLabel
+from schemas.graph import ExtractedKnowledge, GraphEdge, GraphNode
+
+
+def _node(node_id, label):
+    return GraphNode(id=node_id, label=label, name=node_id)
+
+
+def _edge(source, target, relation, evidence=""):
+    return GraphEdge(source=source, target=target, relation=relation, evidence=evidence)
+
+
+def _edge_keys(graph):
+    return [(e.source, e.target, e.relation) for e in graph.edges]
+
+
+def test_ghost_and_repeated_nodes_are_removed_with_their_edges():
+    graph = ExtractedKnowledge(
+        nodes=[
+            _node("redis", NodeLabel.COMPONENT),
+            _node("ghost", NodeLabel.COMPONENT),
+            _node("redis", NodeLabel.CONCEPT),
+            _node("cache_task", NodeLabel.TASK),
+        ],
+        edges=[
+            _edge("cache_task", "redis", EdgeRelation.DEPENDS_ON),
+            _edge("cache_task", "ghost", EdgeRelation.DEPENDS_ON),
+            _edge("redis", "redis", EdgeRelation.RELATES_TO),
+        ],
+    )
+    graph, fixes = validate_subgraph(graph, valid_ids={"redis", "cache_task"})
+
+    assert [(n.id, n.label) for n in graph.nodes] == [("redis", NodeLabel.COMPONENT), ("cache_task", NodeLabel.TASK)]
+    assert _edge_keys(graph) == [("cache_task", "redis", EdgeRelation.DEPENDS_ON)]
+    assert [f.action for f in fixes.fixes] == ["remove_node", "remove_node", "remove_edge", "remove_edge"]
+
+
+def test_valid_ids_none_skips_ghost_check():
+    graph = ExtractedKnowledge(nodes=[_node("anything", NodeLabel.CONCEPT)])
+    graph, fixes = validate_subgraph(graph)
+
+    assert [n.id for n in graph.nodes] == ["anything"]
+    assert fixes.fixes == []
+
+
+def test_votes_are_flipped_or_removed():
+    graph = ExtractedKnowledge(
+        nodes=[
+            _node("anya", NodeLabel.PERSON),
+            _node("db_choice", NodeLabel.DECISION),
+            _node("postgres", NodeLabel.COMPONENT),
+            _node("mongo", NodeLabel.COMPONENT),
+        ],
+        edges=[
+            _edge("db_choice", "postgres", EdgeRelation.RELATES_TO),
+            _edge("db_choice", "mongo", EdgeRelation.RELATES_TO),
+            _edge("postgres", "anya", EdgeRelation.VOTED_FOR),
+            _edge("postgres", "mongo", EdgeRelation.VOTED_AGAINST),
+        ],
+    )
+    graph, fixes = validate_subgraph(graph)
+
+    assert _edge_keys(graph) == [
+        ("db_choice", "postgres", EdgeRelation.RELATES_TO),
+        ("db_choice", "mongo", EdgeRelation.RELATES_TO),
+        ("anya", "postgres", EdgeRelation.VOTED_FOR),
+    ]
+    assert [f.action for f in fixes.fixes] == ["fix_vote", "remove_edge"]
+
+
+def test_decision_options_are_restored():
+    graph = ExtractedKnowledge(
+        nodes=[
+            _node("anya", NodeLabel.PERSON),
+            _node("db_choice", NodeLabel.DECISION),
+            _node("cache_choice", NodeLabel.DECISION),
+            _node("postgres", NodeLabel.COMPONENT),
+            _node("redis", NodeLabel.COMPONENT),
+            _node("memcached", NodeLabel.COMPONENT),
+        ],
+        edges=[
+            _edge("db_choice", "postgres", EdgeRelation.RESOLVED_TO),
+            _edge("anya", "redis", EdgeRelation.VOTED_FOR),
+            _edge("anya", "memcached", EdgeRelation.VOTED_AGAINST),
+        ],
+    )
+    graph, fixes = validate_subgraph(graph)
+
+    options = [(e.source, e.target) for e in graph.edges if e.relation == EdgeRelation.RELATES_TO]
+    # db_choice — из RESOLVED_TO; cache_choice остался единственным без вариантов — из голосов окна
+    assert options == [("db_choice", "postgres"), ("cache_choice", "redis"), ("cache_choice", "memcached")]
+    assert [f.action for f in fixes.fixes] == ["add_edge"] * 3
+
+
+def test_decision_options_are_not_guessed_between_several_decisions():
+    graph = ExtractedKnowledge(
+        nodes=[
+            _node("anya", NodeLabel.PERSON),
+            _node("db_choice", NodeLabel.DECISION),
+            _node("cache_choice", NodeLabel.DECISION),
+            _node("redis", NodeLabel.COMPONENT),
+        ],
+        edges=[_edge("anya", "redis", EdgeRelation.VOTED_FOR)],
+    )
+    graph, fixes = validate_subgraph(graph)
+
+    assert not any(e.relation == EdgeRelation.RELATES_TO for e in graph.edges)
+    assert fixes.fixes == []
+
+
+def test_duplicate_edges_keep_first_and_fill_evidence():
+    graph = ExtractedKnowledge(
+        nodes=[_node("cache_task", NodeLabel.TASK), _node("redis", NodeLabel.COMPONENT)],
+        edges=[
+            _edge("cache_task", "redis", EdgeRelation.DEPENDS_ON),
+            _edge("cache_task", "redis", EdgeRelation.DEPENDS_ON, evidence="нужен Redis"),
+            _edge("cache_task", "redis", EdgeRelation.MENTIONS),
+        ],
+    )
+    graph, fixes = validate_subgraph(graph)
+
+    assert [(e.relation, e.evidence) for e in graph.edges] == [
+        (EdgeRelation.DEPENDS_ON, "нужен Redis"), (EdgeRelation.MENTIONS, ""),
+    ]
+    assert [f.reason for f in fixes.fixes] == ["Дубль ребра"]
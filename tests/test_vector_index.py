@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from utils.vector_index import similar_pairs
+
+
+def _brute_force_pairs(vectors, threshold, top_k=None):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    sims = unit @ unit.T
+    n = len(vectors)
+    if top_k is None:
+        allowed = {(i, j) for i in range(n) for j in range(i + 1, n)}
+    else:
+        allowed = set()
+        for i in range(n):
+            neighbours = sorted((j for j in range(n) if j != i), key=lambda j: -sims[i, j])[:top_k]
+            allowed.update((min(i, j), max(i, j)) for j in neighbours)
+    return {(i, j): float(sims[i, j]) for i, j in allowed if sims[i, j] >= threshold}
+
+
+@pytest.mark.parametrize("top_k", [None, 1, 3])
+@pytest.mark.parametrize("block_bytes", [4, 1 << 10, 1 << 26])
+def test_similar_pairs_matches_brute_force(top_k, block_bytes):
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(50, 6)).astype(np.float32)
+
+    pairs = similar_pairs(vectors, threshold=0.3, top_k=top_k, block_bytes=block_bytes)
+    expected = _brute_force_pairs(vectors, 0.3, top_k)
+
+    assert [(i, j) for i, j, _ in pairs] == sorted(expected)
+    for i, j, sim in pairs:
+        assert sim == pytest.approx(expected[(i, j)], abs=1e-5)
+
+
+def test_similar_pairs_trivial_inputs():
+    assert similar_pairs(np.zeros((0, 4), dtype=np.float32), threshold=0.5) == []
+    assert similar_pairs(np.ones((1, 4), dtype=np.float32), threshold=0.5) == []
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+from layer1_miner import windowing
+from layer1_miner.windowing import (
+    MESSAGE_OVERHEAD_TOKENS, OVERLAP_MESSAGES, best_lookback_links, pack_thread_windows, shard_bounds,
+)
+from utils.preprocessing import THREAD_SEPARATOR_TYPE
+
+
+@pytest.fixture(autouse=True)
+def fixed_tokens(monkeypatch):
+    """Стоимость сообщения задаётся в самом сообщении — тесты не зависят от токенизатора."""
+    monkeypatch.setattr(windowing, "message_tokens", lambda msg: msg["tokens"])
+
+
+def _thread(first_id, count, tokens=10):
+    return [{"id": first_id + i, "text": f"m{first_id + i}", "tokens": tokens} for i in range(count)]
+
+
+def _window_tokens(msgs):
+    return sum(MESSAGE_OVERHEAD_TOKENS if m.get("type") == THREAD_SEPARATOR_TYPE else m["tokens"] for m in msgs)
+
+
+def test_small_threads_are_packed_with_separators():
+    threads = [_thread(0, 3), _thread(10, 3), _thread(20, 3)]
+    # 3 треда по 30 токенов + 2 разделителя = ровно бюджет
+    windows = pack_thread_windows(threads, budget=3 * 30 + 2 * MESSAGE_OVERHEAD_TOKENS)
+
+    assert len(windows) == 1
+    ref, msgs = windows[0]
+    assert ref == "threads_0-2_msg_0_to_22"
+    assert [m.get("type") for m in msgs].count(THREAD_SEPARATOR_TYPE) == 2
+    assert _window_tokens(msgs) == 3 * 30 + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+def test_pack_is_flushed_when_budget_is_exceeded():
+    threads = [_thread(0, 4), _thread(10, 4), _thread(20, 4)]
+    windows = pack_thread_windows(threads, budget=100)
+
+    assert [ref for ref, _ in windows] == ["threads_0-1_msg_0_to_13", "thread_2_msg_20_to_23"]
+    assert all(_window_tokens(msgs) <= 100 for _, msgs in windows)
+
+
+def test_oversize_thread_keeps_time_order():
+    # Регрессия: мелкий тред до большого должен попасть в окно раньше окон большого треда
+    threads = [_thread(0, 2), _thread(100, 25), _thread(200, 2)]
+    refs = [ref for ref, _ in pack_thread_windows(threads, budget=100)]
+
+    assert refs[0] == "thread_0_msg_0_to_1"
+    assert all(ref.startswith("thread_1_") for ref in refs[1:-1])
+    assert refs[-1] == "thread_2_msg_200_to_201"
+
+
+def test_oversize_thread_windows_respect_budget_and_overlap():
+    thread = _thread(0, 40)
+    windows = [msgs for _, msgs in pack_thread_windows([thread], budget=100)]
+
+    assert len(windows) > 1
+    assert all(_window_tokens(msgs) <= 100 for msgs in windows)
+    for prev, cur in zip(windows, windows[1:]):
+        assert cur[:OVERLAP_MESSAGES] == prev[-OVERLAP_MESSAGES:]
+    # Каждое сообщение попало хотя бы в одно окно, порядок сохранён
+    covered = [m["id"] for m in windows[0]] + [m["id"] for msgs in windows[1:] for m in msgs[OVERLAP_MESSAGES:]]
+    assert covered == [m["id"] for m in thread]
+
+
+def _brute_force_shard_bounds(n, sources, targets, max_shard):
+    cuts = [
+        c for c in range(1, n)
+        if not any(min(s, t) < c <= max(s, t) for s, t in zip(sources, targets))
+    ]
+    bounds, shard_start = [], 0
+    for seg_start, seg_stop in zip([0] + cuts, cuts + [n]):
+        if seg_stop - shard_start > max_shard and seg_start > shard_start:
+            bounds.append((shard_start, seg_start))
+            shard_start = seg_start
+    if n > shard_start:
+        bounds.append((shard_start, n))
+    return bounds
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_shard_bounds_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 120))
+    m = int(rng.integers(0, n))
+    sources = rng.integers(0, n, size=m)
+    # Рёбра короткие, как у связей по окну lookback, чтобы были естественные разрезы
+    targets = np.clip(sources - rng.integers(0, 6, size=m), 0, n - 1)
+    max_shard = int(rng.integers(1, 40))
+
+    bounds = shard_bounds(n, sources, targets, max_shard=max_shard)
+
+    assert bounds == _brute_force_shard_bounds(n, sources.tolist(), targets.tolist(), max_shard)
+    assert bounds[0][0] == 0 and bounds[-1][1] == n
+    assert all(a[1] == b[0] for a, b in zip(bounds, bounds[1:]))
+
+
+def test_shard_bounds_without_edges():
+    assert shard_bounds(5, np.array([], dtype=np.int64), np.array([], dtype=np.int64), max_shard=2) == [
+        (0, 2), (2, 4), (4, 5),
+    ]
+    assert shard_bounds(0, np.array([], dtype=np.int64), np.array([], dtype=np.int64)) == []
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_best_lookback_links_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n, lookback = 60, 7
+    embeddings = rng.normal(size=(n, 8)).astype(np.float32)
+    minutes = np.cumsum(rng.integers(0, 90, size=n))
+    timestamps = np.datetime64("2024-01-01T00:00:00") + minutes.astype("timedelta64[m]")
+    max_gap = np.timedelta64(2, "h")
+
+    best_j, best_sim = best_lookback_links(embeddings, timestamps, lookback=lookback, max_gap=max_gap)
+
+    unit = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    for i in range(n):
+        candidates = [
+            (float(unit[i] @ unit[j]), j) for j in range(max(0, i - lookback), i)
+            if timestamps[i] - timestamps[j] <= max_gap
+        ]
+        candidates = [(sim, j) for sim, j in candidates if sim > 0]
+        if not candidates:
+            assert best_j[i] == -1
+            continue
+        sim, j = max(candidates, key=lambda c: (c[0], -c[1]))
+        assert best_j[i] == j
+        assert best_sim[i] == pytest.approx(sim, abs=1e-5)
@@ -0,0 +1,116 @@
+import os
+import time
+import logging
+import contextvars
+from collections import defaultdict
+from typing import Dict, List, Optional, TextIO
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+from .state_logger import LOGS_DIR, log_text
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FILENAME = "llm_ledger.jsonl"
+LEDGER_SUMMARY_FILENAME = "llm_ledger_summary.txt"
+
+
+class CallRecord(BaseModel):
+    """Одна запись журнала: вызов LLM или батч эмбеддингов."""
+    call_site: str = Field(description="Точка вызова, например 'miner.link_entity'")
+    kind: str = Field(description="llm_json | llm_text | embedding")
+    provider: str
+    model: str
+    started_at: float = Field(default_factory=time.time)
+    wall_ms: float = 0.0
+    queue_wait_ms: float = Field(default=0.0, description="Ожидание в rate limiter / семафорах")
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    attempts: int = 0
+    items: int = Field(default=1, description="Число текстов (для эмбеддингов)")
+    cache: str = Field(default="off", description="hit | miss | shared | off")
+    ok: bool = True
+    error: Optional[str] = None
+    _t0: float = PrivateAttr(default_factory=time.monotonic)
+
+    @property
+    def retries(self) -> int:
+        return max(0, self.attempts - 1)
+
+
+# Запись текущего вызова: заполняется изнутри ретраев и rate limiter'а
+CURRENT_CALL: contextvars.ContextVar[Optional[CallRecord]] = contextvars.ContextVar("current_llm_call", default=None)
+
+
+def current_call() -> Optional[CallRecord]:
+    return CURRENT_CALL.get()
+
+
+class CallLedger:
+    """Журнал всех LLM/embedding вызовов: JSONL по ходу работы + сводка в конце прогона."""
+
+    def __init__(self, filename: str = LEDGER_FILENAME):
+        self.filename = filename
+        self.records: List[CallRecord] = []
+        self._file: Optional[TextIO] = None
+
+    def start(self, call_site: str, kind: str, provider: str, model: str, **fields) -> CallRecord:
+        return CallRecord(call_site=call_site, kind=kind, provider=provider, model=model, **fields)
+
+    def finish(self, record: CallRecord, error: Optional[BaseException] = None):
+        record.wall_ms = (time.monotonic() - record._t0) * 1000
+        if error is not None:
+            record.ok = False
+            record.error = f"{type(error).__name__}: {error}"[:300]
+        self.records.append(record)
+        self._write(record)
+
+    def _write(self, record: CallRecord):
+        try:
+            if self._file is None:
+                os.makedirs(LOGS_DIR, exist_ok=True)
+                self._file = open(os.path.join(LOGS_DIR, self.filename), "w", encoding="utf-8")
+            self._file.write(record.model_dump_json() + "\n")
+            self._file.flush()
+        except OSError as e:
+            logger.warning(f"Не удалось записать журнал вызовов: {e}")
+
+    def format_summary(self) -> str:
+        if not self.records:
+            return "Журнал вызовов пуст."
+
+        groups: Dict[str, List[CallRecord]] = defaultdict(list)
+        for r in self.records:
+            groups[r.call_site].append(r)
+
+        header = (
+            f"{'call_site':<28} {'calls':>6} {'hit':>5} {'err':>4} {'retry':>5} "
+            f"{'wall_s':>8} {'avg_ms':>8} {'p95_ms':>8} {'wait_s':>7} {'in_tok':>9} {'out_tok':>8}"
+        )
+        lines = [header, "-" * len(header)]
+        rows = sorted(groups.items(), key=lambda kv: -sum(r.wall_ms for r in kv[1]))
+        for site, recs in rows + [("ИТОГО", self.records)]:
+            walls = sorted(r.wall_ms for r in recs)
+            p95 = walls[min(len(walls) - 1, int(len(walls) * 0.95))]
+            lines.append(
+                f"{site:<28} {len(recs):>6} "
+                f"{sum(r.cache in ('hit', 'shared') for r in recs):>5} "
+                f"{sum(not r.ok for r in recs):>4} "
+                f"{sum(r.retries for r in recs):>5} "
+                f"{sum(walls) / 1000:>8.1f} {sum(walls) / len(walls):>8.0f} {p95:>8.0f} "
+                f"{sum(r.queue_wait_ms for r in recs) / 1000:>7.1f} "
+                f"{sum(r.prompt_tokens for r in recs):>9} {sum(r.completion_tokens for r in recs):>8}"
+            )
+        return "\n".join(lines)
+
+    def report(self):
+        """Печатает сводку и сохраняет её рядом с JSONL журналом."""
+        summary = self.format_summary()
+        print("\n📊 LLM/Embedding вызовы по стадиям:\n" + summary + "\n")
+        try:
+            log_text(LEDGER_SUMMARY_FILENAME, summary)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить сводку журнала: {e}")
+
+
+LEDGER = CallLedger()
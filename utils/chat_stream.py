@@ -0,0 +1,203 @@
+"""
+Потоковое чтение больших экспортов Telegram (result.json) без загрузки файла в память.
+
+Парсер инкрементально декодирует массив "messages" (json.JSONDecoder.raw_decode по буферу),
+сообщения отдаются упорядоченными по времени чанками с разрезом по паузам в переписке,
+а reply_to_message_id разрешается через компактный индекс ReplyIndex (превью — на диске).
+"""
+import os
+import re
+import json
+import tempfile
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from .preprocessing import get_clean_text
+
+CHAT_STREAM_READ_BYTES = int(os.getenv("CHAT_STREAM_READ_BYTES", str(1024 * 1024)))
+# Чанк режется по паузе длиннее CHAT_CHUNK_GAP_HOURS, а при её отсутствии — по жёсткому лимиту сообщений
+CHAT_CHUNK_GAP_HOURS = float(os.getenv("CHAT_CHUNK_GAP_HOURS", "4"))
+CHAT_CHUNK_MAX_MESSAGES = int(os.getenv("CHAT_CHUNK_MAX_MESSAGES", "5000"))
+REPLY_PREVIEW_CHARS = 40
+
+# Поля сообщения, которые нужны пайплайну; остальное (медиа, entities, реакции) отбрасываем сразу
+_KEPT_FIELDS = ("id", "type", "date", "from", "reply_to_message_id")
+_MESSAGES_KEY_RE = re.compile(r'"messages"\s*:\s*\[')
+_WHITESPACE = " \t\r\n,"
+
+
+def iter_export_messages(path: str, read_size: int = CHAT_STREAM_READ_BYTES) -> Iterator[Dict[str, Any]]:
+    """
+    Итерирует объекты из массива "messages" экспорта Telegram (или из файла-массива).
+    В памяти держится только текущий буфер чтения и одно сообщение.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = f.read(read_size)
+        eof = not buf
+
+        # Ищем начало массива сообщений
+        pos = None
+        while pos is None:
+            stripped = buf.lstrip()
+            if stripped.startswith("["):
+                pos = len(buf) - len(stripped) + 1
+                break
+            match = _MESSAGES_KEY_RE.search(buf)
+            if match:
+                pos = match.end()
+                break
+            if eof:
+                raise ValueError(f"В {path} не найден массив messages")
+            chunk = f.read(read_size)
+            eof = not chunk
+            buf += chunk
+
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            if pos < len(buf):
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    pos = end
+                    if isinstance(obj, dict):
+                        yield obj
+                    continue
+            elif eof:
+                raise ValueError(f"Неожиданный конец файла {path}: массив messages не закрыт")
+
+            # Объект не поместился в буфер — сдвигаем окно и дочитываем
+            buf = buf[pos:]
+            pos = 0
+            chunk = f.read(read_size)
+            eof = not chunk
+            buf += chunk
+
+
+def slim_message(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Оставляет только нужные поля; текст из списка entities склеивается в строку."""
+    msg = {k: raw[k] for k in _KEPT_FIELDS if k in raw}
+    msg["text"] = get_clean_text(raw.get("text", ""))
+    return msg
+
+
+def _parse_date(date_str: str) -> Optional[datetime]:
+    try:
+        dt = datetime.fromisoformat(str(date_str).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+class ReplyIndex:
+    """
+    Компактный индекс id → {"from", "text"} для разрешения ответов.
+    Превью лежат во временном файле, в памяти — только массивы id и смещений.
+    Поддерживает `in`, `[]` и `len`, поэтому подходит как msg_lookup для format_chat_message.
+    """
+
+    def __init__(self, preview_chars: int = REPLY_PREVIEW_CHARS):
+        self.preview_chars = preview_chars
+        self._sorted_ids = array("q")
+        self._sorted_records = array("q")
+        # id не по возрастанию (или не целые) — редкость в экспорте Telegram
+        self._unordered: Dict[Any, int] = {}
+        self._offsets = array("q", [0])
+        self._file = tempfile.TemporaryFile()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def add(self, msg: Dict[str, Any]):
+        msg_id = msg.get("id")
+        if msg_id is None or msg_id in self:
+            return
+        payload = json.dumps(
+            {"from": msg.get("from", "Unknown"), "text": get_clean_text(msg.get("text", ""))[:self.preview_chars]},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        self._file.seek(self._offsets[-1])
+        self._file.write(payload)
+        record = len(self)
+        self._offsets.append(self._offsets[-1] + len(payload))
+
+        if isinstance(msg_id, int) and (not self._sorted_ids or msg_id > self._sorted_ids[-1]):
+            self._sorted_ids.append(msg_id)
+            self._sorted_records.append(record)
+        else:
+            self._unordered[msg_id] = record
+
+    def _record(self, msg_id) -> Optional[int]:
+        if msg_id in self._unordered:
+            return self._unordered[msg_id]
+        if isinstance(msg_id, int):
+            i = bisect_left(self._sorted_ids, msg_id)
+            if i < len(self._sorted_ids) and self._sorted_ids[i] == msg_id:
+                return self._sorted_records[i]
+        return None
+
+    def __contains__(self, msg_id) -> bool:
+        return self._record(msg_id) is not None
+
+    def __getitem__(self, msg_id) -> Dict[str, str]:
+        record = self._record(msg_id)
+        if record is None:
+            raise KeyError(msg_id)
+        start, stop = self._offsets[record], self._offsets[record + 1]
+        self._file.seek(start)
+        return json.loads(self._file.read(stop - start).decode("utf-8"))
+
+    def get(self, msg_id, default=None):
+        return self[msg_id] if msg_id in self else default
+
+    def close(self):
+        self._file.close()
+
+
+def iter_time_chunks(
+        path: str,
+        reply_index: Optional[ReplyIndex] = None,
+        gap_hours: float = CHAT_CHUNK_GAP_HOURS,
+        max_messages: int = CHAT_CHUNK_MAX_MESSAGES,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Упорядоченные по времени чанки текстовых сообщений экспорта.
+    Чанк закрывается на паузе длиннее gap_hours (через неё тред всё равно не связывается)
+    или при достижении max_messages. Каждое сообщение (и без текста) попадает в reply_index до выдачи чанка.
+    """
+    max_gap = timedelta(hours=gap_hours)
+    chunk: List[Dict[str, Any]] = []
+    last_time: Optional[datetime] = None
+
+    for raw in iter_export_messages(path):
+        if raw.get("type") != "message":
+            continue
+        msg = slim_message(raw)
+        # В индекс — и сообщения без текста (медиа, стикеры): на них тоже отвечают
+        if reply_index is not None:
+            reply_index.add(msg)
+        if not msg["text"]:
+            continue
+
+        msg_time = _parse_date(msg.get("date", ""))
+        gap_exceeded = msg_time is not None and last_time is not None and msg_time - last_time > max_gap
+        if chunk and (gap_exceeded or len(chunk) >= max_messages):
+            yield chunk
+            chunk = []
+        if msg_time is not None:
+            last_time = msg_time
+
+        chunk.append(msg)
+
+    if chunk:
+        yield chunk
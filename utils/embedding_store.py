@@ -0,0 +1,118 @@
+import os
+import re
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_STORE_ENABLED = os.getenv("EMBEDDING_STORE", "1") not in ("0", "false", "False", "")
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", os.path.join(".cache", "embeddings"))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Дисковое хранилище эмбеддингов одной модели.
+    - vectors.f32 — append-only матрица float32 (читается через np.memmap);
+    - index.txt   — заголовок с размерностью, затем хэш текста на каждую строку матрицы.
+    """
+
+    def __init__(self, model_name: str, store_dir: str = EMBEDDING_STORE_DIR):
+        safe_model = re.sub(r"[^\w.-]+", "_", model_name)
+        self.dir = os.path.join(store_dir, safe_model)
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.index_path = os.path.join(self.dir, "index.txt")
+        self.dim: Optional[int] = None
+        self._rows: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_path) or not os.path.exists(self.vectors_path):
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            header, *hashes = f.read().split("\n")
+        self.dim = int(header.split()[-1])
+        # Запись могла оборваться: доверяем только строкам, у которых есть и хэш, и вектор
+        n_vectors = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        hashes = [h for h in hashes if h]
+        if len(hashes) > n_vectors:
+            hashes = hashes[:n_vectors]
+            with open(self.index_path, "w", encoding="utf-8") as f:
+                f.write(f"# dim {self.dim}\n" + "".join(h + "\n" for h in hashes))
+        self._rows = {h: i for i, h in enumerate(hashes)}
+        self._reopen()
+        logger.info(f"  -> Хранилище эмбеддингов: {len(self._rows)} векторов (dim={self.dim})")
+
+    def _reopen(self):
+        self._matrix = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r", shape=(len(self._rows), self.dim)
+        ) if self._rows else None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def lookup(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Пакетный поиск: вектор для найденных текстов, None для промахов."""
+        rows = [self._rows.get(text_hash(t)) for t in texts]
+        hit_positions = [i for i, r in enumerate(rows) if r is not None]
+        result: List[Optional[List[float]]] = [None] * len(texts)
+        if hit_positions:
+            block = np.asarray(self._matrix[[rows[i] for i in hit_positions]])
+            for pos, vec in zip(hit_positions, block):
+                result[pos] = vec.tolist()
+        return result
+
+    def add(self, texts: List[str], vectors: List[List[float]]):
+        """Дописывает новые векторы в конец матрицы и индекса."""
+        new_hashes, new_vectors = [], []
+        seen = set()
+        for text, vec in zip(texts, vectors):
+            h = text_hash(text)
+            if h in self._rows or h in seen:
+                continue
+            if self.dim is None:
+                self.dim = len(vec)
+            if len(vec) != self.dim:
+                continue
+            seen.add(h)
+            new_hashes.append(h)
+            new_vectors.append(vec)
+        if not new_hashes:
+            return
+
+        os.makedirs(self.dir, exist_ok=True)
+        if not self._rows:
+            # Начинаем заново: обрезаем возможные хвосты от прерванных записей
+            with open(self.index_path, "w", encoding="utf-8") as f:
+                f.write(f"# dim {self.dim}\n")
+            open(self.vectors_path, "wb").close()
+        with open(self.vectors_path, "r+b") as f:
+            f.truncate(len(self._rows) * self.dim * 4)
+            f.seek(0, os.SEEK_END)
+            f.write(np.asarray(new_vectors, dtype=np.float32).tobytes())
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(new_hashes) + "\n")
+
+        start = len(self._rows)
+        for i, h in enumerate(new_hashes):
+            self._rows[h] = start + i
+        self._reopen()
+
+
+_STORES: Dict[str, EmbeddingStore] = {}
+
+
+def get_embedding_store(model_name: str) -> Optional[EmbeddingStore]:
+    """Одно хранилище на модель на процесс (общее для windowing и merger)."""
+    if not EMBEDDING_STORE_ENABLED:
+        return None
+    if model_name not in _STORES:
+        _STORES[model_name] = EmbeddingStore(model_name)
+    return _STORES[model_name]
@@ -1,3 +1,5 @@
+import os
+import time
 import asyncio
 import logging
 from typing import List
@@ -12,8 +14,24 @@ from tenacity import (
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 import google.api_core.exceptions
 
+from .call_ledger import LEDGER, CURRENT_CALL, current_call
+from .embedding_store import get_embedding_store
+from .llm_client import LLM_PROVIDER, get_embeddings_client, in_flight_slot
+from .rate_limiter import RATE_LIMITER
+from .tokens import estimate_tokens
+
 logger = logging.getLogger(__name__)
 
+# Синтетические векторы fake-провайдера хранятся отдельно от настоящих
+EMBEDDING_MODEL = "fake-embedding" if LLM_PROVIDER == "fake" else "models/gemini-embedding-001"
+EMBEDDING_RATE_KEY = "fake" if LLM_PROVIDER == "fake" else "embedding"
+EMBEDDING_PROVIDER = "fake" if LLM_PROVIDER == "fake" else "google"
+# Сколько батчей одного вызова одновременно в полёте и до какого размера может расти батч
+# (каждая попытка ещё и занимает слот общего бюджета LLM_MAX_IN_FLIGHT)
+# (batchEmbedContents у Google принимает максимум 100 текстов)
+EMBEDDING_MAX_IN_FLIGHT = int(os.getenv("EMBEDDING_MAX_IN_FLIGHT", "4"))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "100"))
+
 # Настройки повторов специально для Google Embeddings API
 EMBEDDING_RETRY_CONFIG = {
     "stop": stop_after_attempt(6),
@@ -31,30 +49,99 @@ EMBEDDING_RETRY_CONFIG = {
 @retry(**EMBEDDING_RETRY_CONFIG)
 async def _aembed_batch_with_retry(model: GoogleGenerativeAIEmbeddings, batch: List[str]) -> List[List[float]]:
     """Асинхронно получает эмбеддинги для одного батча с автоматическими ретраями."""
-    return await model.aembed_documents(batch)
+    tokens = sum(estimate_tokens(t) for t in batch)
+    waited = await RATE_LIMITER.acquire(EMBEDDING_RATE_KEY, EMBEDDING_MODEL, tokens)
+    record = current_call()
+    if record is not None:
+        record.attempts += 1
+        record.queue_wait_ms += waited * 1000
+        record.prompt_tokens = tokens
+    try:
+        async with in_flight_slot():
+            result = await model.aembed_documents(batch)
+    except Exception as e:
+        RATE_LIMITER.report(EMBEDDING_RATE_KEY, EMBEDDING_MODEL, e)
+        raise
+    RATE_LIMITER.report(EMBEDDING_RATE_KEY, EMBEDDING_MODEL)
+    return result
 
-async def aget_embeddings_safe(texts: List[str], batch_size: int = 20, delay: float = 0.5) -> List[List[float]]:
+async def aget_embeddings_safe(
+        texts: List[str],
+        batch_size: int = 20,
+        max_in_flight: int = EMBEDDING_MAX_IN_FLIGHT,
+        call_site: str = "unknown",
+) -> List[List[float]]:
     """
     Разбивает тексты на батчи и безопасно получает эмбеддинги.
+    Батчи отправляются параллельно (не больше max_in_flight одновременно);
+    размер батча растёт после успехов до EMBEDDING_MAX_BATCH_SIZE и уменьшается после провалов.
+    Темп запросов задаёт глобальный RATE_LIMITER, а не фиксированные паузы.
+    Уже посчитанные векторы берутся из дискового хранилища — в API уходят только промахи.
     В случае абсолютного провала возвращает безопасный "шумовой" вектор,
     чтобы не сломать математику (косинусное сходство).
     """
     if not texts:
         return[]
 
-    model = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
-    embeddings: List[List[float]] =[]
+    store = get_embedding_store(EMBEDDING_MODEL)
+    lookup_started = time.monotonic()
+    cached = store.lookup(texts) if store is not None else [None] * len(texts)
+    embeddings: List[List[float]] = list(cached)
+
+    # Одинаковые тексты внутри запроса эмбеддим один раз
+    miss_positions: dict[str, List[int]] = {}
+    for pos, vec in enumerate(cached):
+        if vec is None:
+            miss_positions.setdefault(texts[pos], []).append(pos)
+    miss_texts = list(miss_positions)
+
+    n_hits = len(texts) - sum(map(len, miss_positions.values()))
+    if store is not None and n_hits:
+        # Запись о попаданиях создаётся только когда они есть, время — от начала lookup
+        lookup_record = LEDGER.start(
+            call_site, "embedding", EMBEDDING_PROVIDER, EMBEDDING_MODEL, items=n_hits, cache="hit",
+        )
+        lookup_record._t0 = lookup_started
+        LEDGER.finish(lookup_record)
+        logger.info(f"  -> Эмбеддинги: {n_hits} из кеша, {len(miss_texts)} новых")
+    if not miss_texts:
+        return embeddings
+
+    model = get_embeddings_client(EMBEDDING_MODEL)
+    cursor = 0
+    current_batch_size = min(batch_size, EMBEDDING_MAX_BATCH_SIZE)
+
+    async def worker():
+        nonlocal cursor, current_batch_size
+        while cursor < len(miss_texts):
+            # Резервируем срез до await — воркеры никогда не берут один и тот же батч
+            start = cursor
+            batch = miss_texts[start : start + current_batch_size]
+            cursor += len(batch)
+            record = LEDGER.start(
+                call_site, "embedding", EMBEDDING_PROVIDER, EMBEDDING_MODEL,
+                items=len(batch), cache="miss" if store is not None else "off",
+            )
+            token = CURRENT_CALL.set(record)
+            try:
+                batch_result = await _aembed_batch_with_retry(model, batch)
+                LEDGER.finish(record)
+                if store is not None:
+                    store.add(batch, batch_result)
+                current_batch_size = min(EMBEDDING_MAX_BATCH_SIZE, current_batch_size * 2)
+            except Exception as e:
+                LEDGER.finish(record, e)
+                logger.error(f"❌ ПРОВАЛ эмбеддингов (батч {start}, {len(batch)} текстов) после всех попыток: {e}")
+                batch_result = [[1e-5] * 768] * len(batch)
+                current_batch_size = max(1, current_batch_size // 2)
+            finally:
+                CURRENT_CALL.reset(token)
 
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i : i + batch_size]
-        try:
-            batch_result = await _aembed_batch_with_retry(model, batch)
-            embeddings.extend(batch_result)
-        except Exception as e:
-            logger.error(f"❌ ПРОВАЛ эмбеддингов (батч {i}, {len(batch)} текстов) после всех попыток: {e}")
-            embeddings.extend([[1e-5] * 768] * len(batch))
+            for text, vec in zip(batch, batch_result):
+                for pos in miss_positions[text]:
+                    embeddings[pos] = vec
 
-        if i + batch_size < len(texts):
-            await asyncio.sleep(delay)
+    n_workers = max(1, min(max_in_flight, -(-len(miss_texts) // current_batch_size)))
+    await asyncio.gather(*[worker() for _ in range(n_workers)])
 
-    return embeddings
\ No newline at end of file
+    return embeddings
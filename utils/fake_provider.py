@@ -0,0 +1,290 @@
+"""
+Офлайн-провайдер LLM_PROVIDER=fake для нагрузочного тестирования пайплайна без сети.
+
+Возвращает валидные по схеме синтетические ответы и детерминированные
+hash-эмбеддинги. Задержка и доля ошибок настраиваются через окружение:
+FAKE_LLM_LATENCY_MS, FAKE_EMBEDDING_LATENCY_MS, FAKE_ERROR_RATE, FAKE_SEED.
+Для замеров накладных расходов выключайте кеши: LLM_CACHE=0 EMBEDDING_STORE=0.
+"""
+import os
+import re
+import types
+import random
+import asyncio
+import hashlib
+import typing
+from enum import Enum
+from typing import Any, Callable, Dict, List, Type
+
+import numpy as np
+from pydantic import BaseModel
+from langchain_core.messages import AIMessage
+
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "0"))
+FAKE_EMBEDDING_LATENCY_MS = float(os.getenv("FAKE_EMBEDDING_LATENCY_MS", "0"))
+FAKE_ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+FAKE_DUPLICATE_RATE = float(os.getenv("FAKE_DUPLICATE_RATE", "0.3"))
+FAKE_EMBEDDING_DIM = 768
+
+_rng = random.Random(int(os.getenv("FAKE_SEED", "42")))
+
+_DATA_MARKER = "--- ВХОДНЫЕ ДАННЫЕ ---"
+_GLOSSARY_LINE_RE = re.compile(r"- (\S+) \((\w+)\): (.+)$", re.MULTILINE)
+_AUTHOR_RE = re.compile(r"^\[[^\]]+\] ([^\[:]+?)(?:\[|:)", re.MULTILINE)
+_CLUSTER_HEADER_RE = re.compile(r"^Кластер \d+:", re.MULTILINE)
+_ID_LINE_RE = re.compile(r"ID:\s*([\w\-.]+)\s*\|\s*(?:Имя:\s*)?([^|\n]*)")
+_WORD_RE = re.compile(r"[A-Za-zА-Яа-яЁё][\w+#.\-]{2,}")
+
+
+def _seed(*parts: str) -> int:
+    return int.from_bytes(hashlib.sha256("\x1f".join(parts).encode("utf-8")).digest()[:8], "big")
+
+
+def _snake_id(name: str) -> str:
+    return name.lower().replace(" ", "_").replace("-", "_")
+
+
+def _split_prompt(prompt: str):
+    if _DATA_MARKER in prompt:
+        head, data = prompt.split(_DATA_MARKER, 1)
+        return head, data
+    return prompt, prompt
+
+
+async def _simulate_network(latency_ms: float):
+    if latency_ms > 0:
+        # Экспоненциальный разброс вокруг среднего — похоже на реальные хвосты задержек
+        await asyncio.sleep(_rng.expovariate(1.0 / latency_ms) / 1000.0)
+    if FAKE_ERROR_RATE > 0 and _rng.random() < FAKE_ERROR_RATE:
+        raise ConnectionError("fake provider: injected transient error")
+
+
+# ─────────────────────────────────────────────
+# ГЕНЕРАТОРЫ ОТВЕТОВ ПО СХЕМАМ
+# ─────────────────────────────────────────────
+def _fake_entity_dicts(prompt: str, rnd: random.Random) -> List[Dict[str, str]]:
+    _, data = _split_prompt(prompt)
+    authors = list(dict.fromkeys(a.strip() for a in _AUTHOR_RE.findall(data)))
+    author_words = {w for a in authors for w in a.split()}
+    words = list(dict.fromkeys(
+        w.strip(".-") for w in _WORD_RE.findall(data)
+        if (w[0].isupper() or w.isascii()) and w not in author_words
+    ))
+    labels = ["Component", "Concept", "Requirement", "Task"]
+    entities = [{"name": a, "label": "Person", "description": "Участник обсуждения"} for a in authors[:3]]
+    entities += [
+        {"name": w, "label": labels[_seed(w) % len(labels)], "description": f"Упоминание «{w}» в обсуждении"}
+        for w in words[:rnd.randint(1, 5)]
+    ]
+    return entities
+
+
+def _fake_raw_entities(schema, prompt: str, rnd: random.Random):
+    return schema(entities=_fake_entity_dicts(prompt, rnd))
+
+
+def _fake_merge_decision(schema, prompt: str, rnd: random.Random):
+    entity = prompt.split("\n", 1)[0].removeprefix("Сущность:").split("(")[0].strip()
+    known = {gid for gid, _, _ in _GLOSSARY_LINE_RE.findall(prompt)}
+    entity_id = _snake_id(entity)
+    if entity_id in known:
+        return schema(is_duplicate=True, target_global_id=entity_id, new_id=None)
+    return schema(is_duplicate=False, target_global_id=None, new_id=entity_id)
+
+
+def _fake_entity_link_batch(schema, prompt: str, rnd: random.Random):
+    _, data = _split_prompt(prompt)
+    known = {gid for gid, _, _ in _GLOSSARY_LINE_RE.findall(data)}
+    decisions = []
+    for index, name in re.findall(r"^(\d+)\. (.+?) \(\w+\):", data, re.MULTILINE):
+        entity_id = _snake_id(name)
+        is_dup = entity_id in known
+        decisions.append({
+            "entity_index": int(index), "is_duplicate": is_dup,
+            "target_global_id": entity_id if is_dup else None, "new_id": None if is_dup else entity_id,
+        })
+    return schema(decisions=decisions)
+
+
+def _fake_extracted_knowledge(schema, prompt: str, rnd: random.Random):
+    glossary = _GLOSSARY_LINE_RE.findall(prompt)
+    text = prompt.split("Текст:", 1)[-1].lower()
+    mentioned = [(gid, label, name) for gid, label, name in glossary if name.lower() in text] or glossary[:3]
+    nodes = [
+        {"id": gid, "label": label, "name": name, "description": f"{name} (синтетическое описание)"}
+        for gid, label, name in mentioned
+    ]
+    edges = [
+        {"source": a["id"], "target": b["id"], "relation": "RELATES_TO", "evidence": "fake"}
+        for a, b in zip(nodes, nodes[1:])
+    ]
+    return schema(summary=f"Синтетический граф из {len(nodes)} узлов", nodes=nodes, edges=edges)
+
+
+def _fake_fast_extraction(schema, prompt: str, rnd: random.Random):
+    head, _ = _split_prompt(prompt)
+    known = {gid for gid, _, _ in _GLOSSARY_LINE_RE.findall(head)}
+    entities = _fake_entity_dicts(prompt, rnd)
+    for entity in entities:
+        entity_id = _snake_id(entity["name"])
+        entity["glossary_id"] = entity_id if entity_id in known else None
+    edges = [
+        {"source": i, "target": i + 1, "relation": "RELATES_TO", "evidence": "fake"}
+        for i in range(len(entities) - 1)
+    ]
+    return schema(summary=f"Синтетическое окно из {len(entities)} сущностей", entities=entities, edges=edges)
+
+
+def _fake_project_memory(schema, prompt: str, rnd: random.Random):
+    ids = list(dict.fromkeys(re.findall(r'"id":\s*"([^"]+)"', prompt)))
+    return schema(key_entities=ids[:10])
+
+
+def _fake_merge_batch(schema, prompt: str, rnd: random.Random):
+    _, data = _split_prompt(prompt)
+    actions = []
+    # Пакет кластеров — по одному решению на кластер
+    for cluster in _CLUSTER_HEADER_RE.split(data):
+        ids = [gid for gid, _ in _ID_LINE_RE.findall(cluster)]
+        if len(ids) < 2 or rnd.random() >= FAKE_DUPLICATE_RATE:
+            continue
+        unified = min(ids, key=len)
+        actions.append({
+            "is_duplicate": True, "ids_to_merge": ids, "unified_id": unified,
+            "unified_name": unified.replace("_", " "), "unified_desc": "Синтетическое объединение",
+        })
+    return schema(actions=actions)
+
+
+def _fake_section_batch(schema, prompt: str, rnd: random.Random):
+    _, data = _split_prompt(prompt)
+    sections = ["general_info", "tech_stack", "functional_req", "ui_ux"]
+    return schema(assignments=[
+        {"node_id": gid, "target_section": sections[_seed(gid) % len(sections)]}
+        for gid, _ in _ID_LINE_RE.findall(data)
+    ])
+
+
+def _fake_empty(schema, prompt: str, rnd: random.Random):
+    # Пустые списки: конфликтов и правок нет (иначе main.py ждёт ввода пользователя)
+    return schema()
+
+
+_FAKE_BUILDERS: Dict[str, Callable[[Type[BaseModel], str, random.Random], BaseModel]] = {
+    "RawEntitiesSchema": _fake_raw_entities,
+    "MergeDecision": _fake_merge_decision,
+    "EntityLinkBatch": _fake_entity_link_batch,
+    "ExtractedKnowledge": _fake_extracted_knowledge,
+    "FastExtraction": _fake_fast_extraction,
+    "ProjectMemory": _fake_project_memory,
+    "MergeBatchResult": _fake_merge_batch,
+    "SectionBatchResult": _fake_section_batch,
+    "ConflictBatchResult": _fake_empty,
+}
+
+
+def _fake_value(annotation: Any, rnd: random.Random, depth: int = 0) -> Any:
+    """Универсальный генератор значения по аннотации типа (для схем без своего генератора)."""
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+    if origin in (typing.Union, types.UnionType):
+        non_none = [a for a in args if a is not type(None)]
+        return _fake_value(non_none[0], rnd, depth) if non_none else None
+    if origin in (list, List):
+        return [_fake_value(args[0], rnd, depth + 1) for _ in range(rnd.randint(0, 2) if depth < 3 else 0)]
+    if origin in (dict, Dict):
+        return {}
+    if isinstance(annotation, type):
+        if issubclass(annotation, BaseModel):
+            return _fake_model(annotation, rnd, depth + 1)
+        if issubclass(annotation, Enum):
+            return rnd.choice(list(annotation))
+        if issubclass(annotation, bool):
+            return rnd.random() < 0.5
+        if issubclass(annotation, int):
+            return rnd.randint(0, 10)
+        if issubclass(annotation, float):
+            return rnd.random()
+    return f"fake_{rnd.randint(0, 10 ** 6)}"
+
+
+def _fake_model(schema: Type[BaseModel], rnd: random.Random, depth: int = 0) -> BaseModel:
+    values = {
+        name: _fake_value(field.annotation, rnd, depth)
+        for name, field in schema.model_fields.items()
+    }
+    return schema.model_validate(values)
+
+
+def build_fake_response(schema: Type[BaseModel], prompt: str) -> BaseModel:
+    """Детерминированный (по промпту) синтетический объект схемы."""
+    rnd = random.Random(_seed(schema.__name__, prompt))
+    builder = _FAKE_BUILDERS.get(schema.__name__)
+    if builder is not None:
+        return builder(schema, prompt, rnd)
+    return _fake_model(schema, rnd)
+
+
+def build_fake_text(prompt: str) -> str:
+    facts = re.findall(r"^- (.+?) \(ID: [^)]+\): (.*)$", prompt, re.MULTILINE)
+    lines = ["### Синтетический раздел", ""]
+    lines += [f"- **{name}** — {desc}" for name, desc in facts] or ["- Нет данных."]
+    return "\n".join(lines)
+
+
+# ─────────────────────────────────────────────
+# КЛИЕНТЫ (совместимы по интерфейсу с LangChain)
+# ─────────────────────────────────────────────
+def _fake_message(prompt: str, content: str) -> AIMessage:
+    input_tokens, output_tokens = max(1, len(prompt) // 3), max(1, len(content) // 3)
+    return AIMessage(content=content, usage_metadata={
+        "input_tokens": input_tokens, "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens,
+    })
+
+
+class _FakeStructuredRunnable:
+    def __init__(self, schema: Type[BaseModel], include_raw: bool = False):
+        self.schema = schema
+        self.include_raw = include_raw
+
+    async def ainvoke(self, prompt: str):
+        await _simulate_network(FAKE_LLM_LATENCY_MS)
+        parsed = build_fake_response(self.schema, prompt)
+        if not self.include_raw:
+            return parsed
+        return {"raw": _fake_message(prompt, parsed.model_dump_json()), "parsed": parsed, "parsing_error": None}
+
+
+class FakeChatModel:
+    def __init__(self, model: str, temperature: float = 0.1):
+        self.model = model
+        self.temperature = temperature
+
+    def with_structured_output(self, schema: Type[BaseModel], include_raw: bool = False) -> _FakeStructuredRunnable:
+        return _FakeStructuredRunnable(schema, include_raw=include_raw)
+
+    async def ainvoke(self, prompt: str) -> AIMessage:
+        await _simulate_network(FAKE_LLM_LATENCY_MS)
+        return _fake_message(prompt, build_fake_text(prompt))
+
+
+def fake_embedding(text: str, dim: int = FAKE_EMBEDDING_DIM) -> List[float]:
+    """
+    Hashed bag-of-words: у текстов с общими словами векторы похожи,
+    поэтому дедупликация и тредирование ведут себя правдоподобно.
+    """
+    vec = np.zeros(dim, dtype=np.float32)
+    for token in re.findall(r"\w+", text.lower()) or [text]:
+        vec += np.random.default_rng(_seed(token)).standard_normal(dim).astype(np.float32)
+    norm = np.linalg.norm(vec)
+    return (vec / norm if norm > 0 else vec).tolist()
+
+
+class FakeEmbeddings:
+    def __init__(self, model: str):
+        self.model = model
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await _simulate_network(FAKE_EMBEDDING_LATENCY_MS)
+        return [fake_embedding(t) for t in texts]
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") not in ("0", "false", "False", "")
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(".cache", "llm"))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "512"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", str(24 * 30)))
+
+# Ключ хэша схемы: JSON-schema не меняется между вызовами, считаем один раз на класс
+_SCHEMA_HASHES: Dict[Type[BaseModel], str] = {}
+
+
+def schema_hash(schema: Optional[Type[BaseModel]]) -> str:
+    """Хэш JSON-схемы Pydantic модели (пустая строка для текстовых вызовов)."""
+    if schema is None:
+        return ""
+    if schema not in _SCHEMA_HASHES:
+        dumped = json.dumps(schema.model_json_schema(), sort_keys=True, ensure_ascii=False)
+        _SCHEMA_HASHES[schema] = hashlib.sha256(dumped.encode("utf-8")).hexdigest()
+    return _SCHEMA_HASHES[schema]
+
+
+def make_cache_key(
+        provider: str,
+        model_name: str,
+        temperature: float,
+        prompt: str,
+        schema: Optional[Type[BaseModel]] = None,
+) -> str:
+    """Content-addressed ключ: провайдер + модель + температура + полный промпт + хэш схемы."""
+    payload = json.dumps(
+        [provider, model_name, temperature, prompt, schema_hash(schema)],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Персистентный кеш ответов LLM (SQLite) с вытеснением по TTL и размеру.
+    Одинаковые запросы, которые уже выполняются, не дублируются:
+    все конкурентные вызовы ждут один и тот же Future.
+    """
+
+    def __init__(self, cache_dir: str = LLM_CACHE_DIR, max_mb: float = LLM_CACHE_MAX_MB,
+                 ttl_hours: float = LLM_CACHE_TTL_HOURS, enabled: bool = LLM_CACHE_ENABLED):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_hours * 3600
+        self.enabled = enabled
+        self._conn: Optional[sqlite3.Connection] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._writes_since_evict = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.cache_dir, "llm_cache.sqlite3"))
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.commit()
+            self._evict()
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._db().execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        now = time.time()
+        if now - created > self.ttl_seconds:
+            self._db().execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._db().commit()
+            return None
+        self._db().execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        self._db().commit()
+        return value
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        self._db().execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value.encode("utf-8")), now, now),
+        )
+        self._db().commit()
+        self._writes_since_evict += 1
+        if self._writes_since_evict >= 100:
+            self._evict()
+
+    def _evict(self):
+        """Удаляет просроченные записи, затем самые давно использованные, пока кеш больше лимита."""
+        self._writes_since_evict = 0
+        conn = self._conn
+        conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            freed = 0
+            stale_keys = []
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC"):
+                stale_keys.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            conn.executemany("DELETE FROM entries WHERE key = ?", stale_keys)
+            logger.info(f"🧹 LLM-кеш: вытеснено {len(stale_keys)} записей ({freed // 1024} КБ)")
+        conn.commit()
+
+    async def get_or_call(self, key: str, call: Callable[[], Awaitable[str]]) -> Tuple[str, str]:
+        """
+        Возвращает (ответ, статус): закешированный ответ или результат call(),
+        выполненного ровно один раз для всех ожидающих.
+        Статус: "hit" | "miss" | "shared" (дождались чужого запроса) | "off" (кеш выключен).
+        """
+        if not self.enabled:
+            return await call(), "off"
+
+        cached = self.get(key)
+        if cached is not None:
+            return cached, "hit"
+
+        if key in self._in_flight:
+            return await asyncio.shield(self._in_flight[key]), "shared"
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await call()
+            self.put(key, value)
+            future.set_result(value)
+            return value, "miss"
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже проброшено владельцу; помечаем его «полученным» для остальных
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+
+LLM_CACHE = LLMCache()
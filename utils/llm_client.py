@@ -1,14 +1,24 @@
 import os
+import time
+import asyncio
 import logging
-from typing import Type, TypeVar
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple, Type, TypeVar
 
+import httpx
 from dotenv import load_dotenv
 from pydantic import BaseModel
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, before_sleep_log
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain_openai import ChatOpenAI
 import google.api_core.exceptions
 
+from .call_ledger import LEDGER, CURRENT_CALL, current_call
+from .fake_provider import FakeChatModel, FakeEmbeddings
+from .llm_cache import LLM_CACHE, make_cache_key
+from .rate_limiter import RATE_LIMITER
+from .tokens import estimate_tokens
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -20,27 +30,109 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
 DEFAULT_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash-lite")
 
-def get_llm_client(model_name: str, temperature: float = 0.1):
-    """
-    Фабрика для создания клиента LLM в зависимости от LLM_PROVIDER.
-    """
+JSON_TEMPERATURE = 0.3
+TEXT_TEMPERATURE = 0.2
+# Резерв под ответ модели при списании токенов из квоты (ответ заранее неизвестен)
+COMPLETION_TOKEN_RESERVE = 500
+# Общий на процесс потолок одновременных запросов к API — LLM и эмбеддинги (все источники и стадии делят его).
+# Слот занимается на одну попытку: бэкофф tenacity между попытками слот не держит
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "16"))
+
+# === ПУЛ HTTP-СОЕДИНЕНИЙ ===
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "30"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "120"))
+
+# Тёплые клиенты: создаются один раз на процесс и переиспользуются всеми вызовами
+_LLM_CLIENTS: Dict[Tuple[str, str, float], Any] = {}
+_STRUCTURED_CLIENTS: Dict[Tuple[str, str, float, Type[BaseModel]], Any] = {}
+_EMBEDDING_CLIENTS: Dict[Tuple[str, str], Any] = {}
+_HTTP_ASYNC_CLIENT: Optional[httpx.AsyncClient] = None
+_IN_FLIGHT_SEMAPHORE: Optional[asyncio.Semaphore] = None
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _get_http_async_client() -> httpx.AsyncClient:
+    """Общий пул соединений для OpenAI-совместимых клиентов."""
+    global _HTTP_ASYNC_CLIENT
+    if _HTTP_ASYNC_CLIENT is None:
+        _HTTP_ASYNC_CLIENT = httpx.AsyncClient(limits=_http_limits(), timeout=LLM_HTTP_TIMEOUT)
+    return _HTTP_ASYNC_CLIENT
+
+
+def _google_client_args() -> Dict[str, Any]:
+    # google-genai создаёт httpx-клиент на каждый экземпляр модели,
+    # поэтому пул живёт вместе с закешированным экземпляром.
+    return {"limits": _http_limits(), "timeout": LLM_HTTP_TIMEOUT}
+
+
+def _create_llm_client(model_name: str, temperature: float):
+    if LLM_PROVIDER == "fake":
+        return FakeChatModel(model=model_name, temperature=temperature)
     if LLM_PROVIDER == "openai":
         return ChatOpenAI(
             model=model_name,
             temperature=temperature,
             api_key=OPENAI_API_KEY,
             base_url=OPENAI_BASE_URL,
-            max_retries=3
+            max_retries=3,
+            http_async_client=_get_http_async_client(),
         )
     else:
         return ChatGoogleGenerativeAI(
             model=model_name,
             temperature=temperature,
             google_api_key=GOOGLE_API_KEY,
-            max_retries=3
+            max_retries=3,
+            client_args=_google_client_args(),
         )
 
 
+def get_llm_client(model_name: str, temperature: float = 0.1):
+    """
+    Возвращает тёплый клиент LLM для (LLM_PROVIDER, model_name, temperature).
+    Клиент создаётся при первом обращении и дальше переиспользуется.
+    """
+    key = (LLM_PROVIDER, model_name, temperature)
+    if key not in _LLM_CLIENTS:
+        _LLM_CLIENTS[key] = _create_llm_client(model_name, temperature)
+    return _LLM_CLIENTS[key]
+
+
+def get_structured_llm_client(schema: Type[BaseModel], model_name: str, temperature: float = 0.1):
+    """
+    Кешированная обёртка with_structured_output поверх тёплого клиента.
+    include_raw=True: сырой ответ нужен ради usage_metadata (токены для журнала вызовов).
+    """
+    key = (LLM_PROVIDER, model_name, temperature, schema)
+    if key not in _STRUCTURED_CLIENTS:
+        llm = get_llm_client(model_name=model_name, temperature=temperature)
+        _STRUCTURED_CLIENTS[key] = llm.with_structured_output(schema, include_raw=True)
+    return _STRUCTURED_CLIENTS[key]
+
+
+def get_embeddings_client(model_name: str):
+    """Тёплый клиент эмбеддингов (один на модель)."""
+    key = (LLM_PROVIDER, model_name)
+    if key not in _EMBEDDING_CLIENTS:
+        if LLM_PROVIDER == "fake":
+            _EMBEDDING_CLIENTS[key] = FakeEmbeddings(model=model_name)
+        else:
+            _EMBEDDING_CLIENTS[key] = GoogleGenerativeAIEmbeddings(
+                model=model_name,
+                client_args=_google_client_args(),
+            )
+    return _EMBEDDING_CLIENTS[key]
+
+
 T = TypeVar("T", bound=BaseModel)
 
 # === НАСТРОЙКИ ПОВТОРОВ (RETRY) ===
@@ -59,32 +151,129 @@ GLOBAL_RETRY_CONFIG = {
     "before_sleep": before_sleep_log(logger, logging.WARNING)
 }
 
+
+def _build_full_prompt(prompt: str, data: str) -> str:
+    full_prompt = prompt
+    if data:
+        full_prompt += f"\n\n--- ВХОДНЫЕ ДАННЫЕ ---\n{data}"
+    return full_prompt
+
+
+async def _before_attempt(model_name: str, full_prompt: str):
+    """Учёт попытки и ожидания квоты в записи журнала текущего вызова."""
+    record = current_call()
+    waited = await RATE_LIMITER.acquire(
+        LLM_PROVIDER, model_name, estimate_tokens(full_prompt) + COMPLETION_TOKEN_RESERVE
+    )
+    if record is not None:
+        record.attempts += 1
+        record.queue_wait_ms += waited * 1000
+
+
+def _record_usage(message, full_prompt: str, completion: str):
+    record = current_call()
+    if record is None:
+        return
+    usage = getattr(message, "usage_metadata", None) or {}
+    record.prompt_tokens += usage.get("input_tokens") or estimate_tokens(full_prompt)
+    record.completion_tokens += usage.get("output_tokens") or estimate_tokens(completion)
+
+
+def _in_flight_semaphore() -> asyncio.Semaphore:
+    global _IN_FLIGHT_SEMAPHORE
+    if _IN_FLIGHT_SEMAPHORE is None:
+        _IN_FLIGHT_SEMAPHORE = asyncio.Semaphore(LLM_MAX_IN_FLIGHT)
+    return _IN_FLIGHT_SEMAPHORE
+
+
+@asynccontextmanager
+async def in_flight_slot():
+    """Слот бюджета LLM_MAX_IN_FLIGHT на одну попытку запроса; ожидание слота пишется в запись журнала."""
+    started = time.monotonic()
+    async with _in_flight_semaphore():
+        record = current_call()
+        if record is not None:
+            record.queue_wait_ms += (time.monotonic() - started) * 1000
+        yield
+
+
 @retry(**GLOBAL_RETRY_CONFIG)
-async def acall_llm_json(schema: Type[T], prompt: str, data: str = "", model_name: str = DEFAULT_MODEL) -> T:
+async def _ainvoke_json(schema: Type[T], full_prompt: str, model_name: str) -> str:
+    await _before_attempt(model_name, full_prompt)
     try:
-        llm = get_llm_client(model_name=model_name, temperature=0.3)
-        llm_structured = llm.with_structured_output(schema)
-
-        full_prompt = prompt
-        if data:
-            full_prompt += f"\n\n--- ВХОДНЫЕ ДАННЫЕ ---\n{data}"
+        llm_structured = get_structured_llm_client(schema, model_name=model_name, temperature=JSON_TEMPERATURE)
 
-        return await llm_structured.ainvoke(full_prompt)
+        async with in_flight_slot():
+            result = await llm_structured.ainvoke(full_prompt)
+        RATE_LIMITER.report(LLM_PROVIDER, model_name)
+        if result.get("parsing_error") is not None or result.get("parsed") is None:
+            raise ValueError(f"Ответ не соответствует схеме {schema.__name__}: {result.get('parsing_error')}")
+        raw_json = result["parsed"].model_dump_json()
+        _record_usage(result.get("raw"), full_prompt, raw_json)
+        return raw_json
     except Exception as e:
+        RATE_LIMITER.report(LLM_PROVIDER, model_name, e)
         logger.error(f"❌ Ошибка LLM JSON ({LLM_PROVIDER}): {e}")
         raise e
 
 @retry(**GLOBAL_RETRY_CONFIG)
-async def acall_llm_text(prompt: str, data: str = "", model_name: str = DEFAULT_MODEL) -> str:
+async def _ainvoke_text(full_prompt: str, model_name: str) -> str:
+    await _before_attempt(model_name, full_prompt)
     try:
-        llm = get_llm_client(model_name=model_name, temperature=0.2)
+        llm = get_llm_client(model_name=model_name, temperature=TEXT_TEMPERATURE)
 
-        full_prompt = prompt
-        if data:
-            full_prompt += f"\n\n--- ВХОДНЫЕ ДАННЫЕ ---\n{data}"
-
-        result = await llm.ainvoke(full_prompt)
+        async with in_flight_slot():
+            result = await llm.ainvoke(full_prompt)
+        RATE_LIMITER.report(LLM_PROVIDER, model_name)
+        _record_usage(result, full_prompt, result.content)
         return result.content
     except Exception as e:
+        RATE_LIMITER.report(LLM_PROVIDER, model_name, e)
         logger.error(f"❌ Ошибка LLM Text ({LLM_PROVIDER}): {e}")
-        raise e
\ No newline at end of file
+        raise e
+
+
+async def _acall_with_ledger(call_site: str, kind: str, model_name: str, key: str, call) -> str:
+    record = LEDGER.start(call_site, kind, LLM_PROVIDER, model_name)
+    token = CURRENT_CALL.set(record)
+
+    try:
+        # Слот занимают только реальные запросы (in_flight_slot внутри попытки): попадания в кеш идут мимо
+        value, record.cache = await LLM_CACHE.get_or_call(key, call)
+    except Exception as e:
+        LEDGER.finish(record, e)
+        raise
+    finally:
+        CURRENT_CALL.reset(token)
+    LEDGER.finish(record)
+    return value
+
+
+async def acall_llm_json(
+        schema: Type[T],
+        prompt: str,
+        data: str = "",
+        model_name: str = DEFAULT_MODEL,
+        call_site: str = "unknown",
+) -> T:
+    full_prompt = _build_full_prompt(prompt, data)
+    key = make_cache_key(LLM_PROVIDER, model_name, JSON_TEMPERATURE, full_prompt, schema)
+
+    raw_json = await _acall_with_ledger(
+        call_site, "llm_json", model_name, key, lambda: _ainvoke_json(schema, full_prompt, model_name)
+    )
+    # Каждый вызывающий получает свой экземпляр: результаты мутируются дальше по пайплайну
+    return schema.model_validate_json(raw_json)
+
+async def acall_llm_text(
+        prompt: str,
+        data: str = "",
+        model_name: str = DEFAULT_MODEL,
+        call_site: str = "unknown",
+) -> str:
+    full_prompt = _build_full_prompt(prompt, data)
+    key = make_cache_key(LLM_PROVIDER, model_name, TEXT_TEMPERATURE, full_prompt)
+
+    return await _acall_with_ledger(
+        call_site, "llm_text", model_name, key, lambda: _ainvoke_text(full_prompt, model_name)
+    )
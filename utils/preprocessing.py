@@ -1,5 +1,5 @@
 import re
-from typing import Tuple
+from typing import Any, Dict, List, Sequence, Tuple
 
 CONFIRMATION_WORDS = {"ок", "да", "давайте", "плюс", "+", "ага", "согласен", "добро", "принято", "хорошо"}
 REJECTION_WORDS = {"не", "нет", "не надо", "минус", "-", "отмена", "против", "не согласен"}
@@ -16,6 +16,23 @@ _VOTE_AGAINST_PATTERNS = [
     r"не\s+хочу\s+(?P<target>[\w\s\+#\.]+)",
 ]
 
+
+# Все паттерны голосов в порядке приоритета: сначала «за», потом «против»
+_VOTE_PATTERNS = [("for", re.compile(p)) for p in _VOTE_FOR_PATTERNS] + \
+                 [("against", re.compile(p)) for p in _VOTE_AGAINST_PATTERNS]
+# Одна альтернация с именованными группами <direction>_<приоритет>: за один проход находит
+# самое левое срабатывание любого паттерна (или убеждается, что голоса в тексте нет)
+_VOTE_RE = re.compile("|".join(
+    pattern.pattern.replace("(?P<target>", f"(?P<{direction}_{priority}>")
+    for priority, (direction, pattern) in enumerate(_VOTE_PATTERNS)
+))
+# Быстрый литеральный отсев перед альтернацией: без одного из этих слов ни одна ветка не сработает.
+# Python re не ускоряет альтернацию по общим префиксам, а поиск литералов — быстрый
+_VOTE_TRIGGER_RE = re.compile(r"за\s|поддерживаю\s|против\s|не\s+хочу\s")
+
+# Псевдо-сообщение-разделитель тредов внутри упакованного окна (см. layer1_miner.windowing)
+THREAD_SEPARATOR_TYPE = "thread_separator"
+
 def normalize_short_answers(text: str) -> str:
     if not isinstance(text, str):
         return ""
@@ -31,14 +48,16 @@ def detect_vote(text: str) -> Tuple[str | None, str | None]:
     if not isinstance(text, str):
         return None, None
     lower = text.lower().strip()
-    for pattern in _VOTE_FOR_PATTERNS:
-        m = re.search(pattern, lower)
-        if m:
-            return "for", m.group("target").strip()
-    for pattern in _VOTE_AGAINST_PATTERNS:
-        m = re.search(pattern, lower)
-        if m:
-            return "against", m.group("target").strip()
+    m = _VOTE_RE.search(lower) if _VOTE_TRIGGER_RE.search(lower) else None
+    if m:
+        # Самое левое срабатывание — паттерн с приоритетом `priority`. Паттерн выше по приоритету
+        # мог сработать правее — его и проверяем (обычно побеждает первый «за», и проверять нечего)
+        direction, priority = m.lastgroup.rsplit("_", 1)
+        for higher_direction, pattern in _VOTE_PATTERNS[:int(priority)]:
+            higher = pattern.search(lower)
+            if higher:
+                return higher_direction, higher.group("target").strip()
+        return direction, m.group(m.lastgroup).strip()
     clean = lower.strip(",.!?:")
     if clean in CONFIRMATION_WORDS:
         return "for", None
@@ -46,15 +65,52 @@ def detect_vote(text: str) -> Tuple[str | None, str | None]:
         return "against", None
     return None, None
 
+def detect_votes(texts: Sequence[str]) -> List[Tuple[str | None, str | None]]:
+    """detect_vote для массива текстов: одинаковые тексты («+», «ок», «за redis») классифицируются один раз."""
+    unique = {text: None for text in texts}
+    for text in unique:
+        unique[text] = detect_vote(text)
+    return [unique[text] for text in texts]
+
+def format_vote_flag(direction: str | None, target: str | None) -> str:
+    if not direction:
+        return ""
+    return f"[VOTE_{direction.upper()}:{target or 'LAST_MENTIONED'}]"
+
 def enrich_message_with_vote(msg: dict) -> dict:
     """Добавляет явный vote_flag в сообщение"""
-    text = str(msg.get("text", ""))
-    direction, target = detect_vote(text)
-    if direction:
-        target_str = target or "LAST_MENTIONED"
-        msg["vote_flag"] = f"[VOTE_{direction.upper()}:{target_str}]"
+    flag = format_vote_flag(*detect_vote(str(msg.get("text", ""))))
+    if flag:
+        msg["vote_flag"] = flag
     return msg
 
+class VoteClassifier:
+    """
+    Пакетная классификация голосов с кешем по id сообщения (один экземпляр на источник):
+    перекрывающиеся окна не классифицируют одни и те же сообщения повторно.
+    """
+
+    def __init__(self):
+        self._flags: Dict[Any, str] = {}
+
+    def vote_flags(self, messages: Sequence[dict]) -> List[str]:
+        """vote_flag для каждого сообщения ('' — голоса нет)."""
+        todo = [i for i, m in enumerate(messages) if m.get("id") is None or m["id"] not in self._flags]
+        votes = detect_votes([str(messages[i].get("text", "")) for i in todo])
+        flags = [self._flags.get(m.get("id"), "") for m in messages]
+        for i, vote in zip(todo, votes):
+            flags[i] = format_vote_flag(*vote)
+            if messages[i].get("id") is not None:
+                self._flags[messages[i]["id"]] = flags[i]
+        return flags
+
+    def enrich(self, messages: Sequence[dict]) -> List[dict]:
+        """Сообщения с vote_flag; копируются только те, где голос найден."""
+        return [
+            {**m, "vote_flag": flag} if flag else m
+            for m, flag in zip(messages, self.vote_flags(messages))
+        ]
+
 def get_clean_text(text_obj) -> str:
     if isinstance(text_obj, str):
         return text_obj
@@ -63,6 +119,8 @@ def get_clean_text(text_obj) -> str:
     return ""
 
 def format_chat_message(msg: dict, msg_lookup: dict = None) -> str:
+    if msg.get("type") == THREAD_SEPARATOR_TYPE:
+        return "──────── СЛЕДУЮЩИЙ ТРЕД (не связан с предыдущим) ────────"
     date = msg.get("date", "Unknown Date")
     author = msg.get("from", msg.get("author", "Unknown"))
     text = get_clean_text(msg.get("text", ""))
@@ -0,0 +1,160 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+import google.api_core.exceptions
+
+logger = logging.getLogger(__name__)
+
+# Лимиты по умолчанию (requests/tokens per minute); 0 — без ограничения.
+# Переопределяются через RATE_LIMITS='{"google:gemini-2.5-flash": {"rpm": 1000, "tpm": 1000000}}'
+# (ключ — "provider:model" или просто "provider").
+DEFAULT_RATE_LIMITS: Dict[str, Dict[str, int]] = {
+    "google": {"rpm": int(os.getenv("LLM_RPM", "60")), "tpm": int(os.getenv("LLM_TPM", "1000000"))},
+    "openai": {"rpm": int(os.getenv("LLM_RPM", "500")), "tpm": int(os.getenv("LLM_TPM", "200000"))},
+    "embedding": {"rpm": int(os.getenv("EMBEDDING_RPM", "100")), "tpm": int(os.getenv("EMBEDDING_TPM", "0"))},
+    # Офлайн-провайдер: без ограничений, чтобы мерить собственные накладные расходы пайплайна
+    "fake": {"rpm": 0, "tpm": 0},
+}
+RATE_LIMITS_OVERRIDES: Dict[str, Dict[str, int]] = json.loads(os.getenv("RATE_LIMITS", "{}"))
+
+# AIMD: при 429 скорость делится пополам, при успехах — медленно восстанавливается
+THROTTLE_DECREASE_FACTOR = 0.5
+RECOVERY_STEP = 0.02
+MIN_RATE_FACTOR = 0.05
+THROTTLE_COOLDOWN_SECONDS = float(os.getenv("RATE_LIMIT_COOLDOWN", "10"))
+
+
+# «429» в тексте ошибки считается только рядом со status/code/HTTP или как «429 Too Many Requests»:
+# голое число часто встречается в request id и счётчиках токенов
+_RATE_LIMIT_TEXT_RE = re.compile(
+    r"(?:\b(?:status|status_code|code|http|error)\b\W{0,3}429\b)|(?:\b429\s+too many requests\b)",
+    re.IGNORECASE,
+)
+_RATE_LIMIT_EXCEPTION_NAMES = ("RateLimitError", "ResourceExhausted", "TooManyRequests")
+
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    """ResourceExhausted / RateLimitError / HTTP 429 от любого провайдера."""
+    if isinstance(e, google.api_core.exceptions.ResourceExhausted):
+        return True
+    if any(cls.__name__ in _RATE_LIMIT_EXCEPTION_NAMES for cls in type(e).__mro__):
+        return True
+    response = getattr(e, "response", None)
+    for status in (getattr(e, "status_code", None), getattr(e, "code", None), getattr(response, "status_code", None)):
+        if status == 429:
+            return True
+    text = str(e)
+    return bool(_RATE_LIMIT_TEXT_RE.search(text)) or "RESOURCE_EXHAUSTED" in text or "rate limit" in text.lower()
+
+
+class _Bucket:
+    """Token bucket: ёмкость = лимит в минуту, пополнение с постоянной скоростью."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self, now: float, factor: float):
+        if self.unlimited:
+            return
+        rate_per_sec = self.capacity * factor / 60.0
+        self.level = min(self.capacity, self.level + (now - self.updated) * rate_per_sec)
+        self.updated = now
+
+    def wait_time(self, amount: float, factor: float) -> float:
+        if self.unlimited:
+            return 0.0
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.capacity * factor / 60.0)
+
+    def consume(self, amount: float):
+        if not self.unlimited:
+            self.level -= min(amount, self.capacity)
+
+
+class _ModelLimiter:
+    def __init__(self, name: str, rpm: int, tpm: int):
+        self.name = name
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        self.factor = 1.0
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> float:
+        """Ждёт, пока в обоих бакетах хватит квоты. Возвращает время ожидания (с)."""
+        started = time.monotonic()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.requests.refill(now, self.factor)
+                self.tokens.refill(now, self.factor)
+                wait = max(self.requests.wait_time(1, self.factor), self.tokens.wait_time(tokens, self.factor))
+                if wait <= 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(tokens)
+                    return time.monotonic() - started
+                await asyncio.sleep(wait)
+
+    def report_throttled(self):
+        self.factor = max(MIN_RATE_FACTOR, self.factor * THROTTLE_DECREASE_FACTOR)
+        self.paused_until = max(self.paused_until, time.monotonic() + THROTTLE_COOLDOWN_SECONDS)
+        # Квота кончилась у провайдера — наши бакеты тоже обнуляем
+        self.requests.level = min(self.requests.level, 0.0)
+        logger.warning(f"🐢 Rate limit '{self.name}': 429 → скорость снижена до {self.factor:.0%}")
+
+    def report_success(self):
+        if self.factor < 1.0:
+            self.factor = min(1.0, self.factor + RECOVERY_STEP)
+
+
+class RateLimiter:
+    """
+    Глобальный (на процесс) асинхронный лимитер запросов и токенов
+    по парам (provider, model). Скорость адаптируется по ответам 429.
+    """
+
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, str], _ModelLimiter] = {}
+
+    def _limits_for(self, provider: str, model_name: str) -> Dict[str, int]:
+        limits = dict(DEFAULT_RATE_LIMITS.get(provider, DEFAULT_RATE_LIMITS["google"]))
+        limits.update(RATE_LIMITS_OVERRIDES.get(provider, {}))
+        limits.update(RATE_LIMITS_OVERRIDES.get(f"{provider}:{model_name}", {}))
+        return limits
+
+    def _get(self, provider: str, model_name: str) -> _ModelLimiter:
+        key = (provider, model_name)
+        if key not in self._limiters:
+            limits = self._limits_for(provider, model_name)
+            self._limiters[key] = _ModelLimiter(f"{provider}:{model_name}", limits["rpm"], limits["tpm"])
+        return self._limiters[key]
+
+    async def acquire(self, provider: str, model_name: str, tokens: int = 0) -> float:
+        return await self._get(provider, model_name).acquire(tokens)
+
+    def report(self, provider: str, model_name: str, error: Optional[BaseException] = None):
+        """Обратная связь после вызова: успех или ошибка (429 снижает скорость)."""
+        limiter = self._get(provider, model_name)
+        if error is None:
+            limiter.report_success()
+        elif is_rate_limit_error(error):
+            limiter.report_throttled()
+
+
+RATE_LIMITER = RateLimiter()
@@ -0,0 +1,53 @@
+import os
+import logging
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# BPE-кодировка tiktoken по провайдеру. У Gemini свой SentencePiece-токенизатор, которого в tiktoken нет,
+# поэтому для google — грубая оценка. TOKENIZER_ENCODING переопределяет выбор (пустая строка — только оценка)
+PROVIDER_TOKENIZER_ENCODINGS = {
+    "openai": "o200k_base",
+    "google": "",
+    "fake": "cl100k_base",
+}
+TOKENIZER_ENCODING = os.getenv(
+    "TOKENIZER_ENCODING",
+    PROVIDER_TOKENIZER_ENCODINGS.get(os.getenv("LLM_PROVIDER", "google").lower(), "cl100k_base"),
+)
+
+_ENCODER: Optional[Any] = None
+_ENCODER_LOADED = False
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (для кириллицы ~3 символа на токен)."""
+    if not text:
+        return 0
+    return max(1, len(text) // 3)
+
+
+def _get_encoder():
+    """tiktoken грузится один раз; нет пакета или файла кодировки (офлайн) — работаем по оценке."""
+    global _ENCODER, _ENCODER_LOADED
+    if not _ENCODER_LOADED:
+        _ENCODER_LOADED = True
+        if not TOKENIZER_ENCODING:
+            logger.info("ℹ️ Кодировка токенизатора не задана для провайдера, токены считаются по оценке")
+            return None
+        try:
+            import tiktoken
+            _ENCODER = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            logger.warning(f"⚠️ tiktoken ({TOKENIZER_ENCODING}) недоступен ({type(e).__name__}), токены считаются по оценке")
+    return _ENCODER
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов текста: tiktoken, если доступен, иначе estimate_tokens."""
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is None:
+        return estimate_tokens(text)
+    return len(encoder.encode(text, disallowed_special=()))
@@ -0,0 +1,153 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """Стекает векторы в float32 матрицу с единичными строками (нулевые строки остаются нулевыми)."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorIndex:
+    """
+    Инкрементальный in-memory индекс нормализованных векторов для поиска top-k по косинусу.
+    Матрица растёт удвоением ёмкости, так что вставка амортизированно O(d).
+    """
+
+    def __init__(self, initial_capacity: int = 256):
+        self.keys: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._alive: Optional[np.ndarray] = None
+        self._initial_capacity = initial_capacity
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._positions
+
+    def _ensure_capacity(self, dim: int, needed: int):
+        if self._matrix is None:
+            capacity = max(self._initial_capacity, needed)
+            self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+            self._alive = np.zeros(capacity, dtype=bool)
+        elif needed > self._matrix.shape[0]:
+            capacity = max(needed, self._matrix.shape[0] * 2)
+            grown = np.zeros((capacity, dim), dtype=np.float32)
+            grown[:len(self.keys)] = self._matrix[:len(self.keys)]
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:len(self.keys)] = self._alive[:len(self.keys)]
+            self._matrix, self._alive = grown, alive
+
+    def add(self, keys: Sequence[str], vectors) -> None:
+        """Добавляет (или обновляет) векторы по ключам."""
+        if not keys:
+            return
+        rows = normalize_rows(vectors)
+        new_keys = [k for k in dict.fromkeys(keys) if k not in self._positions]
+        self._ensure_capacity(rows.shape[1], len(self.keys) + len(new_keys))
+        for key in new_keys:
+            self._positions[key] = len(self.keys)
+            self.keys.append(key)
+        for key, row in zip(keys, rows):
+            pos = self._positions[key]
+            self._matrix[pos] = row
+            self._alive[pos] = True
+
+    def copy(self) -> "VectorIndex":
+        """Независимая копия: вставки в копию не видны оригиналу и наоборот."""
+        clone = VectorIndex(self._initial_capacity)
+        clone.keys = list(self.keys)
+        clone._positions = dict(self._positions)
+        if self._matrix is not None:
+            clone._matrix = self._matrix.copy()
+            clone._alive = self._alive.copy()
+        return clone
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Нормализованный вектор ключа (копия) или None."""
+        pos = self._positions.get(key)
+        return None if pos is None else self._matrix[pos].copy()
+
+    def remove(self, key: str) -> None:
+        pos = self._positions.pop(key, None)
+        if pos is not None:
+            self._alive[pos] = False
+
+    def search(
+            self,
+            queries,
+            k: int = 10,
+            threshold: float = 0.0,
+    ) -> List[List[Tuple[str, float]]]:
+        """Для каждого запроса — до k ближайших ключей со сходством >= threshold (по убыванию)."""
+        query_rows = normalize_rows(queries)
+        if not self._positions:
+            return [[] for _ in range(len(query_rows))]
+
+        n = len(self.keys)
+        sims = query_rows @ self._matrix[:n].T
+        sims[:, ~self._alive[:n]] = -np.inf
+        k = min(k, n)
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+
+        results = []
+        for qi, candidates in enumerate(top):
+            scored = sorted(((float(sims[qi, j]), j) for j in candidates), key=lambda x: (-x[0], x[1]))
+            results.append([(self.keys[j], s) for s, j in scored if s >= threshold])
+        return results
+
+
+# Память под один блок матрицы сходств (строки × столбцы × float32)
+SIMILARITY_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def similar_pairs(
+        vectors,
+        threshold: float,
+        top_k: Optional[int] = None,
+        block_bytes: int = SIMILARITY_BLOCK_BYTES,
+) -> List[Tuple[int, int, float]]:
+    """
+    Все пары (i, j, sim), i < j, с косинусным сходством >= threshold.
+    Считается блочным матричным умножением: в памяти одновременно не больше block_bytes сходств.
+    top_k — оставить для каждого узла не больше k лучших соседей
+    (пара сохраняется, если она входит в top-k хотя бы одного из концов).
+    """
+    matrix = normalize_rows(vectors)
+    n = matrix.shape[0]
+    if n < 2:
+        return []
+
+    rows_per_block = max(1, block_bytes // (4 * n))
+    found: Dict[Tuple[int, int], float] = {}
+
+    for start in range(0, n, rows_per_block):
+        stop = min(n, start + rows_per_block)
+        if top_k is None:
+            # Только верхний треугольник: столбцы правее диагонали блока
+            sims = matrix[start:stop] @ matrix[start:].T
+            rows, cols = np.nonzero(sims >= threshold)
+            for r, c in zip(rows.tolist(), cols.tolist()):
+                i, j = start + r, start + c
+                if i < j:
+                    found[(i, j)] = float(sims[r, c])
+        else:
+            sims = matrix[start:stop] @ matrix.T
+            sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+            k = min(top_k, n - 1)
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            for r, cols in enumerate(top):
+                i = start + r
+                for j in cols.tolist():
+                    sim = float(sims[r, j])
+                    if sim >= threshold:
+                        found[(min(i, j), max(i, j))] = sim
+
+    return [(i, j, sim) for (i, j), sim in sorted(found.items())]